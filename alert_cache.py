@@ -0,0 +1,150 @@
+import logging
+import threading
+import time
+from datetime import datetime
+from pymongo.errors import OperationFailure
+from db import *
+
+
+class AlertCache(object):
+
+    collections = ('notificationsettings', 'usersettings', 'stocks')
+    operations = ('insert', 'update', 'replace', 'delete')
+
+    def __init__(self, reconcile_interval=600, poll_interval=5, poll_reconcile_interval=60):
+        self.reconcile_interval = reconcile_interval
+        self.poll_interval = poll_interval
+        self.poll_reconcile_interval = poll_reconcile_interval
+        self.notifications = {}
+        self.user_settings = {}
+        self.stocks = {}
+        self.users = {}
+        self.high_water = {}
+        self.last_reconcile = 0
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+        self.db = NotificationSetting._get_db()
+
+    def reconcile(self):
+        notifications = {x['_id']: x for x in self.db.notificationsettings.find(
+            {}, {'createdBy': True, 'stock': True, 'type': True, 'threshold': True, 'enabled': True,
+                 'window': True, 'longWindow': True, 'armed': True, 'updatedAt': True})}
+        user_settings = {x['_id']: x for x in self.db.usersettings.find(
+            {}, {'createdBy': True, 'notificationEnable': True, 'updatedAt': True})}
+        stocks = {x['_id']: x for x in self.db.stocks.find({}, {'symbol': True, 'updatedAt': True})}
+        users = {x['_id']: x['telegramUid'] for x in self.db.users.find({}, {'telegramUid': True})}
+        with self.lock:
+            self.notifications, self.user_settings, self.stocks, self.users = \
+                notifications, user_settings, stocks, users
+            for name, docs in zip(self.collections, (notifications, user_settings, stocks)):
+                stamps = [x['updatedAt'] for x in docs.values() if x.get('updatedAt') is not None]
+                self.high_water[name] = max(stamps + [self.high_water.get(name, datetime(1970, 1, 1))])
+            self.last_reconcile = time.time()
+        self.logger.debug('Alert cache reconciled with %d notifications.' % len(notifications))
+
+    def target(self, name):
+        return {'notificationsettings': self.notifications, 'usersettings': self.user_settings,
+                'stocks': self.stocks}[name]
+
+    def apply(self, name, operation, key, document=None):
+        with self.lock:
+            target = self.target(name)
+            if operation == 'delete':
+                target.pop(key, None)
+            elif document is not None:
+                target[key] = document
+                if document.get('updatedAt') is not None:
+                    self.high_water[name] = max(self.high_water.get(name, document['updatedAt']),
+                                                document['updatedAt'])
+
+    def resolve_users(self, users):
+        # Looked up outside the lock so that a new user does not stall sweep readers on a DB round trip.
+        found = {x['_id']: x['telegramUid'] for x in self.db.users.find({'_id': {'$in': list(users)}},
+                                                                         {'telegramUid': True})}
+        with self.lock:
+            self.users.update({x: found.get(x) for x in users})
+
+    def snapshot(self):
+        with self.lock:
+            enabled_users = {x['createdBy'] for x in self.user_settings.values() if x.get('notificationEnable')}
+            missing = enabled_users - set(self.users)
+        if len(missing) > 0:
+            self.resolve_users(missing)
+        with self.lock:
+            notifications = [x for x in self.notifications.values()
+                             if x.get('enabled') and x.get('createdBy') in enabled_users and x.get('stock') in self.stocks]
+            notifications = [{'id': x['_id'], 'user_id': self.users.get(x['createdBy']),
+                              'symbol': self.stocks[x['stock']].get('symbol'), 'type': x['type'],
+                              'threshold': x['threshold'], 'window': x.get('window'),
+                              'long_window': x.get('longWindow'), 'armed': x.get('armed', True)}
+                             for x in notifications]
+        return [x for x in notifications if x['user_id'] is not None]
+
+    def watch(self):
+        pipeline = [{'$match': {'$or': [{'ns.coll': {'$in': list(self.collections)}},
+                                        {'operationType': {'$in': ['invalidate', 'dropDatabase']}}]}}]
+        with self.db.watch(pipeline, full_document='updateLookup') as stream:
+            while stream.alive:
+                change = stream.try_next()
+                if change is not None and change['operationType'] not in self.operations:
+                    # drop, rename and invalidate events carry no document and end the stream: resync and reopen.
+                    self.logger.info('Alert change stream ended by %s event.' % change['operationType'])
+                    return
+                elif change is not None:
+                    self.apply(change['ns']['coll'], change['operationType'], change['documentKey']['_id'],
+                               change.get('fullDocument'))
+                elif time.time() - self.last_reconcile > self.reconcile_interval:
+                    self.reconcile()
+                else:
+                    time.sleep(0.5)
+
+    def poll_once(self):
+        for name in self.collections:
+            since = self.high_water.get(name, datetime(1970, 1, 1))
+            for document in self.db[name].find({'updatedAt': {'$gte': since}}):
+                self.apply(name, 'update', document['_id'], document)
+        # Polling only sees updates: alerts are removed by disabling them, and hard deletes are caught by
+        # reconciling more often than with change streams.
+        if time.time() - self.last_reconcile > self.poll_reconcile_interval:
+            self.reconcile()
+
+    def poll(self):
+        while True:
+            self.poll_once()
+            time.sleep(self.poll_interval)
+
+    def dump(self):
+        with self.lock:
+            return {'notifications': dict(self.notifications), 'user_settings': dict(self.user_settings),
+                    'stocks': dict(self.stocks), 'users': dict(self.users), 'high_water': dict(self.high_water)}
+
+    def restore(self, state):
+        with self.lock:
+            self.notifications = state['notifications']
+            self.user_settings = state['user_settings']
+            self.stocks = state['stocks']
+            self.users = state['users']
+            self.high_water = state['high_water']
+
+    def run(self):
+        while True:
+            try:
+                self.reconcile()
+                try:
+                    self.watch()
+                except OperationFailure as e:
+                    # Change streams need a replica set; a standalone mongod falls back to polling updatedAt.
+                    self.logger.info('Change streams unavailable, polling for alert changes. %s' % e)
+                    self.poll()
+            except Exception as e:
+                # The sync thread must outlive any error, otherwise sweeps silently serve a frozen cache.
+                self.logger.error('Alert cache sync failed. %s' % e)
+                time.sleep(self.poll_interval)
+
+    def start(self):
+        # A cache restored from a snapshot is served right away and reconciled by the sync thread.
+        if len(self.notifications) == 0:
+            self.reconcile()
+        thread = threading.Thread(target=self.run, daemon=True)
+        thread.start()
+        return thread
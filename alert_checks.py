@@ -0,0 +1,39 @@
+from quote_history import parse_price
+
+
+class AlertChecks(object):
+
+    # Threshold alerts evaluated against a quote string; each check returns the alert text or None.
+    @staticmethod
+    def price_change(notification):
+        if '(' in notification['quote']:
+            try:
+                percentage_change = abs(float(notification['quote'].split('(')[-1].split('%')[0]) / 100)
+            except ValueError:
+                percentage_change = 0
+            if percentage_change > notification['threshold']:
+                return 'Price change percentage for %s reached.' % notification['symbol']
+        return None
+
+    @staticmethod
+    def stop_loss(notification):
+        price = parse_price(notification['quote'])
+        price = float('inf') if price is None else price
+        if price < notification['threshold']:
+            return 'SL for %s reached.' % notification['symbol']
+        return None
+
+    @staticmethod
+    def take_profit(notification):
+        price = parse_price(notification['quote'])
+        price = - float('inf') if price is None else price
+        if price > notification['threshold']:
+            return 'TP for %s reached.' % notification['symbol']
+        return None
+
+    checks = {'priceChange': price_change.__func__, 'sl': stop_loss.__func__, 'tp': take_profit.__func__}
+
+    def evaluate(self, notification, quotes):
+        notification = [x for x in notification if x['type'] in self.checks and x['symbol'] in quotes]
+        contents = [self.checks[x['type']](dict(x, quote=quotes[x['symbol']])) for x in notification]
+        return [(x, y) for x, y in zip(notification, contents) if y is not None]
@@ -0,0 +1,98 @@
+import logging
+from datetime import datetime, timedelta
+from bson import ObjectId
+from pymongo import UpdateOne
+from db import *
+
+
+class AlertOutbox(object):
+
+    # A triggered alert is disabled and gets its delivery record in the same
+    # document update, so the transition and the outbox entry are atomic.
+    def __init__(self, max_attempts=10, lease=60, batch_size=100, retry_base=5, retry_cap=900):
+        self.max_attempts = max_attempts
+        self.lease = lease
+        self.retry_base = retry_base
+        self.retry_cap = retry_cap
+        self.batch_size = batch_size
+        self.collection = NotificationSetting._get_collection()
+        self.logger = logging.getLogger(__name__)
+
+    def enqueue(self, alerts, rearmable=False):
+        if len(alerts) == 0:
+            return 0
+        now = datetime.utcnow()
+        # Rolling alerts stay enabled and are disarmed instead; they are not re-queued over an undelivered alert.
+        if rearmable:
+            query = {'enabled': True, 'delivery.status': {'$nin': ['pending', 'sending']}}
+            transition = {'armed': False}
+        else:
+            query = {'enabled': True}
+            transition = {'enabled': False}
+        requests = [UpdateOne(dict(query, _id=x['id']), {'$set': dict(
+            transition,
+            updatedAt=now,
+            delivery={'telegramUid': x['user_id'], 'content': content, 'status': 'pending', 'attempts': 0,
+                      'triggeredAt': now, 'leaseUntil': now})}) for x, content in alerts]
+        result = self.collection.bulk_write(requests, ordered=False)
+        self.logger.debug('Alert outbox enqueued %d of %d alerts.' % (result.modified_count, len(alerts)))
+        return result.modified_count
+
+    def rearm(self, ids):
+        if len(ids) > 0:
+            self.collection.update_many({'_id': {'$in': ids}}, {'$set': {'armed': True, 'updatedAt': datetime.utcnow()}})
+
+    def backoff(self, attempts):
+        return min(self.retry_base * 2 ** max(attempts - 1, 0), self.retry_cap)
+
+    # A batch is claimed in three round trips: candidate ids, one update_many stamping a claim
+    # token and the lease, then the documents carrying that token.
+    def claim(self):
+        now = datetime.utcnow()
+        due = {'delivery.status': {'$in': ['pending', 'sending']}, 'delivery.leaseUntil': {'$lte': now}}
+        ids = [x['_id'] for x in self.collection.find(due, {'_id': True}).limit(self.batch_size)]
+        if len(ids) == 0:
+            return []
+        token = str(ObjectId())
+        self.collection.update_many(
+            dict(due, _id={'$in': ids}),
+            {'$set': {'delivery.status': 'sending', 'delivery.leaseUntil': now + timedelta(seconds=self.lease),
+                      'delivery.claim': token},
+             '$inc': {'delivery.attempts': 1}})
+        return list(self.collection.find({'delivery.claim': token}, {'delivery': True}))
+
+    def complete(self, ids):
+        self.collection.update_many({'_id': {'$in': ids}, 'delivery.status': 'sending'},
+                                    {'$set': {'delivery.status': 'sent', 'delivery.sentAt': datetime.utcnow()}})
+
+    def retry(self, alerts):
+        # Failed sends wait base * 2^(attempts - 1) seconds, capped, so an outage does not burn every attempt.
+        now = datetime.utcnow()
+        requests = [UpdateOne({'_id': x['_id'], 'delivery.status': 'sending'}, {'$set': {
+            'delivery.status': 'pending',
+            'delivery.leaseUntil': now + timedelta(seconds=self.backoff(x['delivery']['attempts']))}})
+            for x in alerts]
+        if len(requests) > 0:
+            self.collection.bulk_write(requests, ordered=False)
+
+    def fail(self, ids):
+        self.collection.update_many({'_id': {'$in': ids}}, {'$set': {'delivery.status': 'failed'}})
+
+    async def deliver(self, send):
+        claimed = self.claim()
+        # Duplicate alerts (same user and text) in one batch are sent once.
+        grouped = {}
+        for alert in claimed:
+            key = (alert['delivery']['telegramUid'], alert['delivery']['content'])
+            grouped.setdefault(key, []).append(alert)
+        for (user_id, content), alerts in grouped.items():
+            ids = [x['_id'] for x in alerts]
+            result = await send(content, user_id)
+            if result is not None:
+                self.complete(ids)
+            elif max(x['delivery']['attempts'] for x in alerts) >= self.max_attempts:
+                self.logger.error('Alert delivery to %s abandoned after %d attempts.' % (user_id, self.max_attempts))
+                self.fail(ids)
+            else:
+                self.retry(alerts)
+        return len(claimed)
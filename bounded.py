@@ -0,0 +1,16 @@
+from collections import OrderedDict
+
+
+class BoundedDict(OrderedDict):
+
+    # Least recently written entries are evicted once max_size is reached.
+    def __init__(self, max_size, *args, **kwargs):
+        self.max_size = max_size
+        super(BoundedDict, self).__init__(*args, **kwargs)
+
+    def __setitem__(self, key, value):
+        if key in self:
+            self.move_to_end(key)
+        super(BoundedDict, self).__setitem__(key, value)
+        while len(self) > self.max_size:
+            self.popitem(last=False)
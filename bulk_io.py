@@ -0,0 +1,145 @@
+import csv
+import io
+import logging
+import tempfile
+from datetime import datetime
+from pymongo.errors import BulkWriteError
+from db import *
+
+
+class BulkIO(object):
+
+    columns = ['type', 'symbol', 'unit_price', 'quantity', 'watchlist']
+
+    # Imports are parsed row by row from a file and written per batch: one Stock lookup for the
+    # batch's symbols, one insert_many for new Stock entries and one for the positions.
+    def __init__(self, symbol_index, watchlists, batch_size=1000, max_errors=20):
+        self.symbol_index = symbol_index
+        self.symbol_master = symbol_index.master
+        self.watchlists = watchlists
+        self.batch_size = batch_size
+        self.max_errors = max_errors
+        self.logger = logging.getLogger(__name__)
+
+    def rows(self, stream):
+        reader = csv.DictReader(io.TextIOWrapper(stream, encoding='utf-8-sig', newline=''))
+        if reader.fieldnames is None or 'symbol' not in reader.fieldnames:
+            raise ValueError('CSV header must contain %s' % ','.join(self.columns))
+        for row in reader:
+            yield reader.line_num, {k: (v or '').strip() for k, v in row.items() if k is not None}
+
+    def validate(self, row):
+        kind = row.get('type') or 'position'
+        if kind not in ('position', 'watchlist'):
+            return 'unknown type %s' % kind
+        if row.get('symbol', '') == '':
+            return 'missing symbol'
+        if kind == 'position':
+            try:
+                unit_price, quantity = float(row.get('unit_price')), int(float(row.get('quantity')))
+            except (TypeError, ValueError):
+                return 'invalid unit_price or quantity'
+            if unit_price <= 0 or quantity == 0:
+                return 'unit_price must be positive and quantity non-zero'
+        return None
+
+    def resolve(self, user, symbols, create):
+        # Symbols match whatever case they were stored with; nicknames are matched exactly afterwards.
+        stocks = {}
+        normalized = sorted({self.symbol_master.normalize(x) for x in symbols})
+        for x in Stock._get_collection().find(
+                {'createdBy': user, '$or': [{'nickname': {'$in': symbols}}, {'symbol': {'$in': normalized}}]},
+                {'symbol': 1, 'nickname': 1}, collation={'locale': 'en', 'strength': 2}):
+            stocks.setdefault(self.symbol_master.normalize(x['symbol']), x)
+            if x.get('nickname') in symbols:
+                stocks[x['nickname']] = x
+        # Positions on known symbols without a Stock entry get one; it has no nickname, so /nickname stays clean.
+        missing = sorted({self.symbol_master.normalize(x) for x in create if x not in stocks
+                          and self.symbol_index.is_known(x)} - set(stocks))
+        if len(missing) > 0:
+            now = datetime.utcnow()
+            documents = [{'createdBy': user, 'symbol': x, 'market': self.symbol_master.market(x), 'updatedAt': now}
+                         for x in missing]
+            try:
+                Stock._get_collection().insert_many(documents, ordered=False)
+            except BulkWriteError as e:
+                failed = {x['index'] for x in e.details.get('writeErrors', [])}
+                self.logger.error('Unable to create %d of %d stocks. %s' % (len(failed), len(documents), e))
+                documents = [x for i, x in enumerate(documents) if i not in failed]
+            for x in documents:
+                stocks[x['symbol']] = x
+        for x in symbols:
+            if x not in stocks and self.symbol_master.normalize(x) in stocks:
+                stocks[x] = stocks[self.symbol_master.normalize(x)]
+        return stocks
+
+    def write_batch(self, user, batch, report):
+        stocks = self.resolve(user, sorted({row['symbol'] for line, row in batch}),
+                              {row['symbol'] for line, row in batch if (row.get('type') or 'position') == 'position'})
+        positions, lines, watchlists = [], [], {}
+        for line, row in batch:
+            stock = stocks.get(row['symbol'])
+            if (row.get('type') or 'position') == 'position':
+                if stock is None:
+                    self.error(report, line, 'unknown symbol %s' % row['symbol'])
+                    continue
+                positions.append({'createdBy': user, 'stock': stock['_id'],
+                                  'unitPrice': Position.unitPrice.to_mongo(row['unit_price']),
+                                  'quantity': int(float(row['quantity']))})
+                lines.append(line)
+            elif stock is not None or self.symbol_index.is_known(row['symbol']):
+                symbol = stock['symbol'] if stock is not None else self.symbol_master.normalize(row['symbol'])
+                watchlists.setdefault(row.get('watchlist') or None, []).append(symbol)
+            else:
+                self.error(report, line, 'unknown symbol %s' % row['symbol'])
+        written = len(positions)
+        if len(positions) > 0:
+            try:
+                Position._get_collection().insert_many(positions, ordered=False)
+            except BulkWriteError as e:
+                written = e.details.get('nInserted', 0)
+                for x in e.details.get('writeErrors', []):
+                    self.error(report, lines[x['index']], x.get('errmsg', 'write failed'))
+        for name, symbols in watchlists.items():
+            self.watchlists.add(user, symbols, name)
+        report['positions'] += written
+        report['watchlist'] += sum(len(x) for x in watchlists.values())
+
+    def error(self, report, line, reason):
+        report['rejected'] += 1
+        if len(report['errors']) < self.max_errors:
+            report['errors'].append('line %d: %s' % (line, reason))
+
+    def import_csv(self, user, stream):
+        report = {'positions': 0, 'watchlist': 0, 'rejected': 0, 'errors': []}
+        batch = []
+        for line, row in self.rows(stream):
+            reason = self.validate(row)
+            if reason is not None:
+                self.error(report, line, reason)
+                continue
+            batch.append((line, row))
+            if len(batch) >= self.batch_size:
+                self.write_batch(user, batch, report)
+                batch = []
+        if len(batch) > 0:
+            self.write_batch(user, batch, report)
+        self.logger.info('Imported %d positions and %d watchlist symbols, rejected %d rows.' % (
+            report['positions'], report['watchlist'], report['rejected']))
+        return report
+
+    def export_csv(self, user):
+        output = tempfile.SpooledTemporaryFile(max_size=2 ** 20)
+        text = io.TextIOWrapper(output, encoding='utf-8', newline='', write_through=True)
+        writer = csv.writer(text)
+        writer.writerow(self.columns)
+        stocks = {x['_id']: x['symbol'] for x in Stock._get_collection().find({'createdBy': user}, {'symbol': 1})}
+        for x in Position._get_collection().find({'createdBy': user}, {'stock': 1, 'unitPrice': 1, 'quantity': 1}):
+            if x.get('stock') in stocks:
+                writer.writerow(['position', stocks[x['stock']], x['unitPrice'], x['quantity'], ''])
+        for x in Watchlist._get_collection().find({'createdBy': user}, {'name': 1, 'stockSymbols': 1}):
+            for symbol in x.get('stockSymbols', []):
+                writer.writerow(['watchlist', symbol, '', '', x.get('name', self.watchlists.default_name)])
+        text.detach()
+        output.seek(0)
+        return output
@@ -0,0 +1,54 @@
+import io
+import threading
+from collections import OrderedDict
+from datetime import datetime
+import numpy as np
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+
+
+class ChartRenderer(object):
+
+    def __init__(self, history, max_cached=256):
+        self.history = history
+        self.max_cached = max_cached
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+
+    def render(self, symbol, window):
+        bars = self.history.ohlc(symbol, window)
+        if bars is None:
+            return None
+        last_bar = tuple(float(bars[x][-1]) for x in ('time', 'open', 'high', 'low', 'close'))
+        key = (symbol, window, last_bar)
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+        image = self.draw(symbol, window, bars)
+        with self.lock:
+            self.cache[key] = image
+            while len(self.cache) > self.max_cached:
+                self.cache.popitem(last=False)
+        return image
+
+    @staticmethod
+    def draw(symbol, window, bars):
+        x = np.arange(len(bars['time']))
+        up = bars['close'] >= bars['open']
+        colors = np.where(up, 'tab:green', 'tab:red')
+        fig = Figure(figsize=(8, 4), dpi=100)
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot(1, 1, 1)
+        ax.vlines(x, bars['low'], bars['high'], colors=colors, linewidth=1)
+        body = np.where(bars['close'] == bars['open'], 1e-9, bars['close'] - bars['open'])
+        ax.bar(x, body, bottom=bars['open'], color=colors, width=0.6)
+        step = max(1, len(x) // 6)
+        ax.set_xticks(x[::step])
+        ax.set_xticklabels([datetime.utcfromtimestamp(t).strftime('%m-%d %H:%M') for t in bars['time'][::step]])
+        ax.set_title('%s (%s)' % (symbol, window))
+        ax.grid(alpha=0.3)
+        fig.autofmt_xdate()
+        buffer = io.BytesIO()
+        fig.savefig(buffer, format='png', bbox_inches='tight')
+        return buffer.getvalue()
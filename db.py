@@ -13,19 +13,26 @@ class User(Document):
 class UserSettings(Document):
     createdBy = ReferenceField(User)
     notificationEnable = BooleanField()
+    digestEnable = BooleanField()
+    updatedAt = DateTimeField()
     v = IntField(db_field='__v')
     meta = {
-        'collection': 'usersettings'
+        'collection': 'usersettings',
+        'indexes': [
+            'updatedAt'
+        ]
     }
 
 class Watchlist(Document):
     createdBy = ReferenceField(User)
+    name = StringField(default='default')
     stockSymbols = ListField(StringField())
     v = IntField(db_field='__v')
     meta = {
         'collection': 'watchlists',
         'indexes': [
-            'stockSymbols'
+            'stockSymbols',
+            {'fields': ['createdBy', 'name'], 'unique': True}
         ]
     }
 
@@ -34,13 +41,15 @@ class Stock(Document):
     symbol = StringField()
     nickname = StringField()
     market = StringField()
+    updatedAt = DateTimeField()
     v = IntField(db_field='__v')
     meta = {
         'collection': 'stocks',
         'indexes': [
             'symbol',
             'nickname',
-            'market'
+            'market',
+            'updatedAt'
         ]
     }
 
@@ -55,13 +64,56 @@ class Position(Document):
         'indexes': []
     }
 
+class AlertDelivery(EmbeddedDocument):
+    telegramUid = IntField()
+    content = StringField()
+    status = StringField(choices=('pending', 'sending', 'sent', 'failed'))
+    attempts = IntField(default=0)
+    triggeredAt = DateTimeField()
+    leaseUntil = DateTimeField()
+    claim = StringField()
+    sentAt = DateTimeField()
+
 class NotificationSetting(Document):
     createdBy = ReferenceField(User)
     stock = ReferenceField(Stock)
-    threshold = DecimalField()
-    type = StringField(choices=('sl', 'tp', 'priceChange'))
+    threshold = FloatField()
+    type = StringField(choices=('sl', 'tp', 'priceChange', 'move', 'maCross', 'band'))
+    window = IntField()
+    longWindow = IntField()
+    armed = BooleanField(default=True)
     enabled = BooleanField()
+    delivery = EmbeddedDocumentField(AlertDelivery)
+    updatedAt = DateTimeField()
     v = IntField(db_field='__v')
     meta = {
-        'collection': 'notificationsettings'
+        'collection': 'notificationsettings',
+        'indexes': [
+            ('delivery.status', 'delivery.leaseUntil'),
+            'delivery.claim',
+            'updatedAt'
+        ]
+    }
+
+class QuoteTick(Document):
+    symbol = StringField()
+    price = FloatField()
+    time = DateTimeField()
+    meta = {
+        'collection': 'quoteticks',
+        'indexes': [
+            ('symbol', 'time'),
+            {'fields': ['time'], 'expireAfterSeconds': 8 * 24 * 3600}
+        ]
+    }
+
+class SweepWorker(Document):
+    workerId = StringField(unique=True)
+    heartbeat = DateTimeField()
+    members = ListField(StringField())
+    meta = {
+        'collection': 'sweepworkers',
+        'indexes': [
+            {'fields': ['heartbeat'], 'expireAfterSeconds': 3600}
+        ]
     }
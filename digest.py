@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime
+from db import *
+
+
+class RateLimitedSender(object):
+
+    def __init__(self, send, rate=25):
+        self.send = send
+        self.rate = rate
+
+    async def send_all(self, messages, window=0):
+        if len(messages) == 0:
+            return 0
+        interval = max(float(window) / len(messages), 1.0 / self.rate)
+        start = time.time()
+        sent = 0
+        for i, (user_id, content) in enumerate(messages):
+            delay = start + i * interval - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            if await self.send(content, user_id) is not None:
+                sent += 1
+        return sent
+
+
+class DigestEngine(object):
+
+    labels = {'open': 'open', 'close': 'close'}
+
+    def __init__(self, scrapper, send, schedule=None, window=None, rate=25, scheduler=None, portfolio=None):
+        self.scrapper = scrapper
+        self.scheduler = scheduler
+        self.portfolio = portfolio
+        self.sender = RateLimitedSender(send, rate)
+        # Times are UTC, e.g. 'hk_open=01:30,hk_close=08:10'; adjust the US entries for daylight saving.
+        schedule = schedule or os.environ.get(
+            'DIGEST_SCHEDULE', 'hk_open=01:30,hk_close=08:10,us_open=13:30,us_close=20:10')
+        self.schedule = [tuple(x.split('=')) for x in schedule.split(',')]
+        self.window = window if window is not None else float(os.environ.get('DIGEST_WINDOW', 300))
+        self.fired = {}
+        self.logger = logging.getLogger(__name__)
+        # Events already past when the bot starts are not replayed.
+        self.due(datetime.utcnow())
+
+    def due(self, now):
+        events = []
+        for event, at in self.schedule:
+            hour, minute = [int(x) for x in at.split(':')]
+            if (now.hour, now.minute) >= (hour, minute) and self.fired.get(event) != now.date():
+                self.fired[event] = now.date()
+                # Weekends and exchange holidays are marked as fired without sending anything.
+                if self.scrapper.symbol_master.trading_day(event.split('_')[0], now.date()):
+                    events.append(event)
+        return events
+
+    def collect(self, market):
+        users = [x['createdBy'] for x in UserSettings._get_collection().find(
+            {'digestEnable': True}, {'createdBy': True})]
+        uids = {x['_id']: x['telegramUid'] for x in User._get_collection().find(
+            {'_id': {'$in': users}}, {'telegramUid': True})}
+        stocks = {x['_id']: x for x in Stock._get_collection().find(
+            {'createdBy': {'$in': users}}, {'createdBy': True, 'symbol': True, 'nickname': True})}
+        nicknames = {(x['createdBy'], x.get('nickname')): x['symbol'] for x in stocks.values()}
+        user_symbols = {x: [] for x in users}
+        for watchlist in Watchlist._get_collection().find({'createdBy': {'$in': users}},
+                                                          {'createdBy': True, 'stockSymbols': True}):
+            user_symbols[watchlist['createdBy']] += [nicknames.get((watchlist['createdBy'], x), x)
+                                                     for x in watchlist.get('stockSymbols', [])]
+        user_lots = {x: [] for x in users}
+        for position in Position._get_collection().find({'createdBy': {'$in': users}},
+                                                        {'createdBy': True, 'stock': True, 'unitPrice': True,
+                                                         'quantity': True}):
+            stock = stocks.get(position['stock'])
+            if stock is not None:
+                user_symbols[position['createdBy']].append(stock['symbol'])
+                if self.scrapper.symbol_master.market(stock['symbol']) == market:
+                    user_lots[position['createdBy']].append({
+                        'symbol': stock['symbol'], 'nickname': stock.get('nickname'),
+                        'unit_price': float(str(position['unitPrice'])), 'quantity': float(position['quantity'])})
+        market_symbols, market_lots = {}, {}
+        for user, symbols in user_symbols.items():
+            symbols = [x for x in dict.fromkeys(symbols) if self.scrapper.symbol_master.market(x) == market]
+            if len(symbols) > 0 and uids.get(user) is not None:
+                market_symbols[uids[user]] = symbols
+                market_lots[uids[user]] = user_lots[user]
+        return market_symbols, market_lots
+
+    async def fetch(self, symbols):
+        if self.scheduler is not None:
+            return await self.scheduler.report_quote('digest', symbols, weight=2, limited=False)
+        return await self.scrapper.report_quote(symbols)
+
+    async def pnl_line(self, lots, quotes):
+        # Valued from the digest's quotes; only FX pairs missing from them are fetched, once per event.
+        async def report_quote(symbols):
+            missing = [x for x in symbols if x not in quotes]
+            if len(missing) > 0:
+                quotes.update({k: v for x in await self.fetch(missing) for k, v in x.items()})
+            return [{x: quotes.get(x, 'Not available')} for x in symbols]
+        value = await self.portfolio.valuation(None, report_quote=report_quote, lots=lots)
+        if value is None:
+            return None
+        cost = value['total'] - value['total_pnl']
+        return 'Positions: %.2f %s, P&L %.2f %s (%.2f%%)' % (
+            value['total'], value['base_currency'], value['total_pnl'], value['base_currency'],
+            value['total_pnl'] / cost * 100 if cost != 0 else 0)
+
+    async def run_event(self, event):
+        market, label = event.split('_')
+        user_symbols, user_lots = self.collect(market)
+        unique = sorted({x for symbols in user_symbols.values() for x in symbols})
+        if len(unique) == 0:
+            return 0
+        quotes = {k: v for x in await self.fetch(unique) for k, v in x.items()}
+        messages = []
+        for user_id, symbols in user_symbols.items():
+            lines = ['%s %s digest' % (market.upper(), self.labels.get(label, label))] + [
+                '%s: %s' % (x, quotes.get(x, 'Not available')) for x in symbols]
+            if self.portfolio is not None and len(user_lots[user_id]) > 0:
+                pnl = await self.pnl_line(user_lots[user_id], quotes)
+                if pnl is not None:
+                    lines.append(pnl)
+            messages.append((user_id, '\n'.join(lines)))
+        self.logger.info('Digest %s: %d symbols for %d users.' % (event, len(unique), len(messages)))
+        return await self.sender.send_all(messages, self.window)
+
+    async def loop_digest(self):
+        while True:
+            for event in self.due(datetime.utcnow()):
+                try:
+                    await self.run_event(event)
+                except Exception as e:
+                    self.logger.error('Unable to send digest %s. %s' % (event, e))
+            await asyncio.sleep(30)
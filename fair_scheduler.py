@@ -0,0 +1,107 @@
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from bounded import BoundedDict
+
+
+class TokenBucket(object):
+
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.time()
+
+    def take(self, count):
+        now = time.time()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        taken = min(count, int(self.tokens))
+        self.tokens -= taken
+        return taken
+
+
+class FairScheduler(object):
+
+    # Scrape slots are shared by every event loop (bot handlers, sweep, digests) and handed out by
+    # deficit round robin across users, so a long request only ever holds its fair share of slots.
+    def __init__(self, scrapper, capacity=None, max_symbols=None, burst=None, rate=None, cache_age=900):
+        self.scrapper = scrapper
+        self.capacity = capacity or int(os.environ.get('SCRAPE_CAPACITY', 8))
+        self.max_symbols = max_symbols or int(os.environ.get('MAX_SYMBOLS_PER_REQUEST', 20))
+        self.burst = burst or float(os.environ.get('QUOTA_BURST', 40))
+        self.rate = rate or float(os.environ.get('QUOTA_RATE', 0.5))
+        self.cache_age = cache_age
+        self.buckets = BoundedDict(100000)
+        self.weights = {}
+        self.queues = OrderedDict()
+        self.deficit = {}
+        self.in_flight = 0
+        self.lock = threading.Lock()
+
+    def grant(self):
+        while self.in_flight < self.capacity and len(self.queues) > 0:
+            user, queue = next(iter(self.queues.items()))
+            self.deficit[user] = self.deficit.get(user, 0) + self.weights.get(user, 1)
+            while len(queue) > 0 and self.deficit[user] >= 1 and self.in_flight < self.capacity:
+                loop, future = queue.popleft()
+                self.deficit[user] -= 1
+                self.in_flight += 1
+                loop.call_soon_threadsafe(self.resolve, future)
+            if len(queue) == 0:
+                del self.queues[user]
+                self.deficit.pop(user, None)
+            else:
+                self.queues.move_to_end(user)
+
+    def resolve(self, future):
+        if future.done():
+            self.release()
+        else:
+            future.set_result(True)
+
+    def release(self):
+        with self.lock:
+            self.in_flight -= 1
+            self.grant()
+
+    async def fetch(self, user, symbols):
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        with self.lock:
+            self.queues.setdefault(user, deque()).append((loop, future))
+            self.grant()
+        await future
+        try:
+            return await self.scrapper.report_quote(symbols, record=False)
+        finally:
+            self.release()
+
+    def cached(self, symbol):
+        cached = self.scrapper.quote_cache.get(symbol)
+        if cached is not None and time.time() - cached[0] < self.cache_age:
+            return {symbol: '%s (cached)' % cached[1]}
+        return {symbol: 'Not available (quota exceeded)'}
+
+    async def report_quote(self, user, symbols, weight=None, limited=True):
+        symbols = [str(x) for x in dict.fromkeys(symbols)]
+        if weight is not None:
+            self.weights[user] = weight
+        if limited:
+            # Symbols past the per-request cap are answered like those over quota: from the cache, if at all.
+            with self.lock:
+                bucket = self.buckets.setdefault(user, TokenBucket(self.burst, self.rate))
+                allowed = bucket.take(min(len(symbols), self.max_symbols))
+        else:
+            allowed = len(symbols)
+        fetched, over_quota = symbols[:allowed], symbols[allowed:]
+        # Forex pairs share one API call, so they are scheduled as a single job.
+        forex = [x for x in fetched if self.scrapper.symbol_master.market(x) == 'forex']
+        jobs = [[x] for x in fetched if x not in forex] + ([forex] if len(forex) > 0 else [])
+        quotes = await asyncio.gather(*[self.fetch(user, x) for x in jobs])
+        quotes = [y for x in quotes for y in x]
+        # Jobs are scraped one symbol at a time but recorded and published together.
+        self.scrapper.record_quotes(quotes)
+        return quotes + [self.cached(x) for x in over_quota]
@@ -0,0 +1,78 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+import numpy as np
+
+
+class ForexEngine(object):
+
+    base_pairs = ['EUR/USD', 'GBP/USD', 'AUD/USD', 'NZD/USD', 'USD/JPY', 'USD/HKD', 'USD/CAD', 'USD/CHF',
+                  'USD/CNH', 'USD/SGD', 'XAU/USD', 'XAG/USD', 'BTC/USD', 'ETH/USD']
+
+    # One base set of USD pairs is fetched per interval and shared by all callers; any cross between
+    # currencies in the set is derived locally as usd[base] / usd[quote].
+    def __init__(self, scrapper, interval=None, pairs=None):
+        self.scrapper = scrapper
+        self.interval = interval or float(os.environ.get('FOREX_INTERVAL', 60))
+        self.pairs = pairs or self.base_pairs
+        self.usd = {'USD': 1.0}
+        self.fetched_at = 0
+        self.refreshing = False
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    @property
+    def age(self):
+        return time.time() - self.fetched_at if self.fetched_at > 0 else float('inf')
+
+    def update(self, page):
+        usd = {'USD': 1.0}
+        for quote in page:
+            symbol, price = quote['symbol'].upper(), float(quote['price'])
+            if price <= 0:
+                continue
+            if symbol.endswith('USD'):
+                usd[symbol[:-3]] = price
+            elif symbol.startswith('USD'):
+                usd[symbol[3:]] = 1 / price
+        self.usd = usd
+        self.fetched_at = time.time()
+
+    async def refresh(self, wait=5):
+        with self.lock:
+            start = not self.refreshing and self.age > self.interval
+            if start:
+                self.refreshing = True
+        if start:
+            try:
+                url = ','.join([x.replace('/', '') for x in self.pairs]).join(self.scrapper.forex_url) + \
+                    self.scrapper.one_forge_api
+                page = await self.scrapper.forex_api_fetch(url)
+                if page is not None:
+                    self.update(page)
+            finally:
+                self.refreshing = False
+        else:
+            # Another caller is refreshing; wait briefly only if there are no rates at all yet.
+            deadline = time.time() + wait
+            while self.refreshing and self.fetched_at == 0 and time.time() < deadline:
+                await asyncio.sleep(0.05)
+
+    def derive(self, symbols):
+        pairs = [x.upper().split('/') for x in symbols]
+        usd = self.usd
+        base = np.array([usd.get(x[0], np.nan) for x in pairs], dtype=np.float64)
+        quote = np.array([usd.get(x[-1], np.nan) for x in pairs], dtype=np.float64)
+        return base / quote
+
+    async def quotes(self, symbols):
+        await self.refresh()
+        rates = self.derive(symbols)
+        derived = {x: '%.6g' % y for x, y in zip(symbols, rates) if np.isfinite(y)}
+        direct = [x for x in symbols if x not in derived]
+        if self.age > 2 * self.interval:
+            self.logger.warning('Forex base rates are %.0fs stale.' % self.age)
+        self.logger.debug('Forex derived %d pairs, %d direct.' % (len(derived), len(direct)))
+        return derived, direct
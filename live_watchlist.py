@@ -0,0 +1,106 @@
+import asyncio
+import logging
+import os
+import threading
+import time
+
+
+class LiveWatchlist(object):
+
+    # All live messages are refreshed from one tick: the union of their symbols is quoted once,
+    # each message is re-rendered and only edited when its text changed and its chat is not throttled.
+    def __init__(self, scheduler, render, edit, interval=None, duration=None, edit_interval=3, rate=25,
+                 max_sessions=5000, unpin=None):
+        self.scheduler = scheduler
+        self.render = render
+        self.edit = edit
+        self.unpin = unpin
+        self.interval = interval if interval is not None else float(os.environ.get('LIVE_INTERVAL', 15))
+        self.duration = duration if duration is not None else float(os.environ.get('LIVE_DURATION', 600))
+        self.edit_interval = edit_interval
+        self.rate = rate
+        self.max_sessions = max_sessions
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    async def start(self, chat_id, message_id, symbols, labels, text):
+        # A new live watchlist replaces the chat's running one, whose message is left unpinned.
+        replaced = self.stop(chat_id)
+        if replaced is not None and self.unpin is not None:
+            try:
+                await self.unpin(chat_id, replaced['message_id'])
+            except Exception as e:
+                self.logger.error('Unable to unpin live watchlist in %s. %s' % (chat_id, e))
+        with self.lock:
+            if chat_id not in self.sessions and len(self.sessions) >= self.max_sessions:
+                return None
+            self.sessions[chat_id] = {'message_id': message_id, 'symbols': symbols, 'labels': labels, 'text': text,
+                                      'expires': time.time() + self.duration, 'edited': time.time()}
+        return self.sessions[chat_id]['expires']
+
+    def stop(self, chat_id):
+        with self.lock:
+            return self.sessions.pop(chat_id, None)
+
+    async def quotes(self, symbols):
+        # Quotes another task fetched within the tick are reused rather than scraped again.
+        now = time.time()
+        cache = self.scheduler.scrapper.quote_cache
+        cached = {x: cache.get(x) for x in symbols}
+        fresh = {x: y[1] for x, y in cached.items() if y is not None and now - y[0] < self.interval}
+        stale = [x for x in symbols if x not in fresh]
+        if len(stale) > 0:
+            fetched = await self.scheduler.report_quote('live', stale, weight=2, limited=False)
+            fresh.update({k: v for x in fetched for k, v in x.items()})
+        return fresh
+
+    async def paced_edit(self, index, chat_id, session):
+        # Edits across chats are spread out to stay under the bot-wide message rate.
+        await asyncio.sleep(float(index) / self.rate)
+        return await self.edit(chat_id, session['message_id'], session['text'])
+
+    async def tick(self):
+        now = time.time()
+        with self.lock:
+            sessions = list(self.sessions.items())
+            for chat_id, session in sessions:
+                if now >= session['expires']:
+                    del self.sessions[chat_id]
+        if len(sessions) == 0:
+            return 0
+        quotes = await self.quotes(sorted({y for chat_id, session in sessions for y in session['symbols']}))
+        edits = []
+        for chat_id, session in sessions:
+            expired = now >= session['expires']
+            if not expired and now - session['edited'] < self.edit_interval:
+                continue
+            text = self.render([{x: quotes[x]} for x in session['symbols'] if x in quotes], session['labels'])
+            text += '\nLive updates ended.' if expired else '\nLive until %s UTC' % time.strftime(
+                '%H:%M', time.gmtime(session['expires']))
+            if text == session['text']:
+                continue
+            session['text'], session['edited'] = text, now
+            edits.append((chat_id, session))
+        results = await asyncio.gather(*[self.paced_edit(i, chat_id, session)
+                                         for i, (chat_id, session) in enumerate(edits)], return_exceptions=True)
+        for (chat_id, session), retry_after in zip(edits, results):
+            # Telegram asks for a pause on this chat; hold its edits until then.
+            if isinstance(retry_after, (int, float)) and retry_after > 0:
+                session['edited'] = now + retry_after
+            elif isinstance(retry_after, Exception):
+                self.logger.error('Unable to edit live watchlist in %s. %s' % (chat_id, retry_after))
+        if self.unpin is not None:
+            await asyncio.gather(*[self.unpin(chat_id, session['message_id']) for chat_id, session in sessions
+                                   if now >= session['expires']], return_exceptions=True)
+        self.logger.debug('Live tick: %d sessions, %d symbols, %d edits.' % (len(sessions), len(quotes), len(edits)))
+        return len(edits)
+
+    async def loop_live(self):
+        while True:
+            start = time.time()
+            try:
+                await self.tick()
+            except Exception as e:
+                self.logger.error('Live watchlist tick failed. %s' % e)
+            await asyncio.sleep(max(self.interval - (time.time() - start), 1))
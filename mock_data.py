@@ -0,0 +1,156 @@
+import asyncio
+import os
+import sys
+import time
+from datetime import datetime
+import numpy as np
+from bson import ObjectId
+from db import *
+from fair_scheduler import FairScheduler
+from quote_history import parse_price
+from snapshot import Snapshot
+from stock_scrapper import StockScrapper
+from symbol_master import SymbolMaster
+
+# Populates a local MongoDB with a reproducible synthetic user base:
+#   python mock_data.py [users] [seed]
+# MOCK_SYMBOLS sets the symbol universe size, MOCK_RESET=1 removes previously generated data first.
+# Thresholds are set around seeded log-normal prices. MOCK_LIVE_PRICES=1 sets them around the bot's snapshot quotes,
+# then live quotes instead, which trades reproducibility for realistic trigger rates.
+
+EPOCH = 0x5e0be100
+UID_BASE = 9 * 10 ** 9
+
+
+class MockData(object):
+
+    collections = [(1, User), (2, UserSettings), (3, Stock), (4, Watchlist), (5, Position), (6, NotificationSetting)]
+
+    def __init__(self, users, seed=42, symbols=2000, zipf=1.1, batch_size=5000):
+        self.users = users
+        self.rng = np.random.RandomState(seed)
+        self.batch_size = batch_size
+        self.universe = self.symbol_universe(symbols)
+        # Popularity follows a Zipf law over a seeded shuffle of the universe.
+        rank = np.arange(1, len(self.universe) + 1, dtype=np.float64)
+        self.popularity = rank ** -zipf / np.sum(rank ** -zipf)
+        self.rng.shuffle(self.universe)
+        self.prices = np.round(np.exp(self.rng.normal(3, 1.2, len(self.universe))), 2)
+        self.counters = {kind: 0 for kind, model in self.collections}
+        self.pending = {model: [] for kind, model in self.collections}
+        self.inserted = {model: 0 for kind, model in self.collections}
+
+    def symbol_universe(self, size):
+        master = SymbolMaster()
+        symbols = [x.symbol for x in master if x.market != 'forex']
+        # Pad with HK codes, which the master classifies by shape.
+        code = 1
+        while len(symbols) < size:
+            if master.get(str(code)) is None:
+                symbols.append(str(code))
+            code += 1
+        self.master = master
+        return symbols[:size]
+
+    # ObjectIds from a fixed timestamp and a per-collection counter keep references reproducible.
+    def object_id(self, kind):
+        self.counters[kind] += 1
+        return ObjectId('%08x%04x%012x' % (EPOCH, kind, self.counters[kind]))
+
+    def add(self, kind, model, document):
+        document['_id'] = self.object_id(kind)
+        self.pending[model].append(document)
+        if len(self.pending[model]) >= self.batch_size:
+            self.flush(model)
+        return document['_id']
+
+    def flush(self, model):
+        if len(self.pending[model]) > 0:
+            model._get_collection().insert_many(self.pending[model], ordered=False)
+            self.inserted[model] += len(self.pending[model])
+            self.pending[model] = []
+
+    def user(self, index, now):
+        user = self.add(1, User, {'telegramUid': UID_BASE + index, 'name': 'user%d' % index})
+        self.add(2, UserSettings, {'createdBy': user, 'notificationEnable': bool(self.rng.rand() < 0.8),
+                                   'digestEnable': bool(self.rng.rand() < 0.3), 'updatedAt': now})
+        count = min(1 + self.rng.poisson(8), len(self.universe))
+        picks = self.rng.choice(len(self.universe), count, replace=False, p=self.popularity)
+        watchlists = {'default': []}
+        for pick in picks:
+            symbol, price = self.universe[pick], self.prices[pick]
+            nickname = symbol if self.rng.rand() < 0.5 else '%s%d' % (self.master.market(symbol), pick)
+            stock = self.add(3, Stock, {'createdBy': user, 'symbol': symbol, 'nickname': nickname,
+                                        'market': self.master.market(symbol), 'updatedAt': now})
+            name = 'default' if self.rng.rand() < 0.8 else 'trading'
+            watchlists.setdefault(name, []).append(symbol)
+            if self.rng.rand() < 0.5:
+                lot = self.master.resolve(symbol).lot_size
+                self.add(5, Position, {'createdBy': user, 'stock': stock,
+                                       'unitPrice': round(float(price * (1 + self.rng.normal(0, 0.1))), 2),
+                                       'quantity': int(lot * self.rng.randint(1, 20))})
+            for kind in ('sl', 'tp', 'priceChange'):
+                if self.rng.rand() < 0.3:
+                    self.add(6, NotificationSetting, {
+                        'createdBy': user, 'stock': stock, 'type': kind, 'threshold': self.threshold(kind, price),
+                        'armed': True, 'enabled': True, 'updatedAt': now})
+        for name, symbols in watchlists.items():
+            if symbols:
+                self.add(4, Watchlist, {'createdBy': user, 'name': name, 'stockSymbols': symbols})
+
+    def threshold(self, kind, price):
+        # Stops and targets sit a few percent around the reference price, so a share of them trigger.
+        if kind == 'sl':
+            return round(float(price * (1 - self.rng.uniform(0.01, 0.15))), 2)
+        elif kind == 'tp':
+            return round(float(price * (1 + self.rng.uniform(0.01, 0.15))), 2)
+        return round(float(self.rng.uniform(0.01, 0.08)), 4)
+
+    def reference_prices(self, quote_cache=None, report_quote=None):
+        # Stops and targets are only meaningful around real prices; synthetic ones are kept for what can't be quoted.
+        prices = {x: parse_price(y) for x, (t, y) in (quote_cache or {}).items()}
+        missing = [x for x in self.universe if not prices.get(x)]
+        if len(missing) > 0 and report_quote is not None:
+            try:
+                quotes = asyncio.get_event_loop().run_until_complete(report_quote(missing))
+                prices.update({k: parse_price(v) for x in quotes for k, v in x.items()})
+            except Exception as e:
+                print('Unable to quote %d symbols, using synthetic prices. %s' % (len(missing), e))
+        found = 0
+        for index, symbol in enumerate(self.universe):
+            if prices.get(symbol):
+                self.prices[index] = prices[symbol]
+                found += 1
+        return found
+
+    def run(self):
+        now = datetime.utcnow()
+        for index in range(self.users):
+            self.user(index, now)
+        for kind, model in self.collections:
+            self.flush(model)
+        return self.inserted
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 42
+    if os.environ.get('MOCK_RESET'):
+        for kind, model in MockData.collections:
+            model._get_collection().delete_many({'_id': {'$gte': ObjectId('%08x%016x' % (EPOCH, 0)),
+                                                         '$lt': ObjectId('%08x%016x' % (EPOCH + 1, 0))}})
+    start = time.time()
+    mock = MockData(users, seed, int(os.environ.get('MOCK_SYMBOLS', 2000)))
+    if os.environ.get('MOCK_LIVE_PRICES'):
+        state = Snapshot().load()
+        scheduler = FairScheduler(StockScrapper(mock.master, persist_history=False))
+        found = mock.reference_prices(state['quote_cache'] if state is not None else None,
+                                      lambda x: scheduler.report_quote('mock', x, limited=False))
+        print('Reference prices for %d of %d symbols' % (found, len(mock.universe)))
+    inserted = mock.run()
+    print('Inserted %s in %.1fs' % (', '.join('%d %s' % (v, k._get_collection_name()) for k, v in inserted.items()),
+                                    time.time() - start))
+
+
+if __name__ == '__main__':
+    main()
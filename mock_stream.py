@@ -0,0 +1,56 @@
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from aiohttp import web
+
+# Local websocket stand-in for QUOTE_STREAM_URL=ws://localhost:8765/ticks
+# Usage: python mock_stream.py [ticks.jsonl] [ticks_per_second]
+# Replays recorded ticks (one JSON object per line) in a loop, or a random walk when no file is given.
+
+
+def recorded_ticks(path):
+    with open(path) as f:
+        ticks = [json.loads(x) for x in f if len(x.strip()) > 0]
+    while True:
+        for tick in ticks:
+            yield tick
+
+
+def random_ticks(symbols=('700', '5', 'AAPL', 'NVDA', 'EUR/USD')):
+    prices = {x: 100.0 for x in symbols}
+    while True:
+        symbol = random.choice(symbols)
+        prices[symbol] *= 1 + random.gauss(0, 0.001)
+        yield {'symbol': symbol, 'price': round(prices[symbol], 4)}
+
+
+def make_app(source, rate):
+    # source is called once per connection and returns a tick generator.
+    async def ticks_handler(request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        ticks = source()
+        batch = max(1, int(rate / 100))
+        start, sent = time.time(), 0
+        while not ws.closed:
+            try:
+                await ws.send_str(json.dumps([next(ticks) for _ in range(batch)]))
+            except ConnectionResetError:
+                break
+            sent += batch
+            delay = start + sent / rate - time.time()
+            await asyncio.sleep(max(delay, 0))
+        return ws
+
+    app = web.Application()
+    app.router.add_get('/ticks', ticks_handler)
+    return app
+
+
+if __name__ == '__main__':
+    app = make_app(lambda: recorded_ticks(sys.argv[1]) if len(sys.argv) > 1 else random_ticks(),
+                   float(sys.argv[2]) if len(sys.argv) > 2 else 1000)
+    web.run_app(app, port=int(os.environ.get('MOCK_STREAM_PORT', 8765)))
@@ -0,0 +1,62 @@
+import os
+import numpy as np
+from db import *
+from quote_history import parse_price
+
+
+class Portfolio(object):
+
+    def __init__(self, scrapper, base_currency=None):
+        self.scrapper = scrapper
+        self.base_currency = (base_currency or os.environ.get('BASE_CURRENCY', 'HKD')).upper()
+
+    def currency(self, symbol):
+        info = self.scrapper.symbol_master.resolve(symbol)
+        return info.currency if info is not None else self.base_currency
+
+    @staticmethod
+    def load_lots(user_id):
+        positions = list(Position.objects(createdBy=user_id).only('stock', 'unitPrice', 'quantity').as_pymongo())
+        stocks = Stock.objects(id__in=list({x['stock'] for x in positions})).only('symbol', 'nickname')
+        stocks = {x.id: x for x in stocks}
+        positions = [x for x in positions if x['stock'] in stocks]
+        return [{'symbol': stocks[x['stock']].symbol, 'nickname': stocks[x['stock']].nickname or stocks[x['stock']].symbol,
+                 'unit_price': float(str(x['unitPrice'])), 'quantity': float(x['quantity'])} for x in positions]
+
+    @staticmethod
+    def aggregate(lots):
+        symbols, index = np.unique([x['symbol'] for x in lots], return_inverse=True)
+        quantity = np.bincount(index, weights=[x['quantity'] for x in lots], minlength=len(symbols))
+        cost = np.bincount(index, weights=[x['unit_price'] * x['quantity'] for x in lots], minlength=len(symbols))
+        nicknames = {x['symbol']: x['nickname'] for x in lots}
+        with np.errstate(divide='ignore', invalid='ignore'):
+            unit_cost = np.where(quantity != 0, cost / quantity, np.nan)
+        return [str(x) for x in symbols], [nicknames[x] for x in symbols], quantity, unit_cost
+
+    async def valuation(self, user_id, symbol=None, report_quote=None, lots=None):
+        lots = self.load_lots(user_id) if lots is None else lots
+        if symbol is not None:
+            lots = [x for x in lots if symbol in (x['symbol'], x['nickname'])]
+        if len(lots) == 0:
+            return None
+        symbols, nicknames, quantity, unit_cost = self.aggregate(lots)
+        currencies = [self.currency(x) for x in symbols]
+        fx_pairs = sorted({'%s/%s' % (x, self.base_currency) for x in currencies if x != self.base_currency})
+        report_quote = report_quote or self.scrapper.report_quote
+        quotes = await report_quote(symbols + fx_pairs)
+        quotes = {k: v for x in quotes for k, v in x.items()}
+        price = np.array([parse_price(quotes.get(x)) for x in symbols], dtype=np.float64)
+        fx = np.array([1.0 if x == self.base_currency else parse_price(quotes.get('%s/%s' % (x, self.base_currency)))
+                       for x in currencies], dtype=np.float64)
+        market_value = price * quantity * fx
+        pnl = market_value - unit_cost * quantity * fx
+        with np.errstate(divide='ignore', invalid='ignore'):
+            percent = (price / unit_cost - 1) * 100
+            total = np.nansum(market_value)
+            weight = market_value / total * 100 if total != 0 else np.full(len(symbols), np.nan)
+        return {
+            'symbol': symbols, 'nickname': nicknames, 'currency': currencies, 'quantity': quantity,
+            'unit_cost': unit_cost, 'price': price, 'market_value': market_value, 'pnl': pnl,
+            'percent': percent, 'weight': weight, 'total': total, 'total_pnl': np.nansum(pnl),
+            'base_currency': self.base_currency
+        }
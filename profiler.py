@@ -0,0 +1,134 @@
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+
+class SamplingProfiler(object):
+
+    # Samples one thread's stack from a side thread; cost is bounded by the interval and max_samples.
+    # Sampling only runs between resume and pause, so idle time between profiled sections is not recorded.
+    def __init__(self, thread_id, interval=0.005, max_samples=60000):
+        self.thread_id = thread_id
+        self.interval = max(interval, 0.001)
+        self.max_samples = max_samples
+        self.stacks = Counter()
+        self.samples = 0
+        self.elapsed = 0.0
+        self.resumed = None
+        self.running = threading.Event()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    @staticmethod
+    def label(frame):
+        code = frame.f_code
+        return '%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+    def sample(self):
+        while not self.stopped.is_set() and self.samples < self.max_samples:
+            if not self.running.wait(0.1):
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(self.label(frame))
+                frame = frame.f_back
+            if len(stack) > 0:
+                self.stacks[';'.join(reversed(stack))] += 1
+                self.samples += 1
+            time.sleep(self.interval)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+
+    def resume(self, thread_id=None):
+        self.thread_id = thread_id or self.thread_id
+        self.resumed = time.time()
+        self.running.set()
+
+    def pause(self):
+        if self.running.is_set():
+            self.running.clear()
+            self.elapsed += time.time() - self.resumed
+
+    def stop(self):
+        self.pause()
+        self.stopped.set()
+        self.thread.join()
+
+    def folded(self):
+        return '\n'.join('%s %d' % (x, y) for x, y in sorted(self.stacks.items())) + '\n'
+
+    def top(self, n=15):
+        own, total = Counter(), Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(';')
+            own[frames[-1]] += count
+            for frame in set(frames):
+                total[frame] += count
+        samples = max(self.samples, 1)
+        lines = ['%d samples over %.1fs' % (self.samples, self.elapsed), 'self%  total%  function']
+        lines += ['%5.1f  %6.1f  %s' % (y * 100.0 / samples, total[x] * 100.0 / samples, x) for x, y in own.most_common(n)]
+        return '\n'.join(lines)
+
+
+class ProfileControl(object):
+
+    def __init__(self, output_dir=None, interval=None, targets=None):
+        self.output_dir = output_dir or os.environ.get('PROFILE_DIR', 'profiles')
+        self.interval = interval or float(os.environ.get('PROFILE_INTERVAL', 0.005))
+        self.targets = targets
+        self.pending = {}
+        self.active = {}
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+
+    def request(self, target, iterations, callback=None):
+        if self.targets is not None and target not in self.targets:
+            raise ValueError('unknown profile target %s' % target)
+        with self.lock:
+            self.pending[target] = [iterations, callback]
+
+    def write(self, target, profiler):
+        os.makedirs(self.output_dir, exist_ok=True)
+        path = os.path.join(self.output_dir, '%s-%s' % (target, time.strftime('%Y%m%d-%H%M%S')))
+        summary = profiler.top()
+        with open(path + '.folded', 'w') as f:
+            f.write(profiler.folded())
+        with open(path + '.txt', 'w') as f:
+            f.write(summary + '\n')
+        self.logger.info('Profile for %s written to %s.folded' % (target, path))
+        return path, summary
+
+    @contextmanager
+    def section(self, target):
+        with self.lock:
+            request = self.pending.get(target)
+            if request is not None:
+                if target not in self.active:
+                    self.active[target] = SamplingProfiler(threading.get_ident(), self.interval)
+                    self.active[target].start()
+                self.active[target].resume(threading.get_ident())
+        try:
+            yield
+        finally:
+            if request is not None:
+                with self.lock:
+                    profiler = self.active.get(target)
+                    if profiler is not None:
+                        profiler.pause()
+                    request[0] -= 1
+                    done = request[0] <= 0
+                    if done:
+                        self.pending.pop(target, None)
+                        profiler = self.active.pop(target, None)
+                if done and profiler is not None:
+                    profiler.stop()
+                    path, summary = self.write(target, profiler)
+                    if request[1] is not None:
+                        request[1](path, summary)
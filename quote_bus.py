@@ -0,0 +1,73 @@
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+
+class Subscription(object):
+
+    # Pending ticks are conflated per symbol, so a slow consumer holds at most one tick per symbol. A newer
+    # tick keeps the symbol's place in the queue; moving it to the back would starve symbols that tick constantly.
+    def __init__(self, bus, symbols):
+        self.bus = bus
+        self.symbols = set(symbols)
+        self.loop = asyncio.get_event_loop()
+        self.pending = OrderedDict()
+        self.event = asyncio.Event()
+
+    def push(self, symbol, tick):
+        self.pending[symbol] = tick
+        self.event.set()
+
+    async def get(self):
+        while len(self.pending) == 0:
+            self.event.clear()
+            await self.event.wait()
+        return self.pending.popitem(last=False)
+
+    def drain(self):
+        ticks = list(self.pending.items())
+        self.pending.clear()
+        return ticks
+
+    def close(self):
+        self.bus.unsubscribe(self)
+
+
+class QuoteBus(object):
+
+    wildcard = '*'
+
+    def __init__(self):
+        self.subscribers = {}
+        self.published = 0
+        self.lock = threading.Lock()
+
+    def subscribe(self, symbols=None):
+        subscription = Subscription(self, symbols or [self.wildcard])
+        with self.lock:
+            for symbol in subscription.symbols:
+                self.subscribers.setdefault(symbol, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            for symbol in subscription.symbols:
+                self.subscribers.get(symbol, set()).discard(subscription)
+                if len(self.subscribers.get(symbol, ())) == 0:
+                    self.subscribers.pop(symbol, None)
+
+    def publish(self, symbol, quote, timestamp=None):
+        tick = (timestamp or time.time(), quote)
+        with self.lock:
+            subscriptions = list(self.subscribers.get(symbol, ())) + list(self.subscribers.get(self.wildcard, ()))
+            self.published += 1
+        try:
+            running = asyncio.get_event_loop()
+        except RuntimeError:
+            running = None
+        for subscription in subscriptions:
+            if subscription.loop is running:
+                subscription.push(symbol, tick)
+            elif not subscription.loop.is_closed():
+                subscription.loop.call_soon_threadsafe(subscription.push, symbol, tick)
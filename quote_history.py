@@ -0,0 +1,126 @@
+import re
+import threading
+import time
+from datetime import datetime
+import numpy as np
+from bounded import BoundedDict
+from db import *
+
+
+# Quotes are 'price,change(percent)'; the price itself may carry thousands separators, e.g. '1,234.56,+1.2(+0.1%)'.
+PRICE = re.compile(r'^\s*\$?(\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d*\.?\d+)(?:,|\s|$)')
+
+
+def parse_price(quote):
+    match = PRICE.match(str(quote))
+    if match is None:
+        return None
+    return float(match.group(1).replace(',', ''))
+
+
+def parse_change(quote):
+    match = PRICE.match(str(quote))
+    if match is None:
+        return None
+    try:
+        return float(str(quote)[match.end():].split('(')[0].replace(',', ''))
+    except ValueError:
+        return None
+
+
+class TickRing(object):
+
+    # Fixed-size ring of (time, price) at a minimum resolution; a tick in the same slot replaces the last one.
+    # append returns the previous slot's final tick once a new slot opens, i.e. when that slot is complete.
+    def __init__(self, size, resolution):
+        self.resolution = resolution
+        self.times = np.zeros(size, dtype=np.float64)
+        self.prices = np.zeros(size, dtype=np.float64)
+        self.start = 0
+        self.count = 0
+
+    def append(self, timestamp, price):
+        size = len(self.times)
+        last = (self.start + self.count - 1) % size
+        if self.count > 0 and timestamp // self.resolution == self.times[last] // self.resolution:
+            self.times[last], self.prices[last] = timestamp, price
+            return None
+        closed = (self.times[last], self.prices[last]) if self.count > 0 else None
+        if self.count == size:
+            self.start = (self.start + 1) % size
+        else:
+            self.count += 1
+        position = (self.start + self.count - 1) % size
+        self.times[position], self.prices[position] = timestamp, price
+        return closed
+
+    def data(self):
+        index = (self.start + np.arange(self.count)) % len(self.times)
+        return self.times[index], self.prices[index]
+
+
+class QuoteHistory(object):
+
+    # window name -> (lookback seconds, bar seconds)
+    windows = {'1d': (24 * 3600, 3600), '1w': (7 * 24 * 3600, 6 * 3600)}
+
+    # Memory keeps one day per symbol at one-minute resolution for a bounded number of symbols;
+    # anything older is read back from the quoteticks collection.
+    def __init__(self, max_ticks=1440, resolution=60, max_symbols=2000, persist=True):
+        self.max_ticks = max_ticks
+        self.resolution = resolution
+        self.persist = persist
+        self.ticks = BoundedDict(max_symbols)
+        self.lock = threading.Lock()
+
+    def record(self, quotes, timestamp=None):
+        timestamp = time.time() if timestamp is None else timestamp
+        records = []
+        with self.lock:
+            for symbol, quote in quotes.items():
+                price = parse_price(quote)
+                if price is None:
+                    continue
+                if symbol not in self.ticks:
+                    self.ticks[symbol] = TickRing(self.max_ticks, self.resolution)
+                closed = self.ticks[symbol].append(timestamp, price)
+                # Streams record every second; only each completed slot is written, at the memory resolution.
+                if self.persist and closed is not None:
+                    records.append(QuoteTick(symbol=symbol, price=float(closed[1]),
+                                             time=datetime.utcfromtimestamp(closed[0])))
+        if len(records) > 0:
+            QuoteTick.objects.insert(records, load_bulk=False)
+
+    def load(self, symbol, since, until):
+        stored = QuoteTick.objects(Q(symbol=symbol) & Q(time__gte=datetime.utcfromtimestamp(since)) & Q(
+            time__lt=datetime.utcfromtimestamp(until))).order_by('time').only('time', 'price').as_pymongo()
+        stored = [((x['time'] - datetime(1970, 1, 1)).total_seconds(), x['price']) for x in stored]
+        data = np.array(stored, dtype=np.float64).reshape(-1, 2)
+        return data[:, 0], data[:, 1]
+
+    def series(self, symbol, since):
+        with self.lock:
+            ring = self.ticks.get(symbol)
+            times, prices = ring.data() if ring is not None else (np.zeros(0), np.zeros(0))
+        first = times[0] if len(times) > 0 else time.time()
+        if self.persist and first > since + self.resolution:
+            older_times, older_prices = self.load(symbol, since, first)
+            times, prices = np.r_[older_times, times], np.r_[older_prices, prices]
+        keep = times >= since
+        return times[keep], prices[keep]
+
+    def ohlc(self, symbol, window):
+        lookback, bar = self.windows[window]
+        times, prices = self.series(symbol, time.time() - lookback)
+        if len(prices) == 0:
+            return None
+        bars = (times // bar).astype(np.int64)
+        starts = np.flatnonzero(np.r_[True, bars[1:] != bars[:-1]])
+        ends = np.r_[starts[1:], len(prices)] - 1
+        return {
+            'time': bars[starts] * bar,
+            'open': prices[starts],
+            'high': np.maximum.reduceat(prices, starts),
+            'low': np.minimum.reduceat(prices, starts),
+            'close': prices[ends]
+        }
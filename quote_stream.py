@@ -0,0 +1,111 @@
+import asyncio
+import json
+import logging
+import time
+import aiohttp
+from bounded import BoundedDict
+from quote_history import parse_change, parse_price
+
+
+class QuoteStream(object):
+
+    # Ticks are JSON objects (or lists of them) with symbol, price and optional change/percent,
+    # received as websocket messages or as SSE 'data:' lines.
+    def __init__(self, url, bus, scrapper, flush_interval=1, max_backoff=60):
+        self.url = url
+        self.bus = bus
+        self.scrapper = scrapper
+        self.flush_interval = flush_interval
+        self.max_backoff = max_backoff
+        self.buffer = {}
+        self.received = 0
+        self.closes = BoundedDict(20000)
+        self.logger = logging.getLogger(__name__)
+
+    def previous_close(self, tick):
+        symbol = tick['symbol']
+        known = self.closes.get(symbol)
+        if tick.get('prev_close') is not None:
+            return float(tick['prev_close'])
+        # Otherwise the close is derived from the last polled quote as price - change; it is re-derived only
+        # when the cache holds a quote this stream did not emit, i.e. a newer poll.
+        cached = self.scrapper.quote_cache.get(symbol)
+        if cached is None or '(' not in cached[1] or (known is not None and known[1] == cached[1]):
+            return known[0] if known is not None else None
+        price, change = parse_price(cached[1]), parse_change(cached[1])
+        if price is None or change is None or price - change <= 0:
+            return known[0] if known is not None else None
+        return price - change
+
+    @staticmethod
+    def format_quote(tick, close=None):
+        quote = str(tick['price'])
+        change, percent = tick.get('change'), tick.get('percent')
+        if change is None and close is not None:
+            # The change keeps the price's decimals, so price - change gives back the same close on re-derivation.
+            decimals = min(max(len(quote.partition('.')[2]), 2), 6)
+            change = round(float(tick['price']) - close, decimals)
+            change, percent = '%+.*f' % (decimals, change), '%+.2f' % (change / close * 100)
+        if change is not None:
+            quote += ',%s' % change
+            if percent is not None:
+                quote += '(%s%%)' % percent
+        return quote
+
+    def handle(self, data):
+        ticks = json.loads(data)
+        ticks = ticks if isinstance(ticks, list) else [ticks]
+        now = time.time()
+        for tick in ticks:
+            close = self.previous_close(tick) if tick.get('change') is None else None
+            quote = self.format_quote(tick, close)
+            if close is not None:
+                self.closes[tick['symbol']] = (close, quote)
+            self.buffer[tick['symbol']] = quote
+            self.bus.publish(tick['symbol'], quote, tick.get('time', now))
+        self.received += len(ticks)
+
+    async def read_websocket(self, session):
+        async with session.ws_connect(self.url, heartbeat=30) as ws:
+            self.logger.info('Quote stream connected: %s' % self.url)
+            async for message in ws:
+                if message.type == aiohttp.WSMsgType.TEXT:
+                    self.handle(message.data)
+                elif message.type in (aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                    break
+
+    async def read_sse(self, session):
+        async with session.get(self.url, headers={'Accept': 'text/event-stream'}, timeout=None) as response:
+            self.logger.info('Quote stream connected: %s' % self.url)
+            async for line in response.content:
+                line = line.decode('utf-8').strip()
+                if line.startswith('data:'):
+                    self.handle(line[5:].strip())
+
+    async def loop_flush(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            if len(self.buffer) > 0:
+                buffer, self.buffer = self.buffer, {}
+                try:
+                    self.scrapper.record_quotes([{x: y} for x, y in buffer.items()], publish=False)
+                except Exception as e:
+                    self.logger.error('Unable to record streamed quotes. %s' % e)
+
+    async def loop_stream(self):
+        backoff = 1
+        while True:
+            try:
+                async with aiohttp.ClientSession() as session:
+                    if self.url.startswith('ws'):
+                        await self.read_websocket(session)
+                    else:
+                        await self.read_sse(session)
+                backoff = 1
+            except Exception as e:
+                self.logger.error('Quote stream disconnected. %s' % e)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
+
+    def tasks(self):
+        return [('stream', self.loop_stream), ('stream_flush', self.loop_flush)]
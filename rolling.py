@@ -0,0 +1,123 @@
+import math
+from collections import deque
+
+
+class RingWindow(object):
+
+    # Time-bounded window with running sums and monotonic min/max queues: O(1) amortized per tick.
+    def __init__(self, seconds, max_ticks=10000):
+        self.seconds = seconds
+        self.max_ticks = max_ticks
+        self.ticks = deque()
+        self.min_queue = deque()
+        self.max_queue = deque()
+        self.sum = 0.0
+        self.sumsq = 0.0
+        self.sequence = 0
+
+    def push(self, timestamp, price):
+        tick = (self.sequence, timestamp, price)
+        self.sequence += 1
+        self.ticks.append(tick)
+        self.sum += price
+        self.sumsq += price * price
+        while len(self.min_queue) > 0 and self.min_queue[-1][2] >= price:
+            self.min_queue.pop()
+        self.min_queue.append(tick)
+        while len(self.max_queue) > 0 and self.max_queue[-1][2] <= price:
+            self.max_queue.pop()
+        self.max_queue.append(tick)
+        cutoff = timestamp - self.seconds
+        while self.ticks[0][1] < cutoff or len(self.ticks) > self.max_ticks:
+            old = self.ticks.popleft()
+            self.sum -= old[2]
+            self.sumsq -= old[2] * old[2]
+            if self.min_queue[0][0] == old[0]:
+                self.min_queue.popleft()
+            if self.max_queue[0][0] == old[0]:
+                self.max_queue.popleft()
+
+    @property
+    def count(self):
+        return len(self.ticks)
+
+    @property
+    def mean(self):
+        return self.sum / len(self.ticks)
+
+    @property
+    def std(self):
+        mean = self.mean
+        return math.sqrt(max(self.sumsq / len(self.ticks) - mean * mean, 0.0))
+
+    @property
+    def low(self):
+        return self.min_queue[0][2]
+
+    @property
+    def high(self):
+        return self.max_queue[0][2]
+
+
+class RollingEngine(object):
+
+    types = ('move', 'maCross', 'band')
+
+    def __init__(self, hysteresis=0.5, min_ticks=5):
+        self.hysteresis = hysteresis
+        self.min_ticks = min_ticks
+        self.windows = {}
+        self.symbol_windows = {}
+        self.state = {}
+
+    def sync(self, alerts):
+        needed = set()
+        for alert in alerts:
+            needed.add((alert['symbol'], alert['window'] * 60))
+            if alert['type'] == 'maCross':
+                needed.add((alert['symbol'], alert['long_window'] * 60))
+        for key in needed - set(self.windows):
+            self.windows[key] = RingWindow(key[1])
+        for key in set(self.windows) - needed:
+            del self.windows[key]
+        self.symbol_windows = {}
+        for symbol, seconds in self.windows:
+            self.symbol_windows.setdefault(symbol, []).append(self.windows[(symbol, seconds)])
+        ids = {x['id'] for x in alerts}
+        self.state = {x: y for x, y in self.state.items() if x in ids}
+
+    def update(self, symbol, timestamp, price):
+        for window in self.symbol_windows.get(symbol, []):
+            window.push(timestamp, price)
+
+    def evaluate(self, alert, price):
+        window = self.windows.get((alert['symbol'], alert['window'] * 60))
+        if window is None or window.count < self.min_ticks:
+            return None, False
+        threshold = alert['threshold']
+        state = self.state.setdefault(alert['id'], {'armed': alert.get('armed', True), 'side': 0})
+        if alert['type'] == 'maCross':
+            long_window = self.windows[(alert['symbol'], alert['long_window'] * 60)]
+            separation = window.mean / long_window.mean - 1
+            side = 1 if separation > threshold else -1 if separation < -threshold else state['side']
+            crossed = state['side'] != 0 and side != state['side']
+            state['side'] = side
+            if crossed:
+                return '%s %d-minute average crossed %s the %d-minute average.' % (
+                    alert['symbol'], alert['window'], 'above' if side > 0 else 'below', alert['long_window']), False
+            return None, False
+        if alert['type'] == 'move':
+            metric = max(price / window.low - 1, 1 - price / window.high)
+            content = '%s moved %.2f%% in the last %d minutes.' % (alert['symbol'], metric * 100, alert['window'])
+        else:
+            std = window.std
+            metric = abs(price - window.mean) / std if std > 0 else 0
+            content = '%s is %.1f standard deviations from its %d-minute average.' % (
+                alert['symbol'], metric, alert['window'])
+        if state['armed'] and metric >= threshold:
+            state['armed'] = False
+            return content, False
+        if not state['armed'] and metric < threshold * (1 - self.hysteresis):
+            state['armed'] = True
+            return None, True
+        return None, False
@@ -0,0 +1,62 @@
+import asyncio
+import bisect
+import hashlib
+import logging
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from db import *
+
+
+class SweepShard(object):
+
+    def __init__(self, worker_id=None, lease=30, replicas=64):
+        self.worker_id = worker_id or '%s-%s-%s' % (socket.gethostname(), os.getpid(), uuid.uuid4().hex[:6])
+        self.lease = lease
+        self.replicas = replicas
+        self.workers = [self.worker_id]
+        self.ring = self.build_ring(self.workers)
+        self.logger = logging.getLogger(__name__)
+
+    @staticmethod
+    def point(key):
+        return int(hashlib.md5(key.encode('utf-8')).hexdigest()[:16], 16)
+
+    def build_ring(self, workers):
+        return sorted((self.point('%s#%d' % (x, i)), x) for x in workers for i in range(self.replicas))
+
+    # Each heartbeat also publishes the membership this worker currently shards by.
+    def heartbeat(self):
+        now = datetime.utcnow()
+        SweepWorker.objects(workerId=self.worker_id).update_one(set__heartbeat=now, set__members=self.workers,
+                                                                upsert=True)
+        workers = [x.workerId for x in SweepWorker.objects(heartbeat__gte=now - timedelta(seconds=self.lease))
+                   .only('workerId')]
+        return self.rebalance(workers)
+
+    def rebalance(self, workers):
+        workers = sorted(set(workers) | {self.worker_id})
+        if workers != self.workers:
+            self.logger.info('Sweep shard rebalanced: %s' % ', '.join(workers))
+            self.workers = workers
+            self.ring = self.build_ring(workers)
+        return workers
+
+    def owner(self, symbol):
+        index = bisect.bisect(self.ring, (self.point(str(symbol)), ''))
+        return self.ring[index % len(self.ring)][1]
+
+    def owns(self, symbol):
+        return self.owner(symbol) == self.worker_id
+
+    def release(self):
+        SweepWorker.objects(workerId=self.worker_id).delete()
+
+    async def loop_heartbeat(self):
+        while True:
+            try:
+                self.heartbeat()
+            except Exception as e:
+                self.logger.error('Unable to send sweep heartbeat. %s' % e)
+            await asyncio.sleep(self.lease / 3)
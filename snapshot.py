@@ -0,0 +1,77 @@
+import asyncio
+import logging
+import os
+import pickle
+import time
+import zlib
+
+
+class Snapshot(object):
+
+    version = 1
+
+    # The file is written by the bot itself (atomically, via rename) and only ever read back locally.
+    def __init__(self, path=None, interval=None):
+        self.path = path or os.environ.get('SNAPSHOT_PATH', 'stock_quote_bot.snapshot')
+        self.interval = interval or float(os.environ.get('SNAPSHOT_INTERVAL', 60))
+        self.logger = logging.getLogger(__name__)
+
+    def save(self, state):
+        data = zlib.compress(pickle.dumps({'version': self.version, 'time': time.time(), 'state': state},
+                                          pickle.HIGHEST_PROTOCOL))
+        temp = self.path + '.tmp'
+        with open(temp, 'wb') as f:
+            f.write(data)
+        os.replace(temp, self.path)
+        return len(data)
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+        try:
+            with open(self.path, 'rb') as f:
+                snapshot = pickle.loads(zlib.decompress(f.read()))
+        except Exception as e:
+            self.logger.error('Unable to read snapshot %s. %s' % (self.path, e))
+            return None
+        if snapshot.get('version') != self.version:
+            return None
+        self.logger.info('Snapshot loaded, %.0fs old.' % (time.time() - snapshot['time']))
+        return snapshot['state']
+
+    @staticmethod
+    def capture(scrapper, alert_cache, symbol_index, rolling):
+        # Caches shared with the handler loop are copied under their own locks; rolling state belongs to the
+        # sweep loop that saves the snapshot.
+        with scrapper.cache_lock:
+            quote_cache = dict(scrapper.quote_cache)
+        with symbol_index.lock:
+            nicknames = dict(symbol_index.nicknames)
+        return {
+            'quote_cache': quote_cache,
+            'alert_cache': alert_cache.dump(),
+            'nicknames': nicknames,
+            'rolling': dict(rolling.state),
+            'forex': (dict(scrapper.forex_engine.usd), scrapper.forex_engine.fetched_at)
+        }
+
+    def restore(self, state, scrapper, alert_cache, symbol_index, rolling):
+        with scrapper.cache_lock:
+            scrapper.quote_cache.update(state['quote_cache'])
+        alert_cache.restore(state['alert_cache'])
+        with symbol_index.lock:
+            symbol_index.nicknames.update(state['nicknames'])
+        rolling.state.update(state['rolling'])
+        scrapper.forex_engine.usd, scrapper.forex_engine.fetched_at = state['forex']
+        # Quotes recent enough to stand in for the first sweep after a restart.
+        now = time.time()
+        return {x: y for x, (t, y) in state['quote_cache'].items() if now - t < self.interval * 2}
+
+    async def loop_save(self, state):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                size = self.save(state())
+                self.logger.debug('Snapshot saved, %d bytes.' % size)
+            except Exception as e:
+                self.logger.error('Unable to save snapshot. %s' % e)
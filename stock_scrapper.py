@@ -3,19 +3,31 @@ import aiohttp
 import logging
 import os
 import json
+import threading
+import time
+from collections import Counter
 # import arsenic
 from logging.handlers import TimedRotatingFileHandler
 from bs4 import BeautifulSoup
+try:
+    import brotli
+except ImportError:
+    brotli = None
+from bounded import BoundedDict
 from db import *
+from forex_engine import ForexEngine
+from quote_bus import QuoteBus
+from quote_history import QuoteHistory
+from symbol_master import SymbolMaster
 
 
 class StockScrapper(object):
 
-    def __init__(self):
+    def __init__(self, symbol_master=None, persist_history=True):
         self.hk_stock_url = 'http://www.aastocks.com/tc/mobile/Quote.aspx?symbol='
         self.us_stock_url = ['https://www.nasdaq.com/en/symbol/', '/real-time']
         self.forex_url = ['http://forex.1forge.com/1.0.3/quotes?pairs=', '&api_key=']
-        self.__one_forge_api = os.environ['ONEFORGE_API']
+        self.one_forge_api = os.environ['ONEFORGE_API']
         #self.driver_path = os.getcwd() + '/chromedriver'
         #self.service = arsenic.services.Chromedriver(binary=self.driver_path)
         #self.browser = arsenic.browsers.Chrome(chromeOptions={'args': ['-headless', '--disable-gpu']})
@@ -29,35 +41,101 @@ class StockScrapper(object):
         stdlog = logging.StreamHandler()
         stdlog.setFormatter(logger_formatter)
         self.logger.addHandler(stdlog)
-        self.notification_message = []
+        self.accept_encoding = 'gzip, deflate, br' if brotli is not None else 'gzip, deflate'
+        # provider -> (byte cap, marker unique to the last element that is parsed, end of that element)
+        self.page_limits = {'aastocks': (65536, b'two bottom right cell_last', b'</td>'),
+                            'nasdaq': (131072, b'qwidget_percent', b'</div>')}
+        self.not_modified = object()
+        self.sessions = {}
+        self.validators = BoundedDict(20000)
+        self.transfer = Counter()
+        self.quote_cache = BoundedDict(int(os.environ.get('QUOTE_CACHE_SIZE', 20000)))
+        self.cache_lock = threading.Lock()
+        self.history = QuoteHistory(persist=persist_history)
+        self.bus = QuoteBus()
+        self.forex_engine = ForexEngine(self)
+        self.symbol_master = symbol_master if symbol_master is not None else SymbolMaster()
 
-    async def html_page_load(self, url, check_token):
+    def session(self):
+        loop = asyncio.get_event_loop()
+        session = self.sessions.get(loop)
+        if session is None or session.closed:
+            session = aiohttp.ClientSession(headers={'Accept-Encoding': self.accept_encoding})
+            self.sessions[loop] = session
+        return session
+
+    async def read_capped(self, response, limit):
+        if limit is None:
+            return await response.read()
+        # Stop once the last field we parse has been closed, or at the byte cap.
+        size, marker, end = limit
+        page = bytearray()
+        found = -1
+        async for chunk in response.content.iter_chunked(8192):
+            start = max(len(page) - len(marker), 0)
+            page += chunk
+            if found < 0:
+                found = page.find(marker, start)
+            if len(page) >= size or (found >= 0 and page.find(end, found) >= 0):
+                break
+        return bytes(page)
+
+    async def fetch_page(self, url, limit=None):
+        headers = {'Referer': url}
+        if 'aastocks' in url:
+            headers['Cookie'] = 'mredir=m; CookiePolicyCheck=0'
+        validator = self.validators.get(url)
+        if validator is not None and validator['quote'] is not None:
+            if validator['etag'] is not None:
+                headers['If-None-Match'] = validator['etag']
+            if validator['last_modified'] is not None:
+                headers['If-Modified-Since'] = validator['last_modified']
+        async with self.session().get(url, headers=headers) as response:
+            self.transfer['requests'] += 1
+            if response.status == 304:
+                self.transfer['not_modified'] += 1
+                return self.not_modified
+            if response.status != 200:
+                return None
+            page = await self.read_capped(response, limit)
+            self.transfer['bytes'] += len(page)
+            self.transfer['wire_bytes'] += min(int(response.headers.get('Content-Length', len(page))), len(page))
+            if response.headers.get('ETag') is not None or response.headers.get('Last-Modified') is not None:
+                self.validators[url] = {'etag': response.headers.get('ETag'),
+                                        'last_modified': response.headers.get('Last-Modified'), 'quote': None}
+            return page
+
+    async def html_page_load(self, url, check_token, limit=None):
         count = 0
-        page = None
-        while count < 10 and page is None:
+        while count < 10:
             try:
                 self.logger.debug('Start loading page: %s' % url)
-                headers = {'Cookie': 'ASP.NET_SessionId=3pz5rijqiysbfomo4u1ladmu; aa_cookie=219.76.18.79_56624_1544257454; mredir=m; CookiePolicyCheck=0; __asc=3dbbdef81678ce271176068074a; __auc=3dbbdef81678ce271176068074a; __utma=177965731.587761365.1544256910.1544256910.1544256910.1; __utmc=177965731; __utmz=177965731.1544256910.1.1.utmcsr=(direct)|utmccn=(direct)|utmcmd=(none); __utmt=1; __utmb=177965731.1.10.1544256910; __utma=81143559.146825753.1544256910.1544256910.1544256910.1; __utmc=81143559; __utmz=81143559.1544256910.1.1.utmcsr=(direct)|utmccn=(direct)|utmcmd=(none); __utmt_b=1; __utmb=81143559.1.10.1544256910; AALTP=1',
-                           'Referrer': url}
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(url, headers=headers) as response:
-                        if response.status != 200:
-                            page = None
-                            self.logger.error('%s response error.' % url)
-                        else:
-                            page = await response.read()
-                            soup = BeautifulSoup(page, 'html.parser')
-                            if len(soup.select(check_token)) == 0:
-                                self.logger.error('%s html structure invalid.' % url)
-                                page = None
-                            else:
-                                self.logger.debug('%s loaded.' % url)
-                                return page, soup
+                page = await self.fetch_page(url, limit)
+                if page is self.not_modified:
+                    self.logger.debug('%s not modified.' % url)
+                    return page
+                elif page is None:
+                    self.logger.error('%s response error.' % url)
+                else:
+                    # Only the parsed tree is kept; callers decompose it once the quote is extracted.
+                    soup = BeautifulSoup(page, 'html.parser')
+                    del page
+                    if any(len(soup.select(x)) == 0 for x in check_token):
+                        soup.decompose()
+                        if limit is not None:
+                            # The cap cut off a parsed field, so the next attempt reads the whole page.
+                            self.logger.info('%s incomplete within the read cap, reading it whole.' % url)
+                            self.transfer['uncapped'] += 1
+                            limit = None
+                            continue
+                        self.logger.error('%s html structure invalid.' % url)
+                    else:
+                        self.logger.debug('%s loaded.' % url)
+                        return soup
             except Exception as e:
-                page = None
                 self.logger.error('%s Unable to load. %s' % (url, e))
             count += 1
-        return None, None
+        return None
 
     async def browser_page_load(self, url, check_token):
         count = 0
@@ -99,15 +177,17 @@ class StockScrapper(object):
         while count < 10 and page is None:
             try:
                 self.logger.debug('Start loading API:')
-                async with aiohttp.ClientSession() as session:
-                    async with session.get(url) as response:
-                        if response.status != 200:
-                            page = None
-                            self.logger.error('API response error.')
-                        else:
-                            page = json.loads(await response.read())
-                            self.logger.debug('API loaded.')
-                            return page
+                async with self.session().get(url) as response:
+                    if response.status != 200:
+                        page = None
+                        self.logger.error('API response error.')
+                    else:
+                        body = await response.read()
+                        self.transfer['requests'] += 1
+                        self.transfer['bytes'] += len(body)
+                        page = json.loads(body)
+                        self.logger.debug('API loaded.')
+                        return page
             except Exception as e:
                 page = None
                 self.logger.error('API Unable to load. %s' % e)
@@ -116,11 +196,17 @@ class StockScrapper(object):
 
     async def hk_stock_scrapper(self, symbol):
         url = self.hk_stock_url + str(symbol)
-        page, soup = await self.html_page_load(url, 'table.quote_table')
-        if page is not None:
+        soup = await self.html_page_load(url, ('table.quote_table td.two.bottom.right.cell_last div:nth-of-type(3)',),
+                                         self.page_limits['aastocks'])
+        if soup is self.not_modified:
+            quote = self.validators[url]['quote']
+        elif soup is not None:
             quote = soup.select('table.quote_table')[0].select('td.two.bottom.right.cell_last')[0].select('div')
             quote = [x.get_text().replace('\r', '').replace('\n', '').strip() for x in quote]
             quote = ','.join(quote[1:3])
+            soup.decompose()
+            if url in self.validators:
+                self.validators[url]['quote'] = quote
         else:
             quote = 'Not available'
         self.logger.debug('Scrapper quote for %s: %s' % (symbol, quote))
@@ -128,8 +214,11 @@ class StockScrapper(object):
 
     async def us_stock_scrapper(self, symbol):
         url = symbol.lower().join(self.us_stock_url)
-        page, soup = await self.html_page_load(url, 'div#qwidget_lastsale')
-        if page is not None:
+        soup = await self.html_page_load(url, ('div#qwidget_lastsale', 'div#qwidget_netchange', 'div#qwidget_percent'),
+                                         self.page_limits['nasdaq'])
+        if soup is self.not_modified:
+            quote = self.validators[url]['quote']
+        elif soup is not None:
             last_price = soup.select('div#qwidget_lastsale')[0].get_text().replace('$', '')
             net_change = soup.select('div#qwidget_netchange')[0]
             if net_change['class'][-1].split('-')[-1] == 'Red':
@@ -139,15 +228,25 @@ class StockScrapper(object):
             net_change = sign + net_change.get_text()
             per_change = '(' + sign + soup.select('div#qwidget_percent')[0].get_text() + ')'
             quote = last_price + ',' + net_change + per_change
+            soup.decompose()
+            if url in self.validators:
+                self.validators[url]['quote'] = quote
         else:
             quote = 'Not available'
         self.logger.debug('Scrapper quote for %s: %s' % (symbol, quote))
         return {symbol: quote}
 
     async def forex_api(self, symbol_list):
+        derived, direct = await self.forex_engine.quotes(symbol_list)
+        quotes = [{x: derived[x]} for x in symbol_list if x in derived]
+        if len(direct) > 0:
+            quotes += await self.forex_api_direct(direct)
+        return quotes
+
+    async def forex_api_direct(self, symbol_list):
         symbols = [x.replace('/', '').upper() for x in symbol_list]
         symbol_map = {x: y for x, y in zip(symbols, symbol_list)}
-        url = ','.join(symbols).join(self.forex_url) + self.__one_forge_api
+        url = ','.join(symbols).join(self.forex_url) + self.one_forge_api
         page = await self.forex_api_fetch(url)
         if page is not None:
             quotes = [{symbol_map[x['symbol']]: str(x['price'])} for x in page]
@@ -157,18 +256,40 @@ class StockScrapper(object):
                  [list(x.keys())[0] for x in quotes], [list(x.values())[0] for x in quotes]))
         return [{list(x.keys())[0]: list(x.values())[0]} for x in quotes]
 
-    async def report_quote(self, symbols):
-        hksymbols = [str(x) for x in symbols if str(x).isdigit()]
-        ussymbols = [str(x) for x in symbols if not str(x).isdigit() and '/' not in str(x)]
-        forex_symbols = [str(x) for x in symbols if not str(x).isdigit() and '/' in str(x)]
-        tasks = [asyncio.ensure_future(self.hk_stock_scrapper(x)) for x in hksymbols] + [
-                  asyncio.ensure_future(self.us_stock_scrapper(x)) for x in ussymbols] + \
-            ([asyncio.ensure_future(self.forex_api(forex_symbols))] if len(forex_symbols) > 0 else [])
+    async def report_quote(self, symbols, record=True):
+        providers = {}
+        for symbol in symbols:
+            info = self.symbol_master.resolve(symbol)
+            providers.setdefault(info.provider if info is not None else None, []).append(str(symbol))
+        tasks = [asyncio.ensure_future(self.hk_stock_scrapper(x)) for x in providers.get('aastocks', [])] + [
+                  asyncio.ensure_future(self.us_stock_scrapper(x)) for x in providers.get('nasdaq', [])] + \
+            ([asyncio.ensure_future(self.forex_api(providers['1forge']))] if '1forge' in providers else [])
         quotes = await asyncio.gather(*tasks)
         quotes = [[x] if not isinstance(x, list) else x for x in quotes]
-        quotes = [y for x in quotes for y in x]
+        quotes = [y for x in quotes for y in x] + [{x: 'Not available'} for x in providers.get(None, [])]
+        if record:
+            self.record_quotes(quotes)
         return quotes
 
+    def transfer_report(self, before, quotes):
+        delta = self.transfer - before
+        return '%d quotes, %d requests, %d bytes (%d on the wire), %d bytes per quote, %d not modified, ' \
+               '%d read whole' % (quotes, delta['requests'], delta['bytes'], delta['wire_bytes'],
+                                  delta['bytes'] / max(quotes, 1), delta['not_modified'], delta['uncapped'])
+
+    def record_quotes(self, quotes, publish=True):
+        now = time.time()
+        available = {list(x.keys())[0]: list(x.values())[0] for x in quotes if list(x.values())[0] != 'Not available'}
+        with self.cache_lock:
+            self.quote_cache.update({x: (now, y) for x, y in available.items()})
+        if publish:
+            for symbol, quote in available.items():
+                self.bus.publish(symbol, quote, now)
+        try:
+            self.history.record(available, now)
+        except Exception as e:
+            self.logger.error('Unable to record quote history. %s' % e)
+
 
 
 
@@ -0,0 +1,31 @@
+import asyncio
+import logging
+
+
+class Supervisor(object):
+
+    # Long-running loops share one event loop; a loop that raises or returns is logged and started again
+    # so that one failure does not stop delivery, digests or heartbeats along with it.
+    def __init__(self, delay=1, max_delay=60):
+        self.delay = delay
+        self.max_delay = max_delay
+        self.restarts = {}
+        self.logger = logging.getLogger(__name__)
+
+    async def supervise(self, name, factory):
+        delay = self.delay
+        while True:
+            try:
+                await factory()
+                self.logger.error('Task %s returned, restarting.' % name)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.logger.error('Task %s failed, restarting in %ds. %s' % (name, delay, e))
+            self.restarts[name] = self.restarts.get(name, 0) + 1
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_delay)
+
+    def run(self, tasks):
+        return asyncio.gather(*[self.supervise(name, factory) for name, factory in tasks],
+                              return_exceptions=True)
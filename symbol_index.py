@@ -0,0 +1,97 @@
+import threading
+from bounded import BoundedDict
+from db import *
+
+
+class PrefixIndex(object):
+
+    # Every trie node keeps its best matches, so a lookup only walks the prefix.
+    def __init__(self, limit=10):
+        self.limit = limit
+        self.root = {}
+
+    def add(self, key, value):
+        node = self.root
+        for char in key.lower():
+            node = node.setdefault(char, {})
+            top = node.setdefault('', [])
+            if len(top) < self.limit and value not in top:
+                top.append(value)
+
+    def search(self, prefix):
+        node = self.root
+        for char in prefix.lower():
+            node = node.get(char)
+            if node is None:
+                return []
+        return node.get('', [])
+
+
+class SymbolIndex(object):
+
+    def __init__(self, master, limit=10, quote_cache=None):
+        self.master = master
+        self.limit = limit
+        self.quote_cache = quote_cache if quote_cache is not None else {}
+        self.nicknames = BoundedDict(10000)
+        self.lock = threading.Lock()
+        self.index = self.build()
+        master.listeners.append(self.rebuild)
+
+    def build(self):
+        index = PrefixIndex(self.limit)
+        entries = sorted(self.master, key=lambda x: (len(x.symbol), x.symbol))
+        for entry in entries:
+            symbol = entry.symbol
+            index.add(symbol, symbol)
+            index.add(symbol.replace('/', ''), symbol)
+            for word in entry.name.split():
+                index.add(word, symbol)
+        return index
+
+    def rebuild(self):
+        self.index = self.build()
+
+    def user_nicknames(self, user_id):
+        with self.lock:
+            if user_id not in self.nicknames:
+                users = User.objects(telegramUid=user_id)
+                stocks = Stock.objects(createdBy=users[0].id).only('symbol', 'nickname') if len(users) > 0 else []
+                self.nicknames[user_id] = [(x.nickname or '', x.symbol) for x in stocks]
+            return self.nicknames[user_id]
+
+    def invalidate(self, user_id):
+        with self.lock:
+            self.nicknames.pop(user_id, None)
+
+    def search(self, query, user_id=None):
+        query = query.strip()
+        if len(query) == 0:
+            return []
+        matches = []
+        if user_id is not None:
+            matches = [(x, y) for x, y in self.user_nicknames(user_id) if x.lower().startswith(query.lower())]
+        matches += [(None, x) for x in self.index.search(query)]
+        seen = set()
+        results = []
+        for nickname, symbol in matches:
+            if symbol not in seen:
+                seen.add(symbol)
+                results.append((nickname, symbol))
+        return results[:self.limit]
+
+    # Only listed symbols, symbols quoted before and the user's own stocks are fetched; a well-formed typo
+    # such as APPL is rejected here instead of costing a scrape.
+    def is_known(self, symbol, user_id=None):
+        if self.master.get(symbol) is not None or self.master.normalize(symbol) in self.quote_cache:
+            return True
+        return user_id is not None and any(symbol in x for x in self.user_nicknames(user_id))
+
+    def suggest(self, symbol, user_id=None, limit=3):
+        query = str(symbol).strip()
+        while len(query) > 0:
+            matches = [x for nickname, x in self.search(query, user_id)]
+            if len(matches) > 0:
+                return matches[:limit]
+            query = query[:-1]
+        return []
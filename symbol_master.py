@@ -0,0 +1,114 @@
+import csv
+import logging
+import os
+import re
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+from bounded import BoundedDict
+
+
+SymbolInfo = namedtuple('SymbolInfo', ['symbol', 'name', 'market', 'currency', 'lot_size', 'calendar', 'provider'])
+
+
+class SymbolMaster(object):
+
+    markets = {
+        'hk': {'icon': '🇭🇰', 'link': 'http://www.aastocks.com/tc/stocks/quote/detailchart.aspx?symbol=%s',
+               'calendar': 'HKEX'},
+        'us': {'icon': '🇺🇸', 'link': 'https://finance.yahoo.com/chart/%s', 'calendar': 'NYSE'},
+        'forex': {'icon': '', 'link': None, 'calendar': 'FX'}
+    }
+    # Calendars trade Monday to Friday unless listed here; holidays come from market_calendar.csv.
+    weekends = {'CRYPTO': ()}
+    # Symbols missing from the master file are classified once by shape and cached; malformed ones never fetch.
+    patterns = [
+        (re.compile(r'^\d{1,5}$'), lambda x: SymbolInfo(x, '', 'hk', 'HKD', 1, 'HKEX', 'aastocks')),
+        (re.compile(r'^[A-Z][A-Z.\-]{0,5}$'), lambda x: SymbolInfo(x, '', 'us', 'USD', 1, 'NYSE', 'nasdaq')),
+        (re.compile(r'^[A-Z]{3,4}/[A-Z]{3,4}$'),
+         lambda x: SymbolInfo(x, '', 'forex', x.split('/')[1], 1, 'FX', '1forge'))
+    ]
+
+    def __init__(self, path=None, refresh_interval=300, calendar_path=None):
+        self.path = path or os.environ.get('SYMBOL_MASTER', os.path.join(os.path.dirname(
+            os.path.realpath(__file__)), 'symbol_master.csv'))
+        self.calendar_path = calendar_path or os.environ.get('MARKET_CALENDAR', os.path.join(os.path.dirname(
+            os.path.realpath(__file__)), 'market_calendar.csv'))
+        self.holidays = set()
+        self.refresh_interval = refresh_interval
+        self.symbols = {}
+        self.derived = BoundedDict(10000)
+        self.mtime = None
+        self.listeners = []
+        self.logger = logging.getLogger(__name__)
+        self.load()
+
+    @staticmethod
+    def normalize(symbol):
+        return str(symbol).strip().upper()
+
+    def load(self):
+        mtime = os.path.getmtime(self.path)
+        with open(self.path, newline='', encoding='utf-8') as f:
+            symbols = {}
+            for x in csv.DictReader(f):
+                symbol = self.normalize(x['symbol'])
+                symbols[symbol] = SymbolInfo(symbol, x['name'], x['market'], x['currency'], int(x['lot_size']),
+                                             x['calendar'], x['provider'])
+        holidays = set()
+        if os.path.exists(self.calendar_path):
+            with open(self.calendar_path, newline='', encoding='utf-8') as f:
+                holidays = {(x['calendar'], datetime.strptime(x['date'], '%Y-%m-%d').date()) for x in csv.DictReader(f)}
+        self.symbols, self.derived, self.mtime, self.holidays = symbols, BoundedDict(10000), mtime, holidays
+        for listener in self.listeners:
+            listener()
+        return symbols
+
+    def refresh(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                if os.path.getmtime(self.path) != self.mtime:
+                    self.load()
+                    self.logger.info('Symbol master reloaded with %d symbols.' % len(self.symbols))
+            except Exception as e:
+                self.logger.error('Unable to reload symbol master. %s' % e)
+
+    def start(self):
+        thread = threading.Thread(target=self.refresh, daemon=True)
+        thread.start()
+        return thread
+
+    def get(self, symbol):
+        return self.symbols.get(self.normalize(symbol))
+
+    def resolve(self, symbol):
+        key = self.normalize(symbol)
+        info = self.symbols.get(key) or self.derived.get(key)
+        if info is None:
+            info = next((f(key) for pattern, f in self.patterns if pattern.match(key)), None)
+            if info is not None:
+                self.derived[key] = info
+        return info
+
+    def market(self, symbol):
+        info = self.resolve(symbol)
+        return info.market if info is not None else 'unknown'
+
+    def icon(self, symbol):
+        return self.markets.get(self.market(symbol), {}).get('icon', '')
+
+    def link(self, symbol):
+        template = self.markets.get(self.market(symbol), {}).get('link')
+        return template % symbol if template is not None else None
+
+    def trading_day(self, market, day):
+        calendar = self.markets.get(market, {}).get('calendar', market)
+        return day.weekday() not in self.weekends.get(calendar, (5, 6)) and (calendar, day) not in self.holidays
+
+    def __contains__(self, symbol):
+        return self.resolve(symbol) is not None
+
+    def __iter__(self):
+        return iter(list(self.symbols.values()))
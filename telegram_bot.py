@@ -4,14 +4,46 @@ import os
 import logging
 import json
 import threading
+import tempfile
+import time
+from datetime import datetime
+from io import BytesIO
+from alert_cache import AlertCache
+from alert_checks import AlertChecks
+from alert_outbox import AlertOutbox
+from bounded import BoundedDict
+from bulk_io import BulkIO
+from chart import ChartRenderer
+from digest import DigestEngine
+from fair_scheduler import FairScheduler
+from live_watchlist import LiveWatchlist
+from portfolio import Portfolio
+from profiler import ProfileControl
+from quote_stream import QuoteStream
+from quote_history import parse_price
+from rolling import RollingEngine
+from shard import SweepShard
+from snapshot import Snapshot
 from stock_scrapper import StockScrapper
+from supervisor import Supervisor
+from symbol_index import SymbolIndex
+from symbol_master import SymbolMaster
+from watchlist_repository import WatchlistRepository
 from db import *
 from logging.handlers import TimedRotatingFileHandler
 import telegram
-from telegram.ext import Updater, CommandHandler, CallbackQueryHandler, MessageHandler, Filters
+from telegram.ext import Updater, CommandHandler, CallbackQueryHandler, InlineQueryHandler, MessageHandler, Filters
 
 class TelegramBot(object):
 
+    # Sections that /profile can sample: the notification sweep and every run_handler name.
+    profile_targets = ('sweep', 'ask_price', 'chart_view', 'digest_disable', 'digest_enable', 'export_csv',
+                       'history_view', 'import_document', 'import_request', 'nickname_add', 'nickname_list',
+                       'nickname_remove', 'notification_disable', 'notification_enable', 'notification_manage_add',
+                       'notification_manage_list', 'notification_manage_remove', 'position_add', 'position_list',
+                       'position_remove', 'position_view', 'profile', 'watchlist_add', 'watchlist_list',
+                       'watchlist_live', 'watchlist_remove', 'watchlist_stop', 'watchlist_view')
+
     def __init__(self):
         self.updater = Updater(token=os.environ['TELEGRAM_TOKEN'])
         self.dispatcher = self.updater.dispatcher
@@ -19,8 +51,37 @@ class TelegramBot(object):
         self.endpoint = 'https://api.telegram.org/bot%s' % self.__token
         self.get_message_url = '/getUpdates'
         self.send_message_url = '/sendMessage'
+        self.edit_message_url = '/editMessageText'
+        self.unpin_message_url = '/unpinChatMessage'
         self.last_update_id = 0
-        self.scrapper = StockScrapper()
+        self.symbol_master = SymbolMaster()
+        self.scrapper = StockScrapper(self.symbol_master)
+        self.scheduler = FairScheduler(self.scrapper)
+        self.chart = ChartRenderer(self.scrapper.history)
+        self.portfolio = Portfolio(self.scrapper)
+        self.outbox = AlertOutbox()
+        self.checks = AlertChecks()
+        self.alert_cache = AlertCache()
+        self.symbol_index = SymbolIndex(self.symbol_master, quote_cache=self.scrapper.quote_cache)
+        self.watchlists = WatchlistRepository()
+        self.bulk_io = BulkIO(self.symbol_index, self.watchlists)
+        self.pending_imports = BoundedDict(10000)
+        self.live = LiveWatchlist(self.scheduler, self.render_quotes, self.edit_message, unpin=self.unpin_message)
+        self.digest = DigestEngine(self.scrapper, self.send_message, scheduler=self.scheduler, portfolio=self.portfolio)
+        self.stream = QuoteStream(os.environ['QUOTE_STREAM_URL'], self.scrapper.bus, self.scrapper) \
+            if os.environ.get('QUOTE_STREAM_URL') else None
+        self.alert_index = ({}, 0)
+        self.rolling = RollingEngine()
+        self.snapshot = Snapshot()
+        self.supervisor = Supervisor()
+        self.profiler = ProfileControl(targets=self.profile_targets)
+        self.admin_uids = [int(x) for x in os.environ.get('ADMIN_UIDS', '').split(',') if x.strip().isdigit()]
+        if os.environ.get('PROFILE_SWEEPS'):
+            self.profiler.request('sweep', int(os.environ['PROFILE_SWEEPS']))
+        self.warm_quotes = {}
+        self.restore_snapshot()
+        self.shard = SweepShard(os.environ.get('SWEEP_WORKER_ID'), float(os.environ.get('SWEEP_LEASE', 30))) \
+            if os.environ.get('SWEEP_SHARDING') else None
         self.logger = logging.getLogger(__name__)
         self.logger.setLevel(logging.DEBUG)
         self.loop = asyncio.new_event_loop()
@@ -32,7 +93,7 @@ class TelegramBot(object):
         stdlog.setFormatter(logger_formatter)
         self.logger.addHandler(stdlog)
 
-    async def telegram_url(self, url, params=None):
+    async def telegram_url(self, url, params=None, retries=10):
         if self.send_message_url in url:
             send = True
         else:
@@ -40,7 +101,7 @@ class TelegramBot(object):
         params = {} if params is None else params
         count = 0
         message = None
-        while count < 10 and message is None:
+        while count < retries and message is None:
             try:
                 if not send:
                     self.logger.debug('Start getting message:')
@@ -92,103 +153,184 @@ class TelegramBot(object):
         message = await self.get_message(offset=self.last_update_id)
         return message['result']
 
-    async def send_message(self, content, user_id):
+    async def send_message(self, content, user_id, retries=10):
         url = self.endpoint + self.send_message_url
         params = {'chat_id': user_id, 'text': content}
-        await self.telegram_url(url, params)
+        return await self.telegram_url(url, params, retries)
+
+    async def edit_message(self, chat_id, message_id, content):
+        # A single attempt: a failed edit is retried by the next live tick, and a 429 returns its pause.
+        params = {'chat_id': chat_id, 'message_id': message_id, 'text': content, 'parse_mode': 'Markdown',
+                  'disable_web_page_preview': 'true'}
+        result = await self.post_api(self.edit_message_url, params)
+        if not result.get('ok'):
+            self.logger.debug('Edit in %s not applied: %s' % (chat_id, result.get('description')))
+        return result.get('parameters', {}).get('retry_after', 0)
+
+    async def unpin_message(self, chat_id, message_id):
+        result = await self.post_api(self.unpin_message_url, {'chat_id': chat_id, 'message_id': message_id})
+        if not result.get('ok'):
+            self.logger.debug('Unable to unpin live watchlist in %s: %s' % (chat_id, result.get('description')))
+
+    async def post_api(self, path, params):
+        # Live edits reuse the scrapper's per-loop session instead of opening a connection per call.
+        async with self.scrapper.session().post(self.endpoint + path, data=params) as response:
+            return json.loads(await response.read())
+
+    def run_handler(self, name, coroutine):
+        with self.profiler.section(name):
+            return self.loop.run_until_complete(coroutine)
 
     # Default helper message response.
     def help_message_handler(self, bot, update):
         response = '\n'.join([
             'Support commands:',
             '`/ask_price nickname|symbol` - Ask price for a stock with symbol or nickname.',
+            '`@bot prefix` - Search symbols and nicknames inline.',
+            '`/history nickname|symbol 1d|1w` - OHLC history from recorded quotes.',
+            '`/chart nickname|symbol 1d|1w` - Candlestick chart from recorded quotes.',
             '`/nickname_add symbol nickname` - Assign a nickname to the stock.',
             '`/nickname_remove symbol|nickname` - Remove a nickname.',
             '`/nickname` - List of defined nicknames.',
-            '`/watchlist_add symbol|nickname` - Add an item to watchlist.',
-            '`/watchlist_remove symbol|nickname` - Remove an item to watchlist.',
-            '`/watchlist` - View the watchlist.',
+            '`/watchlist_add [name] symbol|nickname` - Add an item to watchlist.',
+            '`/watchlist_remove [name] symbol|nickname` - Remove an item to watchlist.',
+            '`/watchlist [name] [page]` - View the watchlist, names are lowercase words.',
+            '`/watchlist_live [name] [page]` - Keep one message updated with prices.',
+            '`/watchlist_stop` - Stop the live watchlist.',
+            '`/watchlists` - List of watchlists.',
             '`/position_add symbol|nickname buyprice buyunit` - Add an item to position.',
             '`/position_remove symbol|nickname` - Remove an item from positions.',
             '`/positions` - List of positions.',
+            '`/import` - Upload a CSV (type,symbol,unit_price,quantity,watchlist) of positions and watchlists.',
+            '`/export` - Download positions and watchlists as CSV.',
             '`/position symbol|nickname` - View a position.',
             '`/notifications sl|tp|change` - List of notification.',
-            '`/notification_add sl|tp|change` - Add a type of notification.',
+            '`/notification_add sl|tp|change symbol threshold` - Add a type of notification.',
+            '`/notification_add move symbol 2% minutes` - Alert on a move within a rolling window.',
+            '`/notification_add ma symbol 0.1% short long` - Alert on a moving-average cross.',
+            '`/notification_add band symbol stdevs minutes` - Alert on leaving a volatility band.',
             '`/notification_remove sl|tp|change` - Remove a type of notification.',
             '`/notification sl|tp|change` - View a type of notification.',
             '`/notification_enable` - Enable all notifications.',
             '`/notification_disable` - Disable all notifications.',
+            '`/digest_enable` - Receive market open/close digests.',
+            '`/digest_disable` - Stop market open/close digests.',
         ])
         reply_markup = telegram.ReplyKeyboardRemove(remove_keyboard=True)
         bot.send_message(chat_id=update.message.chat_id, text=response, parse_mode=telegram.ParseMode.MARKDOWN,reply_markup=reply_markup)
 
     def setup_handler(self):
         self.dispatcher.add_handler(MessageHandler(Filters.text, self.help_message_handler))
+        self.dispatcher.add_handler(MessageHandler(
+            Filters.document,
+            lambda bot, update: self.run_handler('import_document', self.import_document(bot, update))))
         self.dispatcher.add_handler(CommandHandler(
             'ask_price',
-            callback=lambda bot, update, args: self.loop.run_until_complete(self.ask_price(bot, update, args)),
+            callback=lambda bot, update, args: self.run_handler('ask_price', self.ask_price(bot, update, args)),
+            pass_args=True))
+        self.dispatcher.add_handler(CommandHandler(
+            'history',
+            callback=lambda bot, update, args: self.run_handler('history_view', self.history_view(bot, update, args)),
+            pass_args=True))
+        self.dispatcher.add_handler(CommandHandler(
+            'chart',
+            callback=lambda bot, update, args: self.run_handler('chart_view', self.chart_view(bot, update, args)),
             pass_args=True))
         self.dispatcher.add_handler(CommandHandler(
             'nickname_add',
-            callback=lambda bot, update, args: self.loop.run_until_complete(self.nickname_add(bot, update, args)),
+            callback=lambda bot, update, args: self.run_handler('nickname_add', self.nickname_add(bot, update, args)),
             pass_args=True))
         self.dispatcher.add_handler(CommandHandler(
             'nickname_remove',
-            callback=lambda bot, update, args: self.loop.run_until_complete(self.nickname_remove(bot, update, args)),
+            callback=lambda bot, update, args: self.run_handler('nickname_remove', self.nickname_remove(bot, update, args)),
             pass_args=True))
         self.dispatcher.add_handler(CommandHandler(
             'nickname',
-            callback=lambda bot, update, args: self.loop.run_until_complete(self.nickname_list(bot, update, args)),
+            callback=lambda bot, update, args: self.run_handler('nickname_list', self.nickname_list(bot, update, args)),
             pass_args=True))
         self.dispatcher.add_handler(CommandHandler(
             'watchlist_add',
-            callback=lambda bot, update, args: self.loop.run_until_complete(self.watchlist_add(bot, update, args)),
+            callback=lambda bot, update, args: self.run_handler('watchlist_add', self.watchlist_add(bot, update, args)),
             pass_args=True))
         self.dispatcher.add_handler(CommandHandler(
             'watchlist_remove',
-            callback=lambda bot, update, args: self.loop.run_until_complete(self.watchlist_remove(bot, update, args)),
+            callback=lambda bot, update, args: self.run_handler('watchlist_remove', self.watchlist_remove(bot, update, args)),
             pass_args=True))
         self.dispatcher.add_handler(CommandHandler(
             'watchlist',
-            callback=lambda bot, update, args: self.loop.run_until_complete(self.ask_price(bot, update, args)),
+            callback=lambda bot, update, args: self.run_handler('watchlist_view', self.watchlist_view(bot, update, args)),
+            pass_args=True))
+        self.dispatcher.add_handler(CommandHandler(
+            'watchlist_live',
+            callback=lambda bot, update, args: self.run_handler('watchlist_live', self.watchlist_view(bot, update, args,
+                                                                                                      live=True)),
+            pass_args=True))
+        self.dispatcher.add_handler(CommandHandler(
+            'watchlist_stop',
+            callback=lambda bot, update, args: self.run_handler('watchlist_stop', self.watchlist_stop(bot, update, args)),
+            pass_args=True))
+        self.dispatcher.add_handler(CommandHandler(
+            'watchlists',
+            callback=lambda bot, update, args: self.run_handler('watchlist_list', self.watchlist_list(bot, update, args)),
             pass_args=True))
         self.dispatcher.add_handler(CommandHandler(
             'position_add',
-            callback=lambda bot, update, args: self.loop.run_until_complete(self.position_add(bot, update, args)),
+            callback=lambda bot, update, args: self.run_handler('position_add', self.position_add(bot, update, args)),
             pass_args=True))
         self.dispatcher.add_handler(CommandHandler(
             'positions',
-            callback=lambda bot, update, args: self.loop.run_until_complete(self.position_list(bot, update, args)),
+            callback=lambda bot, update, args: self.run_handler('position_list', self.position_list(bot, update, args)),
             pass_args=True))
         self.dispatcher.add_handler(CommandHandler(
             'position',
-            callback=lambda bot, update, args: self.loop.run_until_complete(self.position_view(bot, update, args)),
+            callback=lambda bot, update, args: self.run_handler('position_view', self.position_view(bot, update, args)),
             pass_args=True))
         self.dispatcher.add_handler(CommandHandler(
             'position_remove',
-            callback=lambda bot, update, args: self.loop.run_until_complete(self.position_remove(bot, update, args)),
+            callback=lambda bot, update, args: self.run_handler('position_remove', self.position_remove(bot, update, args)),
+            pass_args=True))
+        self.dispatcher.add_handler(CommandHandler(
+            'import',
+            callback=lambda bot, update, args: self.run_handler('import_request', self.import_request(bot, update, args)),
+            pass_args=True))
+        self.dispatcher.add_handler(CommandHandler(
+            'export',
+            callback=lambda bot, update, args: self.run_handler('export_csv', self.export_csv(bot, update, args)),
             pass_args=True))
         self.dispatcher.add_handler(CommandHandler(
             'notifications',
-            callback=lambda bot, update, args: self.loop.run_until_complete(self.notification_manage_list(bot, update, args)),
+            callback=lambda bot, update, args: self.run_handler('notification_manage_list', self.notification_manage_list(bot, update, args)),
             pass_args=True))
         self.dispatcher.add_handler(CommandHandler(
             'notification_add',
-            callback=lambda bot, update, args: self.loop.run_until_complete(self.notification_manage_add(bot, update, args)),
+            callback=lambda bot, update, args: self.run_handler('notification_manage_add', self.notification_manage_add(bot, update, args)),
             pass_args=True))
         self.dispatcher.add_handler(CommandHandler(
             'notification_remove',
-            callback=lambda bot, update, args: self.loop.run_until_complete(self.notification_manage_remove(bot, update, args)),
+            callback=lambda bot, update, args: self.run_handler('notification_manage_remove', self.notification_manage_remove(bot, update, args)),
             pass_args=True))
         self.dispatcher.add_handler(CommandHandler(
             'notification_enable',
-            callback=lambda bot, update, args: self.loop.run_until_complete(self.notification_enable(bot, update, args)),
+            callback=lambda bot, update, args: self.run_handler('notification_enable', self.notification_enable(bot, update, args)),
             pass_args=True))
         self.dispatcher.add_handler(CommandHandler(
             'notification_disable',
-            callback=lambda bot, update, args: self.loop.run_until_complete(self.notification_disable(bot, update, args)),
+            callback=lambda bot, update, args: self.run_handler('notification_disable', self.notification_disable(bot, update, args)),
+            pass_args=True))
+        self.dispatcher.add_handler(CommandHandler(
+            'digest_enable',
+            callback=lambda bot, update, args: self.run_handler('digest_enable', self.digest_enable(bot, update, args)),
+            pass_args=True))
+        self.dispatcher.add_handler(CommandHandler(
+            'digest_disable',
+            callback=lambda bot, update, args: self.run_handler('digest_disable', self.digest_disable(bot, update, args)),
+            pass_args=True))
+        self.dispatcher.add_handler(CommandHandler(
+            'profile',
+            callback=lambda bot, update, args: self.run_handler('profile', self.profile(bot, update, args)),
             pass_args=True))
         self.dispatcher.add_handler(CallbackQueryHandler(callback=self.callback_query_response))
+        self.dispatcher.add_handler(InlineQueryHandler(callback=self.inline_query_response))
 
     async def message_classification(self, message):
         msg_text = message['text']
@@ -272,15 +414,6 @@ class TelegramBot(object):
             message_type = None
         return message_type
 
-    @staticmethod
-    def check_watchlist(user_id):
-        users = User.objects(telegramUid=user_id)
-        watchlist = Watchlist.objects(createdBy=users[0].id)
-        if len(watchlist) > 0:
-            return watchlist[0].stockSymbols
-        else:
-            return None
-
     @staticmethod
     def check_nickname(user_id, query):
         users = User.objects(telegramUid=user_id)
@@ -290,67 +423,117 @@ class TelegramBot(object):
         else:
             return query
 
+    def resolve_query(self, user_id, query):
+        symbol = [self.check_nickname(user_id, x) for x in query]
+        symbol_dict = {x: y for x, y in zip(symbol, query)}
+        unknown = [x for x in symbol if not self.symbol_index.is_known(x, user_id)]
+        return [x for x in symbol if x not in unknown], symbol_dict, unknown
+
+    def render_quotes(self, quotes, symbol_dict):
+        response = []
+        symbols = [list(x.keys())[0] for x in quotes]
+        quote_response = ['%s: %s' % (symbol_dict[list(x.keys())[0]], list(x.values())[0]) for x in quotes]
+        # is_increase = [x.split(',')[-1].split('(')[0] > 0 if '/' not in x else False for x in response]
+        # is_decrease = [x.find('-') > 0 for x in response]
+        sign = ['null' if self.symbol_master.market(y) == 'forex' or x.split(',')[-1].split('(')[0] == 0
+                else 'down' if x.find('-') > 0 else 'up' for x, y in zip(quote_response, symbols)]
+        quote_response = ['📈 ' + x if y == 'up' else '📉 ' + x if y == 'down' else x
+                          for x, y in zip(quote_response, sign)]
+        for res, symbol in zip(quote_response, symbols):
+            link = self.symbol_master.link(symbol)
+            response.append('[' + res + '](' + link + ')' if link is not None else res)
+        # Minutes rather than seconds, so that a live watchlist is not re-edited on every tick for this line alone.
+        forex_age = self.scrapper.forex_engine.age
+        if any(self.symbol_master.market(x) == 'forex' for x in symbols) and \
+                self.scrapper.forex_engine.interval < forex_age < float('inf'):
+            response.append('FX rates over %d min old' % max(forex_age // 60, 1))
+        return '\n'.join(response)
+
+    async def price_response(self, user_id, query):
+        symbol, symbol_dict, unknown = self.resolve_query(user_id, query)
+        response = ['Unknown symbol: %s' % ', '.join(unknown)] if len(unknown) > 0 else []
+        for x in unknown:
+            suggestions = self.symbol_index.suggest(x, user_id)
+            if len(suggestions) > 0:
+                response.append('Did you mean %s instead of %s?' % (', '.join(suggestions), x))
+        if len(symbol) == 0:
+            return '\n'.join(response)
+        quotes = await self.scheduler.report_quote(user_id, symbol)
+        if len({str(x) for x in symbol}) > self.scheduler.max_symbols:
+            response.append('Only the first %d symbols are fetched per request, the rest show cached quotes.' % self.scheduler.max_symbols)
+        self.logger.debug('Quotes = ' + json.dumps(quotes) + '\nSymbols =' + json.dumps(symbol))
+        response.append(self.render_quotes(quotes, symbol_dict))
+        return '\n'.join(response)
+
     async def ask_price(self, bot, update, args):
         user_id = update.message.from_user.id
         query_token = ' '.join(args)
         bot.send_chat_action(chat_id=update.message.chat_id, action=telegram.ChatAction.TYPING)
         if len(query_token) == 0:
-            query = self.check_watchlist(user_id)
+            query, _ = self.watchlists.page(User.objects(telegramUid=user_id)[0].id)
         else:
             query = query_token.split(',')
             query = [x.strip() for x in query]
-        symbol = [self.check_nickname(user_id, x) for x in query]
-        symbol_dict = {x: y for x, y in zip(symbol, query)}
+        if len(query) == 0:
+            bot.send_message(chat_id=update.message.chat_id, text='Your watchlist is empty')
+            return
         try:
-            quotes = await self.scrapper.report_quote(symbol)
-            symbols = [list(x.keys())[0] for x in quotes]
-            self.logger.debug('Quotes = ' + json.dumps(quotes) + '\nSymbols =' + json.dumps(symbols))
-            response = ['%s: %s' % (symbol_dict[list(x.keys())[0]], list(x.values())[0]) for x in quotes]
-            # is_increase = [x.split(',')[-1].split('(')[0] > 0 if '/' not in x else False for x in response]
-            # is_decrease = [x.find('-') > 0 for x in response]
-            sign = ['null' if '/' in x or x.split(',')[-1].split('(')[0] == 0 else 'down' if x.find('-') > 0 else 'up'
-                    for x in response]
-            response = ['📈 ' + x if y == 'up' else '📉 ' + x if y == 'down' else x for x, y in zip(response, sign)]
-            markdown_response = []
-            for res, symbol in zip(response, symbols):
-                market = 'hk' if symbol.isdigit() else 'us'
-                res = '['+res+']'
-                link = 'http://www.aastocks.com/tc/stocks/quote/detailchart.aspx?symbol='+symbol+'' if market=='hk' else \
-                    'https://finance.yahoo.com/chart/'+symbol+'#eyJpbnRlcnZhbCI6ImRheSIsInBlcmlvZGljaXR5IjoxLCJ0aW1lVW5pdCI6bnVsbCwiY2FuZGxlV2lkdGgiOjgsInZvbHVtZVVuZGVybGF5Ijp0cnVlLCJhZGoiOnRydWUsImNyb3NzaGFpciI6dHJ1ZSwiY2hhcnRUeXBlIjoiY2FuZGxlIiwiZXh0ZW5kZWQiOmZhbHNlLCJtYXJrZXRTZXNzaW9ucyI6e30sImFnZ3JlZ2F0aW9uVHlwZSI6Im9obGMiLCJjaGFydFNjYWxlIjoibGluZWFyIiwicGFuZWxzIjp7ImNoYXJ0Ijp7InBlcmNlbnQiOjEsImRpc3BsYXkiOiJBREJFIiwiY2hhcnROYW1lIjoiY2hhcnQiLCJ0b3AiOjB9fSwic2V0U3BhbiI6e30sImxpbmVXaWR0aCI6Miwic3RyaXBlZEJhY2tncm91ZCI6dHJ1ZSwiZXZlbnRzIjp0cnVlLCJjb2xvciI6IiMwMDgxZjIiLCJldmVudE1hcCI6eyJjb3Jwb3JhdGUiOnsiZGl2cyI6dHJ1ZSwic3BsaXRzIjp0cnVlfSwic2lnRGV2Ijp7fX0sInN5bWJvbHMiOlt7InN5bWJvbCI6IkFEQkUiLCJzeW1ib2xPYmplY3QiOnsic3ltYm9sIjoiQURCRSJ9LCJwZXJpb2RpY2l0eSI6MSwiaW50ZXJ2YWwiOiJkYXkiLCJ0aW1lVW5pdCI6bnVsbCwic2V0U3BhbiI6e319XSwic3R1ZGllcyI6eyJ2b2wgdW5kciI6eyJ0eXBlIjoidm9sIHVuZHIiLCJpbnB1dHMiOnsiaWQiOiJ2b2wgdW5kciIsImRpc3BsYXkiOiJ2b2wgdW5kciJ9LCJvdXRwdXRzIjp7IlVwIFZvbHVtZSI6IiMwMGIwNjEiLCJEb3duIFZvbHVtZSI6IiNGRjMzM0EifSwicGFuZWwiOiJjaGFydCIsInBhcmFtZXRlcnMiOnsid2lkdGhGYWN0b3IiOjAuNDUsImNoYXJ0TmFtZSI6ImNoYXJ0In19fX0%3D'
-                res += '('+link+')'
-                markdown_response.append(res)
-            markdown_response = '\n'.join(markdown_response)
+            markdown_response = await self.price_response(user_id, query)
             bot.send_message(chat_id=update.message.chat_id, text=markdown_response, parse_mode=telegram.ParseMode.MARKDOWN)
         except Exception as e:
             self.logger.error('Unable to scrap quotes. %s' % e)
 
-    @staticmethod
-    def market_classification(symbol):
-        if str(symbol).isdigit():
-            market = 'hk'
-        elif not str(symbol).isdigit() and '/' not in str(symbol):
-            market = 'us'
-        elif not str(symbol).isdigit() and '/' in str(symbol):
-            market = 'forex'
+    def history_args(self, user_id, args):
+        query = args[0].strip() if len(args) > 0 else ''
+        window = args[1].strip().lower() if len(args) > 1 else '1d'
+        if window not in self.scrapper.history.windows:
+            window = '1d'
+        return self.check_nickname(user_id, query), window
+
+    async def history_view(self, bot, update, args):
+        user_id = update.message.from_user.id
+        bot.send_chat_action(chat_id=update.message.chat_id, action=telegram.ChatAction.TYPING)
+        symbol, window = self.history_args(user_id, args)
+        try:
+            bars = self.scrapper.history.ohlc(symbol, window)
+        except Exception as e:
+            bars = None
+            self.logger.error('Unable to load history for %s. %s' % (symbol, e))
+        if bars is None:
+            response = 'No recorded history for %s' % symbol
         else:
-            market = 'unknonwn'
-        return market
+            response = ['%s (%s) O/H/L/C' % (symbol, window)] + [
+                '%s  %s / %s / %s / %s' % (datetime.utcfromtimestamp(t).strftime('%m-%d %H:%M'), o, h, l, c)
+                for t, o, h, l, c in zip(bars['time'], bars['open'], bars['high'], bars['low'], bars['close'])]
+            response = '\n'.join(response)
+        bot.send_message(chat_id=update.message.chat_id, text=response)
 
-    @staticmethod
-    def market_icon(symbol):
-        market_icon = ''
-        if str(symbol).isdigit():
-            market_icon = '🇭🇰'
-        elif not str(symbol).isdigit() and '/' not in str(symbol):
-            market_icon = '🇺🇸'
-        elif not str(symbol).isdigit() and '/' in str(symbol):
-            market_icon = ''
-        return market_icon
+    async def chart_view(self, bot, update, args):
+        user_id = update.message.from_user.id
+        bot.send_chat_action(chat_id=update.message.chat_id, action=telegram.ChatAction.UPLOAD_PHOTO)
+        symbol, window = self.history_args(user_id, args)
+        try:
+            image = self.chart.render(symbol, window)
+        except Exception as e:
+            image = None
+            self.logger.error('Unable to render chart for %s. %s' % (symbol, e))
+        if image is None:
+            bot.send_message(chat_id=update.message.chat_id, text='No recorded history for %s' % symbol)
+        else:
+            bot.send_photo(chat_id=update.message.chat_id, photo=BytesIO(image))
+
+    def market_classification(self, symbol):
+        return self.symbol_master.market(symbol)
+
+    def market_icon(self, symbol):
+        return self.symbol_master.icon(symbol)
 
     @staticmethod
     def get_method_name(method):
         if (method == 'change'):
             return 'priceChange'
+        elif (method == 'ma'):
+            return 'maCross'
         else:
             return method
 
@@ -360,7 +543,9 @@ class TelegramBot(object):
         symbol, nickname = args
         market = self.market_classification(symbol)
         users = User.objects(telegramUid=user_id)
-        Stock(symbol=symbol, nickname=nickname, createdBy=users[0].id, market=market).save()
+        Stock(symbol=symbol, nickname=nickname, createdBy=users[0].id, market=market,
+              updatedAt=datetime.utcnow()).save()
+        self.symbol_index.invalidate(user_id)
         market_icon = self.market_icon(symbol)
         response = '✅ New entry added:\nSymbol: %s, NickName: %s, Market: %s%s' % (symbol, nickname, market, market_icon)
         bot.send_message(chat_id=update.message.chat_id, text=response)
@@ -372,7 +557,7 @@ class TelegramBot(object):
         users = User.objects(telegramUid=user_id)
         if len(query_token) == 0:
             custom_keyboard = []
-            stocks = Stock.objects(createdBy=users[0].id)
+            stocks = Stock.objects(createdBy=users[0].id, nickname__ne=None)
             for stock in stocks:
                 custom_keyboard.append([telegram.KeyboardButton('/nickname_remove '+stock.nickname)])
             reply_markup = telegram.ReplyKeyboardMarkup(custom_keyboard)
@@ -383,7 +568,12 @@ class TelegramBot(object):
                 one_time_keyboard=True
             )
         else:
-            Stock.objects(Q(createdBy=users[0].id) & (Q(symbol=query_token) | Q(nickname=query_token))).delete()
+            stocks = Stock.objects(Q(createdBy=users[0].id) & (Q(symbol=query_token) | Q(nickname=query_token)))
+            # Alerts on the removed stock are disabled first, so that polling sweeps drop them right away.
+            NotificationSetting.objects(Q(createdBy=users[0].id) & Q(stock__in=[x.id for x in stocks])).update(
+                enabled=False, updatedAt=datetime.utcnow())
+            stocks.delete()
+            self.symbol_index.invalidate(user_id)
             response = '❎ Entry removed: %s' % query_token
             bot.send_message(chat_id=update.message.chat_id, text=response)
 
@@ -392,7 +582,7 @@ class TelegramBot(object):
         bot.send_chat_action(chat_id=update.message.chat_id, action=telegram.ChatAction.TYPING)
         users = User.objects(telegramUid=user_id)
         button_list = []
-        stocks = Stock.objects(createdBy=users[0].id)
+        stocks = Stock.objects(createdBy=users[0].id, nickname__ne=None)
         for stock in stocks:
             button_list.append([telegram.InlineKeyboardButton(text=stock.nickname + ' - ' + stock.symbol, callback_data='/nickname_list '+stock.nickname)])
         reply_markup = telegram.InlineKeyboardMarkup(button_list)
@@ -407,20 +597,38 @@ class TelegramBot(object):
     def callback_query_response(self, bot, update):
         bot.answerCallbackQuery(callback_query_id=update.callback_query.id, text=update.callback_query.data)
 
+    def inline_query_response(self, bot, update):
+        user_id = update.inline_query.from_user.id
+        results = []
+        for nickname, symbol in self.symbol_index.search(update.inline_query.query, user_id):
+            entry = self.symbol_master.get(symbol)
+            cached = self.scrapper.quote_cache.get(symbol)
+            title = symbol if nickname is None else '%s (%s)' % (symbol, nickname)
+            description = ' '.join(x for x in [entry.name if entry is not None else '',
+                                               cached[1] if cached is not None else ''] if len(x) > 0)
+            results.append(telegram.InlineQueryResultArticle(
+                id=symbol, title=title, description=description,
+                input_message_content=telegram.InputTextMessageContent('/ask_price %s' % symbol)))
+        bot.answer_inline_query(update.inline_query.id, results, cache_time=10, is_personal=True)
+
+
+    @staticmethod
+    def watchlist_args(args):
+        if len(args) > 1 and args[0].isalpha() and args[0].islower():
+            name, args = args[0], args[1:]
+        else:
+            name = None
+        symbol_list = ' '.join(args).split(',')
+        return name, [x.strip() for x in symbol_list if len(x.strip()) > 0]
 
     async def watchlist_add(self, bot, update, args):
         user_id = update.message.from_user.id
-        query_token = ' '.join(args)
         bot.send_chat_action(chat_id=update.message.chat_id, action=telegram.ChatAction.TYPING)
-        new_symbol_list = query_token.split(',')
-        new_symbol_list = [x.strip() for x in new_symbol_list]
-        old_symbol_list = self.check_watchlist(user_id)
-        symbol_list = list(set(old_symbol_list + new_symbol_list))
+        name, new_symbol_list = self.watchlist_args(args)
         users = User.objects(telegramUid=user_id)
-        # Watchlist.objects(createdBy=users[0].id).delete()
-        Watchlist.objects(createdBy=users[0].id).update_one(stockSymbols=symbol_list, upsert=True)
-        # Watchlist(createdBy=users[0].id, stockSymbols=symbol_list).save()
-        response = 'Watchlist added with symbols:\n%s' % ', '.join(new_symbol_list)
+        self.watchlists.add(users[0].id, new_symbol_list, name)
+        response = 'Watchlist %s added with symbols:\n%s' % (name or self.watchlists.default_name,
+                                                             ', '.join(new_symbol_list))
         bot.send_message(
             chat_id=update.message.chat.id,
             text=response
@@ -428,21 +636,70 @@ class TelegramBot(object):
 
     async def watchlist_remove(self, bot, update, args):
         user_id = update.message.from_user.id
-        query_token = ' '.join(args)
         bot.send_chat_action(chat_id=update.message.chat_id, action=telegram.ChatAction.TYPING)
-        del_symbol_list = query_token.split(',')
-        del_symbol_list = [x.strip() for x in del_symbol_list]
-        old_symbol_list = self.check_watchlist(user_id)
-        symbol_list = [x for x in old_symbol_list if x not in del_symbol_list]
+        name, del_symbol_list = self.watchlist_args(args)
         users = User.objects(telegramUid=user_id)
-        Watchlist.objects(createdBy=users[0].id).delete()
-        Watchlist(createdBy=users[0].id, stockSymbols=symbol_list).save()
-        response = 'Watchlist removed the symbols:\n%s' % ', '.join(del_symbol_list)
+        self.watchlists.remove(users[0].id, del_symbol_list, name)
+        response = 'Watchlist %s removed the symbols:\n%s' % (name or self.watchlists.default_name,
+                                                              ', '.join(del_symbol_list))
         bot.send_message(
             chat_id=update.message.chat.id,
             text=response
         )
 
+    async def watchlist_view(self, bot, update, args, live=False):
+        user_id = update.message.from_user.id
+        bot.send_chat_action(chat_id=update.message.chat_id, action=telegram.ChatAction.TYPING)
+        name = next((x for x in args if not x.isdigit()), None)
+        page = int(next((x for x in args if x.isdigit()), 1))
+        users = User.objects(telegramUid=user_id)
+        symbols, pages = self.watchlists.page(users[0].id, name, page)
+        name = name or self.watchlists.default_name
+        if len(symbols) == 0:
+            bot.send_message(chat_id=update.message.chat_id, text='Watchlist %s has no symbols on page %d' % (name, page))
+            return
+        if live:
+            await self.watchlist_live(bot, update, symbols)
+            return
+        try:
+            response = await self.price_response(user_id, symbols)
+            if pages > 1:
+                response += '\nPage %d/%d - /watchlist %s %d' % (page, pages, name, page % pages + 1)
+            bot.send_message(chat_id=update.message.chat_id, text=response, parse_mode=telegram.ParseMode.MARKDOWN)
+        except Exception as e:
+            self.logger.error('Unable to scrap quotes. %s' % e)
+
+    async def watchlist_live(self, bot, update, symbols):
+        chat_id = update.message.chat_id
+        user_id = update.message.from_user.id
+        response = await self.price_response(user_id, symbols)
+        message = bot.send_message(chat_id=chat_id, text=response, parse_mode=telegram.ParseMode.MARKDOWN)
+        symbols, symbol_dict, unknown = self.resolve_query(user_id, symbols)
+        expires = await self.live.start(chat_id, message.message_id, symbols[:self.scheduler.max_symbols],
+                                        symbol_dict, response)
+        if expires is None:
+            bot.send_message(chat_id=chat_id, text='Too many live watchlists running, try again later')
+            return
+        try:
+            bot.pin_chat_message(chat_id=chat_id, message_id=message.message_id, disable_notification=True)
+        except telegram.error.TelegramError as e:
+            self.logger.debug('Unable to pin live watchlist in %s. %s' % (chat_id, e))
+
+    async def watchlist_stop(self, bot, update, args):
+        chat_id = update.message.chat_id
+        stopped = self.live.stop(chat_id)
+        if stopped is not None:
+            await self.unpin_message(chat_id, stopped['message_id'])
+        bot.send_message(chat_id=chat_id,
+                         text='Live watchlist stopped' if stopped is not None else 'No live watchlist running')
+
+    async def watchlist_list(self, bot, update, args):
+        user_id = update.message.from_user.id
+        users = User.objects(telegramUid=user_id)
+        names = self.watchlists.names(users[0].id)
+        response = 'Watchlists: %s' % ', '.join(names) if len(names) > 0 else 'You have no watchlist'
+        bot.send_message(chat_id=update.message.chat_id, text=response)
+
     async def position_add(self, bot, update, args):
         user_id = update.message.from_user.id
         query_token = ' '.join(args)
@@ -462,14 +719,57 @@ class TelegramBot(object):
             text=response
         )
 
+    async def import_request(self, bot, update, args):
+        self.pending_imports[update.message.from_user.id] = time.time()
+        bot.send_message(
+            chat_id=update.message.chat_id,
+            text='Send a CSV file with the header %s within 10 minutes.' % ','.join(self.bulk_io.columns))
+
+    async def import_document(self, bot, update):
+        user_id = update.message.from_user.id
+        caption = update.message.caption or ''
+        requested = self.pending_imports.pop(user_id, 0)
+        if not caption.startswith('/import') and time.time() - requested > 600:
+            return
+        bot.send_chat_action(chat_id=update.message.chat_id, action=telegram.ChatAction.TYPING)
+        users = User.objects(telegramUid=user_id)
+        with tempfile.TemporaryFile() as document:
+            bot.get_file(update.message.document.file_id).download(out=document)
+            document.seek(0)
+            try:
+                report = self.bulk_io.import_csv(users[0].id, document)
+            except (ValueError, UnicodeDecodeError) as e:
+                bot.send_message(chat_id=update.message.chat_id, text='❌ Import failed: %s' % e)
+                return
+        self.symbol_index.invalidate(user_id)
+        response = ['✅ Imported %d positions and %d watchlist symbols, rejected %d rows.' % (
+            report['positions'], report['watchlist'], report['rejected'])] + report['errors']
+        bot.send_message(chat_id=update.message.chat_id, text='\n'.join(response))
+
+    async def export_csv(self, bot, update, args):
+        user_id = update.message.from_user.id
+        bot.send_chat_action(chat_id=update.message.chat_id, action=telegram.ChatAction.UPLOAD_DOCUMENT)
+        users = User.objects(telegramUid=user_id)
+        with self.bulk_io.export_csv(users[0].id) as document:
+            bot.send_document(chat_id=update.message.chat_id, document=document, filename='portfolio.csv')
+
     async def position_list(self, bot, update, args):
         user_id = update.message.from_user.id
         users = User.objects(telegramUid=user_id)
         bot.send_chat_action(chat_id=update.message.chat_id, action=telegram.ChatAction.TYPING)
-        position = Position.objects(createdBy=users[0].id)
-        position = ['Symbol: %s, Nickname: %s, unit price: %s, quantity: %s' % (
-            x.stock.symbol, x.stock.nickname, x.unitPrice, x.quantity) for x in position]
-        response = '\n'.join(position)
+        value = await self.portfolio.valuation(
+            users[0].id, report_quote=lambda x: self.scheduler.report_quote(user_id, x, limited=False))
+        if value is None:
+            response = 'You have no positions'
+        else:
+            response = ['%s %s (%s): %s @ %.4g -> %s, P&L %.2f %s (%.2f%%), weight %.1f%%' % (
+                '😆' if pnl > 0 else '😭', symbol, nickname, quantity, cost, price, pnl, value['base_currency'],
+                percent, weight) for symbol, nickname, quantity, cost, price, pnl, percent, weight in zip(
+                value['symbol'], value['nickname'], value['quantity'], value['unit_cost'], value['price'],
+                value['pnl'], value['percent'], value['weight'])]
+            response.append('Total = %.2f %s, P&L = %.2f %s' % (
+                value['total'], value['base_currency'], value['total_pnl'], value['base_currency']))
+            response = '\n'.join(response)
         bot.send_message(
             chat_id=update.message.chat.id,
             text=response
@@ -481,23 +781,16 @@ class TelegramBot(object):
         bot.send_chat_action(chat_id=update.message.chat_id, action=telegram.ChatAction.TYPING)
         query_token = ' '.join(args)
         query = query_token.strip()
-        users = User.objects(telegramUid=user_id)
-        stock = Stock.objects(Q(createdBy=users[0].id) & Q(nickname=query))
-        if len(stock) == 0:
-            stock = Stock.objects(Q(createdBy=users[0].id) & Q(symbol=query))
-        position = Position.objects(Q(createdBy=users[0].id) & Q(stock=stock[0].id))
-        position = position[0]
-        stock = stock[0]
-        old_price = position.unitPrice
-        quantity = position.quantity
-        new_price = await self.scrapper.report_quote([stock.symbol])
-        new_price = new_price[0][stock.symbol].split(',')[0]
-        profit = (float(new_price) - float(old_price)) * quantity
-        percent_profit = str((float(new_price) / float(old_price) - 1) * 100) + '%'
-        if profit > 0:
-            response = '😆 Profit = %s, Percent profit = %s' % (profit, percent_profit)
+        value = await self.portfolio.valuation(
+            users[0].id, query, report_quote=lambda x: self.scheduler.report_quote(user_id, x, limited=False))
+        if value is None:
+            response = 'You have no position for %s' % query
+        elif value['pnl'][0] > 0:
+            response = '😆 Profit = %.2f %s, Percent profit = %.2f%%' % (
+                value['pnl'][0], value['base_currency'], value['percent'][0])
         else:
-            response = '😭 Loss = %s, Percent loss = %s' % (profit, percent_profit)
+            response = '😭 Loss = %.2f %s, Percent loss = %.2f%%' % (
+                value['pnl'][0], value['base_currency'], value['percent'][0])
         bot.send_message(
             chat_id=update.message.chat.id,
             text=response
@@ -587,8 +880,14 @@ class TelegramBot(object):
         stock = Stock.objects(Q(createdBy=users[0].id) & Q(nickname=query))
         if len(stock) == 0:
             stock = Stock.objects(Q(createdBy=users[0].id) & Q(symbol=query))
+        window = int(args[3]) if len(args) > 3 else None
+        long_window = int(args[4]) if len(args) > 4 else None
+        if method in self.rolling.types and (window is None or (method == 'maCross' and long_window is None)):
+            bot.send_message(chat_id=update.message.chat.id, text='Please give the window length in minutes.')
+            return
         NotificationSetting(createdBy=users[0].id, stock=stock[0].id, type=method, threshold=threshold,
-                            enabled=True).save()
+                            window=window, longWindow=long_window, enabled=True,
+                            updatedAt=datetime.utcnow()).save()
         response = '🔈 Notification added:\nSymbol: %s, Nickname: %s, Threshold: %s, Type: %s' % (
             stock[0].symbol, stock[0].nickname, threshold, method)
         bot.send_message(
@@ -616,7 +915,7 @@ class TelegramBot(object):
         if len(stock) == 0:
             stock = Stock.objects(Q(createdBy=users[0].id) & Q(symbol=query))
         NotificationSetting.objects(Q(createdBy=users[0].id) & Q(stock=stock[0].id) & Q(type=method)).update(
-            enabled=False)
+            enabled=False, updatedAt=datetime.utcnow())
         response = '🔇 Notification removed for symbol %s of type %s' % (stock[0].symbol, method)
         bot.send_message(
             chat_id=update.message.chat.id,
@@ -636,7 +935,7 @@ class TelegramBot(object):
         user_id = update.message.from_user.id
         bot.send_chat_action(chat_id=update.message.chat_id, action=telegram.ChatAction.TYPING)
         users = User.objects(telegramUid=user_id)
-        UserSettings.objects(createdBy=users[0].id).update(notificationEnable=enable)
+        UserSettings.objects(createdBy=users[0].id).update(notificationEnable=enable, updatedAt=datetime.utcnow())
         if enable:
             response = '🔈 Notification enabled'
         else:
@@ -652,81 +951,207 @@ class TelegramBot(object):
     async def notification_disable(self, bot, update, args):
         await self.notification_switch(bot, update, False)
 
+    async def digest_switch(self, bot, update, enable):
+        user_id = update.message.from_user.id
+        bot.send_chat_action(chat_id=update.message.chat_id, action=telegram.ChatAction.TYPING)
+        users = User.objects(telegramUid=user_id)
+        UserSettings.objects(createdBy=users[0].id).update_one(digestEnable=enable, updatedAt=datetime.utcnow(),
+                                                               upsert=True)
+        if enable:
+            response = '🗞 Market digest enabled'
+        else:
+            response = '🔇 Market digest disabled'
+        bot.send_message(
+            chat_id=update.message.chat.id,
+            text=response
+        )
+
+    async def digest_enable(self, bot, update, args):
+        await self.digest_switch(bot, update, True)
+
+    async def digest_disable(self, bot, update, args):
+        await self.digest_switch(bot, update, False)
+
+    async def profile(self, bot, update, args):
+        user_id = update.message.from_user.id
+        if user_id not in self.admin_uids:
+            return
+        target = args[0] if len(args) > 0 else 'sweep'
+        iterations = int(args[1]) if len(args) > 1 and args[1].isdigit() else 1
+        chat_id = update.message.chat_id
+        try:
+            self.profiler.request(target, iterations, callback=lambda path, summary: self.updater.bot.send_message(
+                chat_id=chat_id, text='Profile written to %s.folded\n%s' % (path, summary)))
+        except ValueError:
+            bot.send_message(chat_id=chat_id, text='Unknown profile target %s, use one of: %s' % (
+                target, ', '.join(self.profile_targets)))
+            return
+        bot.send_message(chat_id=chat_id, text='Profiling the next %d run(s) of %s' % (iterations, target))
+
     def get_notification(self):
-        notification = NotificationSetting.objects(enabled=True)
-        notification = list(map(lambda x: {'user_id': x.createdBy.telegramUid, 'symbol': x.stock.symbol, 'type': x.type,
-                                           'threshold': x.threshold}, notification))
-        user_enabled = [x.createdBy.telegramUid for x in UserSettings.objects(notificationEnable=True)]
-        notification = [x for x in notification if x['user_id'] in user_enabled]
+        return self.alert_cache.snapshot()
+
+    async def check_notification(self, notification, quotes):
+        triggered = self.checks.evaluate(notification, quotes)
+        try:
+            self.outbox.enqueue(triggered)
+        except Exception as e:
+            self.logger.error('Unable to enqueue alerts. %s' % e)
+
+    def owned_notification(self):
+        notification = self.get_notification()
+        if self.shard is not None:
+            notification = [x for x in notification if self.shard.owns(x['symbol'])]
         return notification
 
-    async def price_change_notification(self, notification):
-        if ',' in notification['quote']:
-            print(notification['quote'])
+    async def loop_check_notification(self):
+        while True:
             try:
-                percentage_change = abs(float(notification['quote'].split('(')[-1].split('%')[0]) / 100)
-            except Exception:
-                percentage_change = 0
-            if percentage_change > notification['threshold']:
-                users = User.objects(telegramUid=notification['user_id'])
-                stock = Stock.objects(Q(createdBy=users[0].id) & Q(symbol=notification['symbol']))
-                NotificationSetting.objects(Q(createdBy=users[0].id) & Q(stock=stock[0].id) & Q(
-                    type='priceChange')).update(enabled=False)
-                await self.send_message(user_id=notification['user_id'],
-                                        content='Price change percentage for %s reached.' % notification['symbol'])
-
-    async def sl_notification(self, notification):
+                with self.profiler.section('sweep'):
+                    await self.sweep_notification()
+            except Exception as e:
+                self.logger.error('Notification sweep failed. %s' % e)
+            await asyncio.sleep(60)
+
+    async def sweep_notification(self):
+        notification = self.owned_notification()
+        symbols = [x['symbol'] for x in notification]
+        transfer = self.scrapper.transfer.copy()
+        if self.stream is None:
+            # The first sweep after a warm restart reuses recent snapshot quotes instead of rescraping them.
+            warm, self.warm_quotes = {x: self.warm_quotes[x] for x in symbols if x in self.warm_quotes}, {}
+            quotes = await self.scheduler.report_quote('sweep', [x for x in symbols if x not in warm], weight=4,
+                                                       limited=False)
+            quotes = dict(warm, **{k: v for x in quotes for k, v in x.items()})
+            await self.check_notification(notification, quotes)
+        else:
+            # Streamed symbols are evaluated from the bus; polling only fills in symbols the stream lacks
+            # and publishes them into the same bus. priceChange alerts also poll while the streamed quote has
+            # no percent yet, which also gives the stream the previous close it derives the change from.
+            cached = {x: self.scrapper.quote_cache.get(x, (0, '')) for x in set(symbols)}
+            stale = [x for x, y in cached.items() if time.time() - y[0] > 60] + sorted(
+                {x['symbol'] for x in notification if x['type'] == 'priceChange' and '(' not in cached[x['symbol']][1]
+                 and time.time() - cached[x['symbol']][0] <= 60})
+            await self.scheduler.report_quote('sweep', stale, weight=4, limited=False)
+        self.logger.info('Sweep transfer: %s' % self.scrapper.transfer_report(transfer, len(set(symbols))))
+
+    def notification_by_symbol(self, max_age=1):
+        index, built = self.alert_index
+        if time.time() - built > max_age:
+            index = {}
+            for x in self.owned_notification():
+                index.setdefault(x['symbol'], []).append(x)
+            self.alert_index = (index, time.time())
+        return index
+
+    async def loop_stream_notification(self, batch_interval=0.1):
+        subscription = self.scrapper.bus.subscribe()
         try:
-            price = float(notification['quote'].split(',')[0])
-        except Exception:
-            price = float('inf')
-        if price < notification['threshold']:
-            users = User.objects(telegramUid=notification['user_id'])
-            stock = Stock.objects(Q(createdBy=users[0].id) & Q(symbol=notification['symbol']))
-            [NotificationSetting.objects(Q(createdBy=users[0].id) & Q(stock=x.id) & Q(
-                type='sl')).update(enabled=False) for x in stock]
-            await self.send_message(user_id=notification['user_id'],
-                                    content='SL for %s reached.' % notification['symbol'])
-
-    async def tp_notification(self, notification):
+            while True:
+                symbol, tick = await subscription.get()
+                await asyncio.sleep(batch_interval)
+                ticks = dict([(symbol, tick)] + subscription.drain())
+                try:
+                    index = self.notification_by_symbol()
+                    notification = [y for x in ticks if x in index for y in index[x]]
+                    if len(notification) > 0:
+                        await self.check_notification(notification, {x: y[1] for x, y in ticks.items()})
+                except Exception as e:
+                    self.logger.error('Unable to check streamed quotes. %s' % e)
+        finally:
+            subscription.close()
+
+    async def loop_rolling_notification(self, batch_interval=0.1, sync_interval=5):
+        subscription = self.scrapper.bus.subscribe()
+        synced, index = 0, {}
         try:
-            price = float(notification['quote'].split(',')[0])
-        except Exception:
-            price = - float('inf')
-        if price > notification['threshold']:
-            users = User.objects(telegramUid=notification['user_id'])
-            stock = Stock.objects(Q(createdBy=users[0].id) & Q(symbol=notification['symbol']))
-            NotificationSetting.objects(Q(createdBy=users[0].id) & Q(stock=stock[0].id) & Q(type='tp')).update(
-                enabled=False)
-            await self.send_message(user_id=notification['user_id'],
-                                    content='TP for %s reached.' % notification['symbol'])
+            while True:
+                symbol, tick = await subscription.get()
+                await asyncio.sleep(batch_interval)
+                ticks = [(symbol, tick)] + subscription.drain()
+                try:
+                    if time.time() - synced > sync_interval:
+                        alerts = [x for x in self.owned_notification() if x['type'] in self.rolling.types]
+                        self.rolling.sync(alerts)
+                        index, synced = {}, time.time()
+                        for x in alerts:
+                            index.setdefault(x['symbol'], []).append(x)
+                    triggered, rearmed = [], []
+                    for symbol, (timestamp, quote) in ticks:
+                        price = parse_price(quote)
+                        if price is None:
+                            continue
+                        self.rolling.update(symbol, timestamp, price)
+                        for alert in index.get(symbol, []):
+                            content, rearm = self.rolling.evaluate(alert, price)
+                            if content is not None:
+                                triggered.append((alert, content))
+                            elif rearm:
+                                rearmed.append(alert['id'])
+                    self.outbox.enqueue(triggered, rearmable=True)
+                    self.outbox.rearm(rearmed)
+                except Exception as e:
+                    self.logger.error('Unable to evaluate rolling alerts. %s' % e)
+        finally:
+            subscription.close()
 
-    async def loop_check_notification(self):
+    async def loop_deliver_alerts(self):
         while True:
-            notification = self.get_notification()
-            symbols = [x['symbol'] for x in notification]
-            quotes = await self.scrapper.report_quote(symbols)
-            notification = [{**x, **{'quote': [y for y in quotes if x['symbol'] in y][0][x['symbol']]}}
-                            for x in notification]
-            price_change_notification = [x for x in notification if x['type'] == 'priceChange']
-            sl_notification = [x for x in notification if x['type'] == 'sl']
-            tp_notification = [x for x in notification if x['type'] == 'tp']
-            tasks = [asyncio.ensure_future(self.price_change_notification(x)) for x in price_change_notification] + [
-                asyncio.ensure_future(self.sl_notification(x)) for x in sl_notification] + [
-                asyncio.ensure_future(self.tp_notification(x)) for x in tp_notification]
-            await asyncio.gather(*tasks)
-            await asyncio.sleep(60)
+            try:
+                # The outbox schedules retries with backoff, so each send is a single attempt.
+                delivered = await self.outbox.deliver(lambda content, user_id: self.send_message(content, user_id, 1))
+            except Exception as e:
+                delivered = 0
+                self.logger.error('Unable to deliver alerts. %s' % e)
+            if delivered == 0:
+                await asyncio.sleep(5)
+
+    def snapshot_state(self):
+        return self.snapshot.capture(self.scrapper, self.alert_cache, self.symbol_index, self.rolling)
+
+    def restore_snapshot(self):
+        state = self.snapshot.load()
+        if state is not None:
+            self.warm_quotes = self.snapshot.restore(state, self.scrapper, self.alert_cache, self.symbol_index,
+                                                     self.rolling)
+
+    def sweep_tasks(self, digest=False):
+        self.alert_cache.start()
+        self.symbol_master.start()
+        tasks = [('sweep', self.loop_check_notification), ('delivery', self.loop_deliver_alerts),
+                 ('rolling', self.loop_rolling_notification)]
+        if digest:
+            tasks += [('digest', self.digest.loop_digest), ('live', self.live.loop_live),
+                      ('snapshot', lambda: self.snapshot.loop_save(self.snapshot_state))]
+        if self.stream is not None:
+            tasks += self.stream.tasks() + [('stream_notification', self.loop_stream_notification)]
+        if self.shard is not None:
+            self.shard.heartbeat()
+            tasks.append(('heartbeat', self.shard.loop_heartbeat))
+        return self.supervisor.run(tasks)
 
     def thread_check_notification(self):
         asyncio.set_event_loop(self.scrapper.loop)
         asyncio.get_child_watcher().attach_loop(self.scrapper.loop)
-        thread = threading.Thread(target=lambda: self.scrapper.loop.run_until_complete(self.loop_check_notification()),
+        thread = threading.Thread(target=lambda: self.scrapper.loop.run_until_complete(self.sweep_tasks(True)),
                                   daemon=True)
         thread.start()
 
+    def run_sweep_worker(self):
+        asyncio.set_event_loop(self.scrapper.loop)
+        try:
+            self.scrapper.loop.run_until_complete(self.sweep_tasks())
+        finally:
+            if self.shard is not None:
+                self.shard.release()
+
 
 def main():
     tg_bot = TelegramBot()
+    # SWEEP_ONLY=1 runs an extra sweep process (usually with SWEEP_SHARDING=1) that does not poll Telegram.
+    if os.environ.get('SWEEP_ONLY'):
+        tg_bot.run_sweep_worker()
+        return
     tg_bot.setup_handler()
     tg_bot.thread_check_notification()
     tg_bot.updater.start_polling()
@@ -734,14 +1159,12 @@ def main():
     # print(tg_bot.loop.run_until_complete(tg_bot.get_message()))
     # print(tg_bot.loop.run_until_complete(tg_bot.get_unprocessed_message()))
     # print(tg_bot.loop.run_until_complete(tg_bot.send_message('Testing', 189497538)))
-    # print(tg_bot.check_watchlist(189497538))
     # asyncio.set_event_loop(tg_bot.loop)
     # print(tg_bot.loop.run_until_complete(
     #     tg_bot.watchlist_remove({'message_id': 29, 'from': {'id': 189497538, 'is_bot': False, 'first_name': 'SCTYS', 'username': 'sctys', 'language_code': 'en-US'}, 'chat': {'id': 189497538, 'first_name': 'SCTYS', 'username': 'sctys', 'type': 'private'}, 'date': 1540632514, 'text': '/watchlist/remove 66, 821'})
     #     ))
     # print(tg_bot.loop.run_until_complete(tg_bot.get_message()))
     # tg_bot.loop.run_until_complete()
-    # print(tg_bot.check_watchlist(263664408))
     # asyncio.set_event_loop(tg_bot.loop)
     # print(tg_bot.loop.run_until_complete(tg_bot.notification_enable({'message_id': 29, 'from': {'id': 263664408, 'is_bot': False, 'first_name': 'SCTYS', 'username': 'sctys', 'language_code': 'en-US'}, 'chat': {'id': 263664408, 'first_name': 'SCTYS', 'username': 'sctys', 'type': 'private'}, 'date': 1540632514, 'text': '/notification/enable'})))
 
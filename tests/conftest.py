@@ -0,0 +1,68 @@
+import os
+import random
+import sys
+import pytest
+
+# db.py connects lazily, so unit tests only need a connection string; tests that talk to MongoDB skip without one.
+os.environ.setdefault('DB_CONN', 'mongodb://localhost:27017/stock_quote_bot_test')
+os.environ.setdefault('ONEFORGE_API', 'test')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from stock_scrapper import StockScrapper
+
+# Local stand-ins for aastocks, nasdaq and 1forge: no network and, with persist_history=False, no MongoDB writes.
+HK_PAGE = '<html><body><table class="quote_table"><tr><td class="two bottom right cell_last">' \
+          '<div>Last</div><div>%.3f</div><div>+0.20(+0.50%%)</div></td></tr></table>%s</body></html>'
+US_PAGE = '<html><body><div id="qwidget_lastsale">$%.2f</div><div id="qwidget_netchange" ' \
+          'class="qwidget-cents qwidget-Red">0.35</div><div id="qwidget_percent">0.41%%</div>%s</body></html>'
+PADDING = '<p>%s</p>' % ('x' * 20000)
+
+
+class LocalScrapper(StockScrapper):
+
+    async def fetch_page(self, url, limit=None):
+        page = HK_PAGE if 'aastocks' in url else US_PAGE
+        page = (page % (random.uniform(10, 500), PADDING)).encode('utf-8')
+        return page[:limit[0]] if limit is not None else page
+
+    async def forex_api_fetch(self, url):
+        pairs = url.split('pairs=')[1].split('&')[0].split(',')
+        return [{'symbol': x, 'price': random.uniform(0.5, 2.0)} for x in pairs]
+
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'slow: long-running checks, deselect with -m "not slow"')
+
+
+@pytest.fixture
+def mongo():
+    from pymongo import MongoClient
+    from pymongo.errors import PyMongoError
+    client = MongoClient(os.environ['DB_CONN'], serverSelectionTimeoutMS=500)
+    try:
+        client.admin.command('ping')
+    except PyMongoError:
+        pytest.skip('MongoDB is not available at %s' % os.environ['DB_CONN'])
+    db = client.get_default_database()
+    for name in db.list_collection_names():
+        db[name].delete_many({})
+    yield db
+    client.close()
+
+
+@pytest.fixture(autouse=True)
+def workdir(tmp_path, monkeypatch):
+    # The bot and the scrapper open stock_quote_bot.log in the working directory.
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
+
+
+@pytest.fixture(autouse=True)
+def event_loop():
+    # StockScrapper and QuoteBus bind to the current event loop when they are built.
+    import asyncio
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    yield loop
+    asyncio.set_event_loop(None)
+    loop.close()
@@ -0,0 +1,116 @@
+import threading
+from datetime import datetime
+from bson import ObjectId
+from alert_cache import AlertCache
+
+
+class Stream(object):
+
+    def __init__(self, changes):
+        self.changes = list(changes)
+        self.alive = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def try_next(self):
+        return self.changes.pop(0) if self.changes else None
+
+
+class Users(object):
+
+    def __init__(self, users, lock):
+        self.users = users
+        self.lock = lock
+        self.locked = []
+
+    def find(self, query, projection):
+        self.locked.append(self.lock.locked())
+        return [{'_id': x, 'telegramUid': self.users[x]} for x in query['_id']['$in'] if x in self.users]
+
+
+def cache_with(changes):
+    cache = AlertCache()
+    cache.reconcile_interval = float('inf')
+    cache.db = type('Db', (object,), {'watch': lambda self, *args, **kwargs: Stream(changes)})()
+    return cache
+
+
+def test_watch_applies_crud_and_returns_on_invalidate():
+    key = ObjectId()
+    cache = cache_with([
+        {'operationType': 'insert', 'ns': {'coll': 'stocks'}, 'documentKey': {'_id': key},
+         'fullDocument': {'_id': key, 'symbol': '700'}},
+        {'operationType': 'drop', 'ns': {'coll': 'stocks'}},
+        {'operationType': 'insert', 'ns': {'coll': 'stocks'}, 'documentKey': {'_id': ObjectId()},
+         'fullDocument': {'symbol': 'never applied'}}])
+    thread = threading.Thread(target=cache.watch, daemon=True)
+    thread.start()
+    thread.join(5)
+    assert not thread.is_alive()
+    assert list(cache.stocks) == [key]
+
+
+def test_snapshot_resolves_users_outside_the_lock():
+    user, stock, notification = ObjectId(), ObjectId(), ObjectId()
+    cache = AlertCache()
+    cache.db = type('Db', (object,), {})()
+    cache.db.users = Users({user: 42}, cache.lock)
+    cache.user_settings = {ObjectId(): {'createdBy': user, 'notificationEnable': True}}
+    cache.stocks = {stock: {'symbol': '5'}}
+    cache.notifications = {notification: {'_id': notification, 'createdBy': user, 'stock': stock, 'type': 'sl',
+                                          'threshold': 1.5, 'enabled': True}}
+    snapshot = cache.snapshot()
+    assert [(x['user_id'], x['symbol'], x['threshold']) for x in snapshot] == [(42, '5', 1.5)]
+    assert cache.db.users.locked == [False]
+    cache.snapshot()
+    assert len(cache.db.users.locked) == 1
+
+
+class Collection(object):
+
+    def __init__(self, documents):
+        self.documents = documents
+
+    def find(self, query, projection=None):
+        since = query.get('updatedAt', {}).get('$gte')
+        return [x for x in self.documents if since is None or x.get('updatedAt', since) >= since]
+
+
+class Db(object):
+
+    def __init__(self, **collections):
+        self.__dict__.update(collections)
+
+    def __getitem__(self, name):
+        return getattr(self, name)
+
+
+def test_poll_drops_disabled_alerts_and_reconciles_deletes():
+    user, stock, notification = ObjectId(), ObjectId(), ObjectId()
+    cache = AlertCache()
+    cache.db = Db(notificationsettings=Collection([]), usersettings=Collection([]), stocks=Collection([]),
+                  users=Collection([{'_id': user, 'telegramUid': 42}]))
+    cache.db['usersettings'].documents.append({'_id': ObjectId(), 'createdBy': user, 'notificationEnable': True,
+                                               'updatedAt': datetime(2026, 1, 1)})
+    cache.db['stocks'].documents.append({'_id': stock, 'symbol': '700', 'updatedAt': datetime(2026, 1, 1)})
+    setting = {'_id': notification, 'createdBy': user, 'stock': stock, 'type': 'sl', 'threshold': 300.0,
+               'enabled': True, 'updatedAt': datetime(2026, 1, 1)}
+    cache.db['notificationsettings'].documents.append(setting)
+    cache.reconcile()
+    assert len(cache.snapshot()) == 1
+    cache.db['notificationsettings'].documents[0] = dict(setting, enabled=False, updatedAt=datetime(2026, 1, 2))
+    cache.poll_once()
+    assert cache.snapshot() == []
+    # A hard-deleted stock is not seen by polling updatedAt, only by the short poll-mode reconcile.
+    cache.db['notificationsettings'].documents[0] = setting
+    cache.reconcile()
+    cache.db['stocks'].documents = []
+    cache.poll_once()
+    assert len(cache.snapshot()) == 1
+    cache.last_reconcile -= cache.poll_reconcile_interval + 1
+    cache.poll_once()
+    assert cache.snapshot() == []
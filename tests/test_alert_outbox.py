@@ -0,0 +1,51 @@
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+from alert_outbox import AlertOutbox
+
+
+def test_backoff_doubles_and_caps():
+    outbox = SimpleNamespace(retry_base=5, retry_cap=900)
+    assert [AlertOutbox.backoff(outbox, x) for x in (1, 2, 3, 4)] == [5, 10, 20, 40]
+    assert AlertOutbox.backoff(outbox, 20) == 900
+
+
+def enqueue(mongo, outbox, count):
+    ids = [mongo.notificationsettings.insert_one({'enabled': True, 'type': 'sl'}).inserted_id for _ in range(count)]
+    outbox.enqueue([({'id': x, 'user_id': 1}, 'alert %d' % i) for i, x in enumerate(ids)])
+    return ids
+
+
+def test_claim_batch_and_backoff_after_failed_send(mongo):
+    outbox = AlertOutbox(batch_size=3)
+    enqueue(mongo, outbox, 5)
+    claimed = outbox.claim()
+    assert len(claimed) == 3
+    assert all(x['delivery']['status'] == 'sending' and x['delivery']['attempts'] == 1 for x in claimed)
+    assert len(outbox.claim()) == 2
+    assert outbox.claim() == []
+
+    async def down(content, user_id):
+        return None
+    mongo.notificationsettings.update_many({}, {'$set': {'delivery.status': 'pending',
+                                                         'delivery.leaseUntil': datetime.utcnow()}})
+    assert asyncio.run(outbox.deliver(down)) == 3
+    # Failed alerts wait out their backoff instead of being reclaimed straight away.
+    retried = list(mongo.notificationsettings.find({'delivery.attempts': 2}))
+    assert len(retried) == 3
+    assert all(x['delivery']['status'] == 'pending' and x['delivery']['leaseUntil'] > datetime.utcnow()
+               for x in retried)
+    assert len(outbox.claim()) == 2
+
+
+def test_deliver_marks_sent(mongo):
+    outbox = AlertOutbox()
+    enqueue(mongo, outbox, 2)
+    sent = []
+
+    async def up(content, user_id):
+        sent.append(content)
+        return {'ok': True}
+    assert asyncio.run(outbox.deliver(up)) == 2
+    assert sorted(sent) == ['alert 0', 'alert 1']
+    assert mongo.notificationsettings.count_documents({'delivery.status': 'sent'}) == 2
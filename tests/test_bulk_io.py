@@ -0,0 +1,36 @@
+import io
+from bson import ObjectId
+from bulk_io import BulkIO
+from symbol_index import SymbolIndex
+from symbol_master import SymbolMaster
+from watchlist_repository import WatchlistRepository
+
+
+def csv_file(*rows):
+    return io.BytesIO(('\n'.join(('type,symbol,unit_price,quantity,watchlist',) + rows) + '\n').encode('utf-8'))
+
+
+def test_repeated_imports_reuse_stocks_case_insensitively(mongo):
+    user = ObjectId()
+    bulk_io = BulkIO(SymbolIndex(SymbolMaster()), WatchlistRepository())
+    mongo.stocks.insert_one({'createdBy': user, 'symbol': 'aapl', 'nickname': 'apple'})
+    report = bulk_io.import_csv(user, csv_file('position,AAPL,150,10,', 'position,msft,120,5,', 'position,MSFT,121,5,',
+                                               'position,apple,151,1,', 'watchlist,Msft,,,tech', 'position,APPL,1,1,'))
+    assert (report['positions'], report['watchlist'], report['rejected']) == (4, 1, 1)
+    bulk_io.import_csv(user, csv_file('position,msft,122,5,'))
+    stocks = list(mongo.stocks.find({'createdBy': user}))
+    assert sorted(x['symbol'] for x in stocks) == ['MSFT', 'aapl']
+    assert [x for x in stocks if x['symbol'] == 'MSFT'][0].get('nickname') is None
+    assert mongo.watchlists.find_one({'createdBy': user, 'name': 'tech'})['stockSymbols'] == ['MSFT']
+
+
+def test_rejected_writes_are_reported(mongo):
+    user = ObjectId()
+    bulk_io = BulkIO(SymbolIndex(SymbolMaster()), WatchlistRepository())
+    mongo.positions.create_index('unitPrice', unique=True, name='test_unit_price')
+    try:
+        report = bulk_io.import_csv(user, csv_file('position,700,300,100,', 'position,700,300,200,'))
+    finally:
+        mongo.positions.drop_index('test_unit_price')
+    assert (report['positions'], report['rejected']) == (1, 1)
+    assert report['errors'][0].startswith('line 3: ')
@@ -0,0 +1,40 @@
+import asyncio
+from datetime import datetime
+from types import SimpleNamespace
+from digest import DigestEngine
+from portfolio import Portfolio
+from symbol_master import SymbolMaster
+
+
+def engine(fetched=None):
+    scrapper = SimpleNamespace(symbol_master=SymbolMaster())
+
+    async def report_quote(symbols):
+        fetched.extend(symbols)
+        return [{x: '7.8' if x == 'USD/HKD' else 'Not available'} for x in symbols]
+    scrapper.report_quote = report_quote
+    return DigestEngine(scrapper, send=None, schedule='hk_open=01:30,us_close=20:10',
+                        portfolio=Portfolio(scrapper, 'HKD'))
+
+
+def test_digest_skips_weekends_and_holidays():
+    digest = engine()
+    digest.fired = {}
+    # Friday 2026-10-16 trades in both markets, the Saturday in neither.
+    assert digest.due(datetime(2026, 10, 16, 21, 0)) == ['hk_open', 'us_close']
+    assert digest.due(datetime(2026, 10, 17, 21, 0)) == []
+    # Monday 2026-10-19 is an HKEX holiday but NYSE is open.
+    assert digest.due(datetime(2026, 10, 19, 21, 0)) == ['us_close']
+    assert digest.due(datetime(2026, 10, 19, 22, 0)) == []
+
+
+def test_digest_pnl_line_values_positions():
+    fetched = []
+    digest = engine(fetched)
+    lots = [{'symbol': '700', 'nickname': 'tencent', 'unit_price': 300.0, 'quantity': 100.0},
+            {'symbol': 'AAPL', 'nickname': 'apple', 'unit_price': 100.0, 'quantity': 10.0}]
+    quotes = {'700': '330.0,+3.0(+0.9%)', 'AAPL': '110.00,+1.00(+0.9%)'}
+    line = asyncio.run(digest.pnl_line(lots, quotes))
+    # 100 * 30 HKD + 10 * 10 USD * 7.8 = 3780 HKD on a cost of 30000 + 7800.
+    assert line == 'Positions: 41580.00 HKD, P&L 3780.00 HKD (10.00%)'
+    assert fetched == ['USD/HKD']
@@ -0,0 +1,42 @@
+import asyncio
+import numpy as np
+from fair_scheduler import FairScheduler
+from conftest import LocalScrapper
+from portfolio import Portfolio
+from symbol_master import SymbolMaster
+
+
+def test_jobs_are_recorded_once_per_request():
+    scrapper = LocalScrapper(SymbolMaster(), persist_history=False)
+    recorded = []
+    scrapper.record_quotes = lambda quotes, publish=True: recorded.append(quotes)
+    scheduler = FairScheduler(scrapper, capacity=2, max_symbols=10, burst=10, rate=1)
+    quotes = asyncio.get_event_loop().run_until_complete(
+        scheduler.report_quote(1, ['700', 'IBM', '700', 'EUR/USD', 'USD/JPY']))
+    assert sorted(k for x in quotes for k in x) == ['700', 'EUR/USD', 'IBM', 'USD/JPY']
+    assert len(recorded) == 1
+    assert sorted(k for x in recorded[0] for k in x) == ['700', 'EUR/USD', 'IBM', 'USD/JPY']
+
+
+def test_symbols_past_the_cap_are_answered_from_cache():
+    scrapper = LocalScrapper(SymbolMaster(), persist_history=False)
+    scheduler = FairScheduler(scrapper, capacity=4, max_symbols=20, burst=100, rate=1)
+    symbols = [str(x) for x in range(1, 26)]
+    scrapper.record_quotes([{'25': '10.00'}])
+    quotes = asyncio.get_event_loop().run_until_complete(scheduler.report_quote(1, symbols))
+    quotes = {k: v for x in quotes for k, v in x.items()}
+    assert sorted(quotes, key=int) == symbols
+    assert quotes['25'] == '10.00 (cached)'
+    assert all(quotes[x] == 'Not available (quota exceeded)' for x in symbols[20:24])
+    assert all('Not available' not in quotes[x] for x in symbols[:20])
+
+
+def test_large_portfolio_is_valued_in_full():
+    scrapper = LocalScrapper(SymbolMaster(), persist_history=False)
+    scheduler = FairScheduler(scrapper, capacity=4, max_symbols=20)
+    lots = [{'symbol': str(x), 'nickname': str(x), 'unit_price': 10.0, 'quantity': 100.0} for x in range(1, 21)]
+    lots.append({'symbol': 'AAPL', 'nickname': 'AAPL', 'unit_price': 100.0, 'quantity': 10.0})
+    value = asyncio.get_event_loop().run_until_complete(Portfolio(scrapper, base_currency='HKD').valuation(
+        None, report_quote=lambda x: scheduler.report_quote(1, x, limited=False), lots=lots))
+    assert not np.isnan(value['price']).any() and not np.isnan(value['market_value']).any()
+    assert value['total'] == np.sum(value['market_value'])
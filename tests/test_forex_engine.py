@@ -0,0 +1,57 @@
+import asyncio
+import logging
+import math
+import time
+from forex_engine import ForexEngine
+from conftest import LocalScrapper
+from symbol_master import SymbolMaster
+
+PAGE = [{'symbol': 'EURUSD', 'price': 1.1}, {'symbol': 'GBPUSD', 'price': 1.25}, {'symbol': 'USDJPY', 'price': 150.0},
+        {'symbol': 'USDHKD', 'price': 7.8}, {'symbol': 'XAUUSD', 'price': 2000.0}]
+
+
+def test_crosses_and_inverse_pairs_are_derived_from_usd_rates():
+    engine = ForexEngine(scrapper=None)
+    engine.update(PAGE)
+    rates = engine.derive(['EUR/USD', 'USD/EUR', 'EUR/GBP', 'GBP/JPY', 'HKD/JPY', 'XAU/HKD', 'USD/USD', 'USD/TRY'])
+    expected = [1.1, 1 / 1.1, 1.1 / 1.25, 1.25 * 150, 150 / 7.8, 2000 * 7.8, 1.0]
+    assert all(abs(x - y) < 1e-9 * y for x, y in zip(rates, expected))
+    assert math.isnan(rates[-1])
+
+
+def test_non_positive_rates_are_ignored():
+    engine = ForexEngine(scrapper=None)
+    engine.update([{'symbol': 'EURUSD', 'price': 0}, {'symbol': 'usdjpy', 'price': '150'}])
+    assert engine.usd == {'USD': 1.0, 'JPY': 1 / 150.0}
+
+
+def test_stale_base_rates_are_reported(caplog):
+    scrapper = LocalScrapper(SymbolMaster(), persist_history=False)
+    engine = ForexEngine(scrapper, interval=60)
+    assert engine.age == float('inf')
+    engine.update(PAGE)
+    engine.fetched_at = time.time() - 150
+    engine.refreshing = True
+    with caplog.at_level(logging.WARNING, logger='forex_engine'):
+        derived, direct = asyncio.get_event_loop().run_until_complete(engine.quotes(['EUR/GBP']))
+    assert derived == {'EUR/GBP': '0.88'} and direct == []
+    assert 150 <= engine.age < 160
+    assert any('stale' in x.getMessage() for x in caplog.records)
+
+
+def test_pairs_outside_the_base_set_are_fetched_directly():
+    scrapper = LocalScrapper(SymbolMaster(), persist_history=False)
+    fetch, urls = scrapper.forex_api_fetch, []
+
+    async def recording_fetch(url):
+        urls.append(url)
+        return await fetch(url)
+    scrapper.forex_api_fetch = recording_fetch
+    loop = asyncio.get_event_loop()
+    quotes = loop.run_until_complete(scrapper.forex_api(['EUR/GBP', 'USD/TRY', 'HKD/JPY']))
+    assert [list(x)[0] for x in quotes] == ['EUR/GBP', 'HKD/JPY', 'USD/TRY']
+    assert len(urls) == 2 and 'pairs=USDTRY&' in urls[1]
+    assert urls[0].split('pairs=')[1].split('&')[0] == ','.join(x.replace('/', '') for x in ForexEngine.base_pairs)
+    # A second request within the interval reuses the base set and only fetches the direct pair again.
+    loop.run_until_complete(scrapper.forex_api(['EUR/GBP', 'USD/TRY']))
+    assert len(urls) == 3 and 'pairs=USDTRY&' in urls[2]
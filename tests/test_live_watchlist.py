@@ -0,0 +1,53 @@
+import asyncio
+import time
+from types import SimpleNamespace
+from live_watchlist import LiveWatchlist
+
+
+class Scheduler(object):
+
+    def __init__(self):
+        self.scrapper = SimpleNamespace(quote_cache={})
+
+    async def report_quote(self, user, symbols, weight=None, limited=True):
+        return [{x: '1.00, +0.01(+1.00%)'} for x in symbols]
+
+
+def test_unchanged_renders_are_not_edited_and_expired_sessions_unpin():
+    edits, unpins = [], []
+
+    async def edit(chat_id, message_id, text):
+        edits.append((chat_id, text))
+        return 0
+
+    async def unpin(chat_id, message_id):
+        unpins.append((chat_id, message_id))
+    live = LiveWatchlist(Scheduler(), lambda quotes, labels: str(quotes), edit, interval=0, duration=600,
+                         edit_interval=0, unpin=unpin)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(live.start(1, 10, ['700'], {'700': '700'}, ''))
+    assert loop.run_until_complete(live.tick()) == 1
+    assert loop.run_until_complete(live.tick()) == 0
+    assert unpins == []
+    live.sessions[1]['expires'] = time.time() - 1
+    assert loop.run_until_complete(live.tick()) == 1
+    assert edits[-1][1].endswith('Live updates ended.')
+    assert unpins == [(1, 10)] and live.sessions == {}
+
+
+def test_restarting_in_a_chat_unpins_the_previous_session():
+    unpins = []
+
+    async def edit(chat_id, message_id, text):
+        return 0
+
+    async def unpin(chat_id, message_id):
+        unpins.append((chat_id, message_id))
+    live = LiveWatchlist(Scheduler(), lambda quotes, labels: str(quotes), edit, unpin=unpin, max_sessions=2)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(live.start(1, 10, ['700'], {'700': '700'}, ''))
+    loop.run_until_complete(live.start(2, 20, ['700'], {'700': '700'}, ''))
+    assert loop.run_until_complete(live.start(1, 11, ['5'], {'5': '5'}, '')) is not None
+    assert unpins == [(1, 10)]
+    assert live.sessions[1]['message_id'] == 11 and live.sessions[1]['symbols'] == ['5']
+    assert len(live.sessions) == 2
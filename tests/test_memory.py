@@ -0,0 +1,106 @@
+import gc
+import logging
+import random
+import tracemalloc
+import pytest
+from bson import ObjectId
+from alert_cache import AlertCache
+from alert_checks import AlertChecks
+from conftest import LocalScrapper
+from fair_scheduler import FairScheduler
+from forex_engine import ForexEngine
+from quote_history import parse_price
+from rolling import RollingEngine
+from symbol_master import SymbolMaster
+
+# Simulated sweeps against the local stand-ins, asserting a flat footprint once every symbol has been seen.
+# Peak memory per 1k symbols is printed: python -m pytest -m slow -s tests/test_memory.py
+
+
+def universe(size):
+    hk = [str(x) for x in range(1, size // 2 + 1)]
+    us = ['T%s' % ''.join(chr(65 + int(y)) for y in str(x)) for x in range(size - len(hk))]
+    return hk + us + [x for x in ForexEngine.base_pairs]
+
+
+def alert_cache_for(symbols, user_id=1):
+    # Filled in memory the way reconcile would, so AlertCache.snapshot runs without MongoDB.
+    cache = AlertCache()
+    user = ObjectId()
+    cache.users = {user: user_id}
+    cache.user_settings = {user: {'_id': user, 'createdBy': user, 'notificationEnable': True}}
+    for symbol in symbols:
+        stock = ObjectId()
+        cache.stocks[stock] = {'_id': stock, 'symbol': symbol}
+        for kind, threshold in (('sl', 100), ('tp', 400), ('priceChange', 0.004)):
+            key = ObjectId()
+            cache.notifications[key] = {'_id': key, 'createdBy': user, 'stock': stock, 'type': kind,
+                                        'threshold': threshold, 'enabled': True}
+    return cache
+
+
+async def sweeps(count, size, outbox=None, mongo=None):
+    scrapper = LocalScrapper(SymbolMaster(), persist_history=False)
+    scrapper.logger.setLevel(logging.WARNING)
+    scheduler = FairScheduler(scrapper)
+    rolling = RollingEngine()
+    checks = AlertChecks()
+    symbols = universe(size * 10)
+    cache = alert_cache_for(symbols)
+    if mongo is not None:
+        mongo.notificationsettings.insert_many([dict(x) for x in cache.notifications.values()])
+    rolling.sync([{'id': i, 'symbol': x, 'type': 'move', 'threshold': 0.05, 'window': 15}
+                  for i, x in enumerate(symbols)])
+    subscription = scrapper.bus.subscribe()
+    # Every symbol gets its fixed-size history ring on first sight, so touch them all before the baseline.
+    for i in range(0, len(symbols), size):
+        await scheduler.report_quote('sweep', symbols[i:i + size], limited=False)
+    subscription.drain()
+    warmup = max(count // 10, 1)
+    baseline = None
+    for i in range(count):
+        swept = set(random.sample(symbols, size))
+        notification = [x for x in cache.snapshot() if x['symbol'] in swept]
+        quotes = await scheduler.report_quote('sweep', sorted(swept), limited=False)
+        quotes = {k: v for x in quotes for k, v in x.items()}
+        triggered = checks.evaluate(notification, quotes)
+        assert len(triggered) > 0
+        if outbox is not None:
+            outbox.enqueue(triggered)
+            outbox.complete([x['_id'] for x in outbox.claim()])
+            # Delivered alerts are re-enabled so that every sweep keeps exercising the outbox.
+            mongo.notificationsettings.update_many({}, {'$set': {'enabled': True}, '$unset': {'delivery': ''}})
+        # Rolling windows run on a simulated one-minute sweep clock so that eviction happens.
+        for symbol, (timestamp, quote) in subscription.drain():
+            price = parse_price(quote)
+            if price is not None:
+                rolling.update(symbol, i * 60.0, price)
+        if i + 1 == warmup:
+            gc.collect()
+            baseline = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+    gc.collect()
+    current, peak = tracemalloc.get_traced_memory()
+    return baseline, current, peak, len(symbols)
+
+
+def assert_flat(event_loop, count, size, **kwargs):
+    tracemalloc.start()
+    try:
+        baseline, current, peak, tracked = event_loop.run_until_complete(sweeps(count, size, **kwargs))
+    finally:
+        tracemalloc.stop()
+    print('baseline=%.1fMB growth=%.1fKB peak=%.1fMB per 1k symbols' % (
+        baseline / 2 ** 20, (current - baseline) / 2 ** 10, peak / 2 ** 20 * 1000.0 / tracked))
+    assert current - baseline < max(baseline * 0.05, 2 ** 20)
+
+
+@pytest.mark.slow
+def test_sweeps_with_alert_checks_hold_memory_flat(event_loop):
+    assert_flat(event_loop, 100, 50)
+
+
+@pytest.mark.slow
+def test_sweeps_through_the_outbox_hold_memory_flat(event_loop, mongo):
+    from alert_outbox import AlertOutbox
+    assert_flat(event_loop, 100, 20, outbox=AlertOutbox(batch_size=1000), mongo=mongo)
@@ -0,0 +1,35 @@
+import time
+from fair_scheduler import FairScheduler
+from conftest import LocalScrapper
+from mock_data import MockData
+
+
+def test_reference_prices_prefer_cache_then_quotes():
+    mock = MockData(10, symbols=30)
+    cached, synthetic = mock.universe[0], mock.prices.copy()
+    scheduler = FairScheduler(LocalScrapper(mock.master, persist_history=False))
+    quoted = []
+
+    def report_quote(symbols):
+        quoted.extend(symbols)
+        return scheduler.report_quote('mock', symbols, limited=False)
+    found = mock.reference_prices({cached: (time.time(), '1,234.5 +1.5(+0.12%)')}, report_quote)
+    assert found == len(mock.universe)
+    assert mock.prices[0] == 1234.5 and cached not in quoted
+    assert all(mock.prices[1:] != synthetic[1:])
+    assert 1234.5 * 0.85 <= mock.threshold('sl', mock.prices[0]) < 1234.5
+
+
+def test_reference_prices_fall_back_to_synthetic_offline():
+    mock = MockData(10, symbols=30)
+    synthetic = mock.prices.copy()
+
+    async def offline(symbols):
+        raise OSError('network is unreachable')
+    assert mock.reference_prices(None, offline) == 0
+    assert all(mock.prices == synthetic)
+
+
+def test_default_prices_are_seeded():
+    assert all(MockData(10, seed=7, symbols=30).prices == MockData(10, seed=7, symbols=30).prices)
+    assert any(MockData(10, seed=7, symbols=30).prices != MockData(10, seed=8, symbols=30).prices)
@@ -0,0 +1,61 @@
+import asyncio
+import math
+from types import SimpleNamespace
+from portfolio import Portfolio
+from symbol_master import SymbolMaster
+
+LOTS = [{'symbol': '700', 'nickname': 'tencent', 'unit_price': 300.0, 'quantity': 100.0},
+        {'symbol': 'AAPL', 'nickname': 'AAPL', 'unit_price': 150.0, 'quantity': 10.0},
+        {'symbol': '700', 'nickname': 'tencent', 'unit_price': 330.0, 'quantity': 200.0}]
+
+
+def valuation(lots, quotes, symbol=None):
+    requested = []
+
+    async def report_quote(symbols):
+        requested.extend(symbols)
+        return [{x: quotes.get(x, 'Not available')} for x in symbols]
+    portfolio = Portfolio(SimpleNamespace(symbol_master=SymbolMaster()), base_currency='HKD')
+    value = asyncio.get_event_loop().run_until_complete(
+        portfolio.valuation(None, symbol, report_quote=report_quote, lots=lots))
+    return value, requested
+
+
+def test_aggregate_averages_lots():
+    symbols, nicknames, quantity, unit_cost = Portfolio.aggregate(LOTS)
+    assert symbols == ['700', 'AAPL'] and nicknames == ['tencent', 'AAPL']
+    assert list(quantity) == [300, 10]
+    assert list(unit_cost) == [320, 150]
+
+
+def test_aggregate_closed_position_has_no_unit_cost():
+    symbols, nicknames, quantity, unit_cost = Portfolio.aggregate(
+        [{'symbol': '5', 'nickname': '5', 'unit_price': 60.0, 'quantity': 400.0},
+         {'symbol': '5', 'nickname': '5', 'unit_price': 65.0, 'quantity': -400.0}])
+    assert quantity[0] == 0 and math.isnan(unit_cost[0])
+
+
+def test_valuation_converts_to_base_currency():
+    value, requested = valuation(LOTS, {'700': '350.00, +1.00(+0.29%)', 'AAPL': '$200.00, +1.00(+0.50%)',
+                                        'USD/HKD': '7.8000'})
+    assert requested == ['700', 'AAPL', 'USD/HKD']
+    # 700: 300 @ 320 -> 350 is 105000 HKD, P&L 9000. AAPL: 10 @ 150 -> 200 at 7.8 is 15600 HKD, P&L 3900.
+    assert list(value['market_value']) == [105000, 15600]
+    assert list(value['pnl']) == [9000, 3900]
+    assert [round(x, 4) for x in value['percent']] == [9.375, 33.3333]
+    assert value['total'] == 120600 and value['total_pnl'] == 12900
+    assert [round(x, 2) for x in value['weight']] == [87.06, 12.94]
+
+
+def test_unavailable_quotes_are_left_out_of_totals():
+    value, requested = valuation(LOTS, {'700': '350.00', 'USD/HKD': '7.8000'})
+    assert math.isnan(value['price'][1]) and math.isnan(value['pnl'][1]) and math.isnan(value['weight'][1])
+    assert value['total'] == 105000 and value['total_pnl'] == 9000
+    assert round(value['weight'][0], 2) == 100
+
+
+def test_valuation_of_one_symbol_by_nickname():
+    value, requested = valuation(LOTS, {'700': '1,000.00'}, symbol='tencent')
+    assert requested == ['700'] and value['symbol'] == ['700']
+    assert value['total_pnl'] == 300 * (1000 - 320)
+    assert valuation(LOTS, {}, symbol='unknown')[0] is None
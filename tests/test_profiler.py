@@ -0,0 +1,41 @@
+import time
+import pytest
+from profiler import ProfileControl
+
+
+def spin(seconds):
+    end = time.time() + seconds
+    while time.time() < end:
+        pass
+
+
+def test_sections_are_sampled_without_the_idle_time_between_them(workdir):
+    control = ProfileControl(output_dir=str(workdir / 'profiles'), interval=0.001, targets=('sweep',))
+    results = []
+    control.request('sweep', 2, callback=lambda path, summary: results.append((path, summary)))
+    for _ in range(2):
+        with control.section('sweep'):
+            spin(0.1)
+        time.sleep(0.3)
+    with control.section('sweep'):
+        spin(0.01)
+    (path, summary), = results
+    lines = summary.split('\n')
+    samples, seconds = lines[0].split(' samples over ')
+    assert 0.15 < float(seconds[:-1]) < 0.4
+    assert lines[1] == 'self%  total%  function'
+    assert 'spin (test_profiler.py' in lines[2]
+    folded = open(path + '.folded').read().splitlines()
+    assert sum(int(x.rsplit(' ', 1)[1]) for x in folded) == int(samples)
+    assert all(';' in x.rsplit(' ', 1)[0] for x in folded)
+    # Nearly all samples are inside spin; the sleeps between sections would be sampled in the test itself.
+    in_spin = sum(int(x.rsplit(' ', 1)[1]) for x in folded if 'spin (' in x)
+    assert in_spin >= 0.9 * int(samples)
+    assert control.active == {} and control.pending == {}
+
+
+def test_unknown_targets_are_rejected():
+    control = ProfileControl(targets=('sweep',))
+    with pytest.raises(ValueError):
+        control.request('swep', 1)
+    assert control.pending == {}
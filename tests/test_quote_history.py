@@ -0,0 +1,38 @@
+from types import SimpleNamespace
+from quote_history import QuoteHistory, parse_price
+
+
+def test_parse_price():
+    assert parse_price('12.34,+0.5(+4.2%)') == 12.34
+    assert parse_price('388.2,-1.80') == 388.2
+    assert parse_price('1.0842') == 1.0842
+    assert parse_price('Not available') is None
+    assert parse_price(None) is None
+
+
+def test_parse_price_thousands_separator():
+    assert parse_price('1,234.56,+12.1(+0.99%)') == 1234.56
+    assert parse_price('2,345,678.9,-1(-0.1%)') == 2345678.9
+    assert parse_price('$1,234.56') == 1234.56
+
+
+def test_record_keeps_large_prices():
+    history = QuoteHistory(persist=False)
+    history.record({'AMZN': '3,102.50,+5.1(+0.2%)'}, timestamp=60)
+    times, prices = history.ticks['AMZN'].data()
+    assert list(prices) == [3102.5]
+
+
+def test_persistence_is_downsampled_to_the_resolution(monkeypatch):
+    import quote_history
+    written = []
+
+    class QuoteTick(SimpleNamespace):
+        objects = SimpleNamespace(insert=lambda records, load_bulk: written.extend(records))
+    monkeypatch.setattr(quote_history, 'QuoteTick', QuoteTick)
+    history = QuoteHistory(persist=True)
+    for second in range(0, 180):
+        history.record({'700': '%.2f' % (300 + second / 100.0)}, timestamp=6000 + second)
+    # Three one-minute slots: the first two are complete and written once each with their last tick.
+    assert [(x.time.second, x.price) for x in written] == [(59, 300.59), (59, 301.19)]
+    assert len(history.ticks['700'].data()[0]) == 3
@@ -0,0 +1,111 @@
+import asyncio
+import json
+import aiohttp
+import pytest
+from aiohttp import web
+from alert_checks import AlertChecks
+from conftest import LocalScrapper
+from mock_stream import make_app, recorded_ticks
+from quote_bus import QuoteBus
+from quote_history import parse_change, parse_price
+from quote_stream import QuoteStream
+from symbol_master import SymbolMaster
+
+
+def replay(path, count, polled=None):
+    scrapper = LocalScrapper(SymbolMaster(), persist_history=False)
+    for symbol, quote in (polled or {}).items():
+        scrapper.record_quotes([{symbol: quote}])
+    bus = QuoteBus()
+    subscription = bus.subscribe()
+    stream = QuoteStream('ws://localhost/ticks', bus, scrapper)
+    source = recorded_ticks(str(path))
+    for _ in range(count):
+        stream.handle(json.dumps([next(source)]))
+    return stream, subscription
+
+
+def write_ticks(path, ticks):
+    path.write_text('\n'.join(json.dumps(x) for x in ticks))
+    return path
+
+
+def test_parse_change():
+    assert parse_change('330.2,+3.2(+0.98%)') == 3.2
+    assert parse_change('1,234.56,-12.10(-0.97%)') == -12.1
+    assert parse_change('1.0842') is None
+
+
+def test_stream_derives_change_from_polled_close(workdir):
+    path = write_ticks(workdir / 'ticks.jsonl', [{'symbol': '700', 'price': 330.0}, {'symbol': '700', 'price': 345.5}])
+    stream, subscription = replay(path, 2, polled={'700': '320.0,+20.0(+6.67%)'})
+    symbol, (timestamp, quote) = subscription.drain()[-1]
+    assert (symbol, quote) == ('700', '345.5,+45.50(+15.17%)')
+    assert parse_price(quote) - parse_change(quote) == pytest.approx(300.0)
+
+
+def test_stream_uses_prev_close_from_tick(workdir):
+    path = write_ticks(workdir / 'ticks.jsonl', [{'symbol': 'AAPL', 'price': 1100.25, 'prev_close': 1000}])
+    stream, subscription = replay(path, 1)
+    assert subscription.drain()[-1][1][1] == '1100.25,+100.25(+10.03%)'
+
+
+def test_mock_stream_ticks_reach_alert_evaluation(workdir):
+    ticks = [{'symbol': '700', 'price': 300.0 + x} for x in range(10)] + [{'symbol': 'AAPL', 'price': 99.0}]
+    path = write_ticks(workdir / 'ticks.jsonl', ticks)
+    stream, subscription = replay(path, len(ticks), polled={'700': '300.0,+0.0(+0.00%)'})
+    latest = {symbol: quote for symbol, (timestamp, quote) in subscription.drain()}
+    alerts = [{'id': 1, 'symbol': '700', 'type': 'priceChange', 'threshold': 0.02},
+              {'id': 2, 'symbol': '700', 'type': 'tp', 'threshold': 305},
+              {'id': 3, 'symbol': 'AAPL', 'type': 'priceChange', 'threshold': 0.01},
+              {'id': 4, 'symbol': 'AAPL', 'type': 'sl', 'threshold': 100}]
+    triggered = {x['id'] for x, content in AlertChecks().evaluate(alerts, latest)}
+    # 700 is up 3% on its polled close; AAPL has no close yet, so only its price checks can fire.
+    assert triggered == {1, 2, 4}
+
+
+def test_local_websocket_at_high_rate_is_coalesced_in_order(workdir):
+    symbols = ['700', '5', 'AAPL', 'NVDA', 'EUR/USD']
+
+    def counting_ticks():
+        sequence = 0
+        while True:
+            sequence += 1
+            yield {'symbol': symbols[sequence % len(symbols)], 'price': sequence}
+
+    async def run():
+        runner = web.AppRunner(make_app(counting_ticks, 20000))
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        port = runner.addresses[0][1]
+        bus = QuoteBus()
+        subscription = bus.subscribe()
+        stream = QuoteStream('ws://127.0.0.1:%d/ticks' % port, bus, LocalScrapper(SymbolMaster(),
+                                                                                    persist_history=False))
+        seen, backlog = {}, []
+
+        async def slow_consumer():
+            while True:
+                symbol, (timestamp, quote) = await subscription.get()
+                seen.setdefault(symbol, []).append(int(quote))
+                backlog.append(len(subscription.pending))
+                await asyncio.sleep(0.005)
+        async with aiohttp.ClientSession() as session:
+            reader = asyncio.ensure_future(stream.read_websocket(session))
+            consumer = asyncio.ensure_future(slow_consumer())
+            await asyncio.sleep(1)
+            reader.cancel()
+            consumer.cancel()
+            await asyncio.gather(reader, consumer, return_exceptions=True)
+        await runner.cleanup()
+        return stream, seen, backlog
+
+    stream, seen, backlog = asyncio.get_event_loop().run_until_complete(run())
+    assert stream.received > 5000
+    # A slow consumer holds at most one pending tick per symbol and sees each symbol's ticks in order.
+    assert max(backlog) <= len(symbols)
+    assert sum(len(x) for x in seen.values()) < stream.received / 10
+    assert sorted(seen) == sorted(symbols)
+    assert all(x == sorted(set(x)) for x in seen.values())
+    assert sorted(int(x) for x in stream.buffer.values())[-1] > max(max(x) for x in seen.values()) - 100
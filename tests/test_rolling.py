@@ -0,0 +1,41 @@
+from bson import ObjectId
+from alert_cache import AlertCache
+from db import NotificationSetting
+from rolling import RollingEngine
+
+
+def stored_alert(kind, threshold, window=5):
+    # The setting goes through the model's storage format and the alert cache, as the sweep sees it.
+    user, stock = ObjectId(), ObjectId()
+    setting = NotificationSetting(id=ObjectId(), createdBy=user, stock=stock, type=kind, threshold=threshold,
+                                  window=window, enabled=True).to_mongo().to_dict()
+    cache = AlertCache()
+    cache.users = {user: 42}
+    cache.user_settings = {ObjectId(): {'createdBy': user, 'notificationEnable': True}}
+    cache.stocks = {stock: {'symbol': '700'}}
+    cache.notifications = {setting['_id']: setting}
+    return cache.snapshot()
+
+
+def test_small_thresholds_survive_storage():
+    assert stored_alert('move', 0.001)[0]['threshold'] == 0.001
+
+
+def test_move_fires_and_rearms():
+    alerts = stored_alert('move', 0.001)
+    engine = RollingEngine()
+    engine.sync(alerts)
+    for i in range(5):
+        engine.update('700', i, 100.0)
+    assert engine.evaluate(alerts[0], 100.0) == (None, False)
+    engine.update('700', 5, 100.2)
+    content, rearmed = engine.evaluate(alerts[0], 100.2)
+    assert content.startswith('700 moved 0.20%') and not rearmed
+    assert engine.evaluate(alerts[0], 100.2) == (None, False)
+    # Once the earlier ticks leave the window the range is flat again: the alert re-arms, then fires again.
+    for i in range(400, 405):
+        engine.update('700', i, 100.2)
+    assert engine.evaluate(alerts[0], 100.2) == (None, True)
+    engine.update('700', 405, 100.0)
+    content, rearmed = engine.evaluate(alerts[0], 100.0)
+    assert content.startswith('700 moved 0.20%') and not rearmed
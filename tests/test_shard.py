@@ -0,0 +1,98 @@
+import os
+import signal
+import subprocess
+import sys
+import time
+import pytest
+from shard import SweepShard
+
+SYMBOLS = [str(x) for x in range(1, 3001)] + ['AAPL', 'MSFT', 'USD/HKD']
+ROOT = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+
+def shard(worker_id, workers):
+    instance = SweepShard(worker_id)
+    instance.rebalance(workers)
+    return instance
+
+
+def test_owner_is_stable_across_instances():
+    workers = ['a', 'b', 'c']
+    first, second = shard('a', workers), shard('c', list(reversed(workers)))
+    assert first.ring == second.ring
+    assert [first.owner(x) for x in SYMBOLS] == [second.owner(x) for x in SYMBOLS]
+
+
+def test_ring_spreads_symbols():
+    ring = shard('a', ['a', 'b', 'c'])
+    counts = {x: sum(ring.owner(y) == x for y in SYMBOLS) for x in ['a', 'b', 'c']}
+    assert all(len(SYMBOLS) * 0.15 < x < len(SYMBOLS) * 0.55 for x in counts.values())
+
+
+def test_membership_change_only_moves_affected_symbols():
+    before = shard('a', ['a', 'b', 'c'])
+    owners = {x: before.owner(x) for x in SYMBOLS}
+    joined = shard('a', ['a', 'b', 'c', 'd'])
+    moved = [x for x in SYMBOLS if joined.owner(x) != owners[x]]
+    assert all(joined.owner(x) == 'd' for x in moved)
+    assert 0 < len(moved) < len(SYMBOLS) * 0.4
+    left = shard('a', ['a', 'b'])
+    assert all(left.owner(x) == owners[x] for x in SYMBOLS if owners[x] != 'c')
+
+
+def partition(workers):
+    owned = {}
+    for worker in workers:
+        ring = shard(worker['workerId'], worker['members'])
+        owned[worker['workerId']] = {x for x in SYMBOLS if ring.owns(x)}
+    return owned
+
+
+def wait_for(condition, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        result = condition()
+        if result:
+            return result
+        time.sleep(0.2)
+    return condition()
+
+
+def test_sweep_only_workers_partition_and_rebalance(mongo, workdir):
+    pytest.importorskip('telegram')
+    lease, count = 3, 3
+    env = dict(os.environ, SWEEP_ONLY='1', SWEEP_SHARDING='1', SWEEP_LEASE=str(lease),
+               TELEGRAM_TOKEN=os.environ.get('TELEGRAM_TOKEN', '123456:test'),
+               SNAPSHOT_PATH=str(workdir / 'snapshot'), PYTHONPATH=ROOT)
+    workers = [subprocess.Popen([sys.executable, os.path.join(ROOT, 'telegram_bot.py')],
+                                env=dict(env, SWEEP_WORKER_ID='worker-%d' % i), cwd=str(workdir))
+               for i in range(count)]
+    try:
+        def converged(expected):
+            live = [x for x in mongo.sweepworkers.find({'workerId': {'$in': expected}})
+                    if sorted(x.get('members', [])) == expected]
+            return live if len(live) == len(expected) else None
+
+        expected = ['worker-%d' % i for i in range(count)]
+        live = wait_for(lambda: converged(expected), 4 * lease + 10)
+        assert live is not None, 'workers did not agree on membership'
+        owned = partition(live)
+        assert set().union(*owned.values()) == set(SYMBOLS)
+        assert sum(len(x) for x in owned.values()) == len(SYMBOLS)
+
+        workers[0].send_signal(signal.SIGKILL)
+        workers[0].wait()
+        killed = time.time()
+        expected = expected[1:]
+        live = wait_for(lambda: converged(expected), 2 * lease + 2)
+        assert live is not None, 'survivors did not drop the killed worker'
+        # The dead heartbeat expires within one lease, survivors see it on their next beat and publish on the one after.
+        assert time.time() - killed < lease + 2 * lease / 3.0 + 1
+        owned = partition(live)
+        assert set().union(*owned.values()) == set(SYMBOLS)
+        assert sum(len(x) for x in owned.values()) == len(SYMBOLS)
+    finally:
+        for worker in workers:
+            if worker.poll() is None:
+                worker.terminate()
+                worker.wait(10)
@@ -0,0 +1,51 @@
+import time
+from bson import ObjectId
+from alert_cache import AlertCache
+from conftest import LocalScrapper
+from rolling import RollingEngine
+from snapshot import Snapshot
+from symbol_index import SymbolIndex
+from symbol_master import SymbolMaster
+
+
+def components():
+    master = SymbolMaster()
+    scrapper = LocalScrapper(master, persist_history=False)
+    return scrapper, AlertCache(), SymbolIndex(master, quote_cache=scrapper.quote_cache), RollingEngine()
+
+
+def test_state_round_trips_through_the_file(workdir):
+    scrapper, alert_cache, symbol_index, rolling = components()
+    now = time.time()
+    scrapper.quote_cache['700'] = (now, '330.00,+3.20(+0.98%)')
+    scrapper.quote_cache['5'] = (now - 3600, '60.00')
+    scrapper.forex_engine.update([{'symbol': 'USDHKD', 'price': 7.8}])
+    user, stock, notification = ObjectId(), ObjectId(), ObjectId()
+    alert_cache.users = {user: 42}
+    alert_cache.user_settings = {ObjectId(): {'createdBy': user, 'notificationEnable': True}}
+    alert_cache.stocks = {stock: {'symbol': '700'}}
+    alert_cache.notifications = {notification: {'_id': notification, 'createdBy': user, 'stock': stock,
+                                                'type': 'move', 'threshold': 0.01, 'window': 5, 'enabled': True}}
+    symbol_index.nicknames[42] = [('tencent', '700')]
+    rolling.state[notification] = {'armed': False, 'side': 0}
+    snapshot = Snapshot(path=str(workdir / 'state.snapshot'), interval=60)
+    assert snapshot.save(snapshot.capture(scrapper, alert_cache, symbol_index, rolling)) > 0
+
+    scrapper, alert_cache, symbol_index, rolling = components()
+    warm = snapshot.restore(snapshot.load(), scrapper, alert_cache, symbol_index, rolling)
+    assert warm == {'700': '330.00,+3.20(+0.98%)'}
+    assert scrapper.quote_cache['5'] == (now - 3600, '60.00')
+    assert scrapper.forex_engine.usd['HKD'] == 1 / 7.8 and scrapper.forex_engine.age < 60
+    assert [(x['user_id'], x['symbol'], x['type']) for x in alert_cache.snapshot()] == [(42, '700', 'move')]
+    assert symbol_index.is_known('tencent', 42)
+    assert rolling.state == {notification: {'armed': False, 'side': 0}}
+
+
+def test_missing_or_corrupt_snapshot_is_a_cold_start(workdir):
+    snapshot = Snapshot(path=str(workdir / 'state.snapshot'))
+    assert snapshot.load() is None
+    (workdir / 'state.snapshot').write_bytes(b'not a snapshot')
+    assert snapshot.load() is None
+    snapshot.save({'quote_cache': {}})
+    snapshot.version += 1
+    assert snapshot.load() is None
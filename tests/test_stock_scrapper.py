@@ -0,0 +1,84 @@
+import asyncio
+from aiohttp import web
+from conftest import HK_PAGE, PADDING
+from stock_scrapper import StockScrapper
+from symbol_master import SymbolMaster
+
+# Other cell_last cells come before the quote, so a marker on the bare class would stop the read too early.
+DECOY = '<table class="summary"><tr><td class="cell_last">Turnover</td><td class="right cell_last">1.2B</td>' \
+        '</tr></table>%s' % ('<p>%s</p>' % ('y' * 12000))
+
+
+def serve(requests, page, etag=None, compress=False):
+    async def quote(request):
+        requests.append(request.headers)
+        if etag is not None and request.headers.get('If-None-Match') == etag:
+            return web.Response(status=304)
+        response = web.StreamResponse(headers={'ETag': etag} if etag is not None else {})
+        if compress:
+            response.enable_compression()
+        await response.prepare(request)
+        body = page.encode('utf-8')
+        try:
+            for i in range(0, len(body), 4096):
+                await response.write(body[i:i + 4096])
+        except ConnectionResetError:
+            pass
+        return response
+    app = web.Application()
+    app.router.add_get('/quote', quote)
+    return app
+
+
+def scrape(page, count=1, **kwargs):
+    requests = []
+
+    async def run():
+        runner = web.AppRunner(serve(requests, page, **kwargs))
+        await runner.setup()
+        site = web.TCPSite(runner, '127.0.0.1', 0)
+        await site.start()
+        scrapper = StockScrapper(SymbolMaster(), persist_history=False)
+        scrapper.hk_stock_url = 'http://127.0.0.1:%d/quote?symbol=' % runner.addresses[0][1]
+        quotes = []
+        for _ in range(count):
+            quotes.append((await scrapper.hk_stock_scrapper('700'))['700'])
+        await scrapper.session().close()
+        await runner.cleanup()
+        return scrapper, quotes
+
+    scrapper, quotes = asyncio.get_event_loop().run_until_complete(run())
+    return scrapper, quotes, requests
+
+
+def test_capped_read_stops_after_the_parsed_cell(workdir):
+    page = DECOY + HK_PAGE % (412.6, PADDING * 10)
+    scrapper, quotes, requests = scrape(page)
+    assert quotes == ['412.600,+0.20(+0.50%)']
+    assert scrapper.transfer['requests'] == 1
+    assert scrapper.transfer['bytes'] < len(page) / 10
+
+
+def test_cell_past_the_cap_is_read_uncapped(workdir):
+    page = DECOY + HK_PAGE % (412.6, '') + PADDING * 5
+    page = page.replace('<table class="quote_table">', PADDING * 4 + '<table class="quote_table">')
+    scrapper, quotes, requests = scrape(page)
+    assert quotes == ['412.600,+0.20(+0.50%)']
+    assert scrapper.transfer['requests'] == 2
+    assert scrapper.transfer['uncapped'] == 1
+
+
+def test_not_modified_reuses_the_last_quote(workdir):
+    scrapper, quotes, requests = scrape(HK_PAGE % (412.6, PADDING), count=2, etag='"v1"')
+    assert quotes == ['412.600,+0.20(+0.50%)'] * 2
+    assert requests[1]['If-None-Match'] == '"v1"'
+    assert scrapper.transfer['not_modified'] == 1
+    assert scrapper.transfer['requests'] == 2
+
+
+def test_compressed_page_is_decoded_before_the_cap(workdir):
+    page = DECOY + HK_PAGE % (412.6, PADDING * 10)
+    scrapper, quotes, requests = scrape(page, compress=True)
+    assert 'gzip' in requests[0]['Accept-Encoding']
+    assert quotes == ['412.600,+0.20(+0.50%)']
+    assert scrapper.transfer['bytes'] < len(page) / 10
@@ -0,0 +1,26 @@
+import asyncio
+from supervisor import Supervisor
+
+
+def test_failed_tasks_restart_without_stopping_the_others():
+    supervisor = Supervisor(delay=0.01)
+    runs = {'flaky': 0, 'steady': 0}
+
+    async def flaky():
+        runs['flaky'] += 1
+        if runs['flaky'] < 3:
+            raise IndexError('truncated page')
+        await asyncio.sleep(10)
+
+    async def steady():
+        while True:
+            runs['steady'] += 1
+            await asyncio.sleep(0.01)
+
+    async def main():
+        task = asyncio.ensure_future(supervisor.run([('flaky', flaky), ('steady', steady)]))
+        await asyncio.sleep(0.2)
+        task.cancel()
+    asyncio.get_event_loop().run_until_complete(main())
+    assert runs['flaky'] == 3 and supervisor.restarts == {'flaky': 2}
+    assert runs['steady'] > 5
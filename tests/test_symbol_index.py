@@ -0,0 +1,57 @@
+import asyncio
+import csv
+import time
+from conftest import LocalScrapper
+from symbol_index import SymbolIndex
+from symbol_master import SymbolMaster
+
+OFF_FILE = ['IBM', '1177', '0700', 'HKD/GBP']
+
+
+def test_only_listed_cached_or_own_symbols_are_known():
+    master = SymbolMaster()
+    cache = {}
+    index = SymbolIndex(master, quote_cache=cache)
+    index.nicknames[42] = [('tencent', '700'), ('', 'IBM')]
+    assert index.is_known('700') and index.is_known('aapl')
+    for symbol in OFF_FILE + ['APPL', 'APPLE', 'not a symbol']:
+        assert symbol in master or symbol == 'not a symbol'
+        assert not index.is_known(symbol)
+    assert index.is_known('IBM', 42) and index.is_known('tencent', 42)
+    cache['1177'] = (time.time(), '10.00')
+    assert index.is_known('1177')
+
+
+def test_typos_get_suggestions():
+    index = SymbolIndex(SymbolMaster())
+    assert index.suggest('APPL')[0] == 'AAPL'
+    assert index.suggest('apple')[0] == 'AAPL'
+    assert index.suggest('???') == []
+
+
+def test_off_file_symbols_are_quoted():
+    master = SymbolMaster()
+    scrapper = LocalScrapper(master, persist_history=False)
+    quotes = asyncio.new_event_loop().run_until_complete(scrapper.report_quote(OFF_FILE))
+    quotes = {k: v for x in quotes for k, v in x.items()}
+    assert sorted(quotes) == sorted(OFF_FILE)
+    assert all('Not available' not in x for x in quotes.values())
+
+
+def test_inline_search_fits_the_budget_on_a_warm_index(tmp_path):
+    path = tmp_path / 'symbol_master.csv'
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['symbol', 'name', 'market', 'currency', 'lot_size', 'calendar', 'provider'])
+        for i in range(1, 20001):
+            writer.writerow([i, 'Company %d Holdings' % i, 'hk', 'HKD', 100, 'HKEX', 'aastocks'])
+    index = SymbolIndex(SymbolMaster(path=str(path)))
+    index.nicknames[42] = [('nick%d' % i, str(i)) for i in range(200)]
+    queries = ['1', '12', '123', '1234', 'comp', 'company 9', 'hold', 'nick1', 'zzz'] * 20
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        index.search(query, 42)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    assert timings[int(len(timings) * 0.95)] < 0.01
@@ -0,0 +1,20 @@
+from forex_engine import ForexEngine
+from symbol_master import SymbolMaster
+
+
+def test_file_and_derived_symbols_are_contained():
+    master = SymbolMaster()
+    assert '700' in master
+    assert master.get('HKD/GBP') is None
+    assert 'HKD/GBP' in master
+    assert 'ibm' in master
+    assert 'not a symbol' not in master
+    assert master.market('HKD/GBP') == 'forex'
+    assert master.resolve('HKD/GBP').provider == '1forge'
+
+
+def test_cross_outside_the_file_reaches_the_forex_engine():
+    engine = ForexEngine(scrapper=None)
+    engine.update([{'symbol': 'USDHKD', 'price': 7.8}, {'symbol': 'GBPUSD', 'price': 1.25}])
+    rate, = engine.derive(['HKD/GBP'])
+    assert abs(rate - 1 / 7.8 / 1.25) < 1e-9
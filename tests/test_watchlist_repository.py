@@ -0,0 +1,42 @@
+import threading
+from bson import ObjectId
+from watchlist_repository import WatchlistRepository
+
+
+def run_concurrently(targets):
+    threads = [threading.Thread(target=x) for x in targets]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def test_concurrent_adds_and_removes_do_not_lose_symbols(mongo):
+    user, watchlists = ObjectId(), WatchlistRepository()
+    symbols = [str(x) for x in range(1, 81)]
+    # Every thread also re-adds a symbol another one adds, which add_to_set keeps unique.
+    run_concurrently([lambda i=i: watchlists.add(user, symbols[i::8] + [symbols[(i + 1) % 8]], 'trading')
+                      for i in range(8)])
+    assert sorted(watchlists.symbols(user, 'trading'), key=int) == symbols
+    run_concurrently([lambda i=i: watchlists.remove(user, symbols[i:40:4], 'trading') for i in range(4)])
+    assert sorted(watchlists.symbols(user, 'trading'), key=int) == symbols[40:]
+    assert watchlists.names(user) == ['trading']
+
+
+def test_pages_slice_the_watchlist(mongo):
+    user, watchlists = ObjectId(), WatchlistRepository(page_size=20)
+    symbols = [str(x) for x in range(1, 46)]
+    watchlists.add(user, symbols)
+    assert watchlists.page(user) == (symbols[:20], 3)
+    assert watchlists.page(user, page=3) == (symbols[40:], 3)
+    assert watchlists.page(user, page=4) == ([], 3)
+    assert watchlists.page(user, 'missing') == ([], 0)
+
+
+def test_migration_names_legacy_watchlists(mongo):
+    user = ObjectId()
+    mongo.watchlists.insert_one({'createdBy': user, 'stockSymbols': ['700']})
+    watchlists = WatchlistRepository()
+    assert watchlists.symbols(user) == []
+    assert watchlists.migrate() == 1
+    assert watchlists.symbols(user) == ['700']
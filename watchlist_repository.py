@@ -0,0 +1,49 @@
+from db import *
+
+
+class WatchlistRepository(object):
+
+    default_name = 'default'
+
+    def __init__(self, page_size=20):
+        self.page_size = page_size
+
+    def migrate(self):
+        # Watchlists created before named watchlists existed become the default one.
+        return Watchlist.objects(name__exists=False).update(name=self.default_name)
+
+    def add(self, user, symbols, name=None):
+        Watchlist.objects(createdBy=user, name=name or self.default_name).update_one(
+            add_to_set__stockSymbols=symbols, upsert=True)
+
+    def remove(self, user, symbols, name=None):
+        Watchlist.objects(createdBy=user, name=name or self.default_name).update_one(
+            pull_all__stockSymbols=symbols)
+
+    def symbols(self, user, name=None):
+        watchlist = Watchlist.objects(createdBy=user, name=name or self.default_name).only('stockSymbols').first()
+        return list(watchlist.stockSymbols) if watchlist is not None else []
+
+    def names(self, user):
+        return sorted(Watchlist.objects(createdBy=user).distinct('name'))
+
+    def page(self, user, name=None, page=1):
+        skip = (max(page, 1) - 1) * self.page_size
+        result = list(Watchlist._get_collection().aggregate([
+            {'$match': {'createdBy': user, 'name': name or self.default_name}},
+            {'$project': {'count': {'$size': {'$ifNull': ['$stockSymbols', []]}},
+                          'symbols': {'$slice': [{'$ifNull': ['$stockSymbols', []]}, skip, self.page_size]}}}
+        ]))
+        if len(result) == 0:
+            return [], 0
+        pages = (result[0]['count'] + self.page_size - 1) // self.page_size
+        return result[0]['symbols'], pages
+
+
+def main():
+    # One-off migration for databases that predate named watchlists: python watchlist_repository.py
+    print('Named %d watchlists %s' % (WatchlistRepository().migrate(), WatchlistRepository.default_name))
+
+
+if __name__ == '__main__':
+    main()